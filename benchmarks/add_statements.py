@@ -0,0 +1,72 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compare the IR-build throughput of emitting N statements of the form
+  total += arr[i] * k;
+one call at a time against the bulk Context.new_array_accesses(),
+Context.new_binary_ops() and Block.add_statements() entrypoints.
+"""
+
+import sys
+import time
+
+import gccjit
+
+def make_context():
+    ctxt = gccjit.Context()
+    int_type = ctxt.get_type(gccjit.TypeKind.INT)
+    param_arr = ctxt.new_param(int_type.get_pointer(), b'arr')
+    fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                           int_type, b'f', [param_arr])
+    total = fn.new_local(int_type, b'total')
+    block = fn.new_block(b'entry')
+    consts = [ctxt.new_rvalue_from_int(int_type, i) for i in range(1000)]
+    return ctxt, int_type, param_arr, total, block, consts
+
+def build_per_call(n):
+    ctxt, int_type, param_arr, total, block, consts = make_context()
+    PLUS, MULT = gccjit.BinaryOp.PLUS, gccjit.BinaryOp.MULT
+    for i in range(n):
+        k = consts[i % 1000]
+        element = ctxt.new_array_access(param_arr, k)
+        block.add_assignment_op(total, PLUS,
+                                ctxt.new_binary_op(MULT, int_type, element, k))
+
+def build_bulk(n):
+    ctxt, int_type, param_arr, total, block, consts = make_context()
+    PLUS, MULT = gccjit.BinaryOp.PLUS, gccjit.BinaryOp.MULT
+    ASSIGN_OP = gccjit.StatementKind.ASSIGN_OP
+    ks = [consts[i % 1000] for i in range(n)]
+    elements = ctxt.new_array_accesses([(param_arr, k) for k in ks])
+    products = ctxt.new_binary_ops([(MULT, int_type, element, k)
+                                    for element, k in zip(elements, ks)])
+    block.add_statements([(ASSIGN_OP, total, PLUS, product)
+                          for product in products])
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000000
+    print('%i statements' % n)
+    for desc, fn in (('one call at a time', build_per_call),
+                     ('bulk', build_bulk)):
+        start = time.perf_counter()
+        fn(n)
+        elapsed = time.perf_counter() - start
+        print('%s: %.3fs (%.0f statements/s)' % (desc, elapsed, n / elapsed))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,117 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compare parsing, compiling and running a generated bf program with and
+without the optimizing front end of examples/bf.py, and the throughput
+of its streaming tokenizer against reading the whole file and looping
+over it a character at a time.
+"""
+
+from functools import partial
+import os
+import sys
+import tempfile
+import time
+
+import gccjit
+from examples import bf
+
+def make_program(n):
+    """
+    Make a bf program with n blocks, each of which uses the idioms the
+    optimizer recognizes: runs of +/-, clear loops, and copy/multiply
+    loops.
+    """
+    block = ('+' * 37 + '[->++>+++<<]' + '>' * 2 + '[-]' + '<' * 2
+             + '-' * 11 + '>[-<+>]<' + '[-]')
+    return block * n
+
+def bench(path, optimize, locations):
+    times = []
+    start = time.perf_counter()
+    c = bf.Compiler(optimize=optimize, locations=locations)
+    c.parse_into_ctxt(path)
+    times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    result = c.ctxt.compile()
+    times.append(time.perf_counter() - start)
+
+    func = result.get_function(b"func", gccjit.TypeKind.VOID, [])
+    start = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - start)
+    return times
+
+def tokenize_whole_file(path):
+    """
+    Tokenize the file the way parse_into_ctxt used to: read it all, then
+    loop over it one character at a time.
+    """
+    tokens = []
+    line = 1
+    column = 0
+    with open(path) as f_in:
+        for ch in f_in.read():
+            if ch == '\n':
+                line += 1
+                column = 0
+                continue
+            if ch in '+-<>.,[]':
+                tokens.append((ch, line, column))
+            column += 1
+    return tokens
+
+def tokenize_streaming(path):
+    c = bf.Compiler()
+    c.line = 1
+    c.column = 0
+    with open(path) as f_in:
+        chunks = iter(partial(f_in.read, c.chunk_size), '')
+        return list(c.tokenize(chunks))
+
+def bench_parse(path):
+    megabytes = os.path.getsize(path) / (1024 * 1024)
+    for label, fn in (('whole file, per character', tokenize_whole_file),
+                      ('streaming', tokenize_streaming)):
+        start = time.perf_counter()
+        fn(path)
+        elapsed = time.perf_counter() - start
+        print('tokenize (%s): %.1f MB/s' % (label, megabytes / elapsed))
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 2000
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.bf',
+                                     delete=False) as f:
+        f.write(make_program(n))
+    try:
+        print('%i bytes of bf' % os.path.getsize(f.name))
+        bench_parse(f.name)
+        print('%-28s %8s %8s %8s' % ('', 'parse', 'compile', 'run'))
+        for optimize, locations in ((False, True),
+                                    (True, True),
+                                    (True, False)):
+            times = bench(f.name.encode('utf-8'), optimize, locations)
+            label = '%s, %s' % ('optimized' if optimize else 'unoptimized',
+                                'locations' if locations else 'no locations')
+            print('%-28s %7.3fs %7.3fs %7.3fs' % ((label,) + tuple(times)))
+    finally:
+        os.unlink(f.name)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,48 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compare the per-call overhead of calling a trivial jitted function
+("square") via ctypes.CFUNCTYPE against gccjit.Result.get_function().
+"""
+
+import ctypes
+import sys
+import timeit
+
+import gccjit
+
+from examples.square import create_fn
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000000
+    result = create_fn()
+
+    int_int_func_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int)
+    via_ctypes = int_int_func_type(result.get_code(b"square"))
+    via_callable = result.get_function(b"square",
+                                       gccjit.TypeKind.INT,
+                                       [gccjit.TypeKind.INT])
+    assert via_ctypes(5) == via_callable(5) == 25
+
+    for desc, fn in (('ctypes', via_ctypes),
+                     ('get_function', via_callable)):
+        elapsed = timeit.timeit(lambda: fn(5), number=n)
+        print('%s: %.1fns per call' % (desc, elapsed / n * 1e9))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,66 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compare compiling N independent contexts serially against
+gccjit.compile_many() with various numbers of worker threads.
+"""
+
+import os
+import sys
+import time
+
+import gccjit
+
+from examples.sum_of_squares import populate_ctxt
+
+def make_contexts(n, opt_level):
+    contexts = []
+    for i in range(n):
+        ctxt = gccjit.Context()
+        ctxt.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL, opt_level)
+        populate_ctxt(ctxt)
+        contexts.append(ctxt)
+    return contexts
+
+def time_serial(n, opt_level):
+    contexts = make_contexts(n, opt_level)
+    start = time.perf_counter()
+    results = [ctxt.compile() for ctxt in contexts]
+    return time.perf_counter() - start
+
+def time_compile_many(n, opt_level, max_workers):
+    contexts = make_contexts(n, opt_level)
+    start = time.perf_counter()
+    results = gccjit.compile_many(contexts, max_workers=max_workers)
+    return time.perf_counter() - start
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 16
+    opt_level = int(argv[2]) if len(argv) > 2 else 2
+    serial = time_serial(n, opt_level)
+    print('%i contexts at -O%i' % (n, opt_level))
+    print('serial: %.3fs' % serial)
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        elapsed = time_compile_many(n, opt_level, workers)
+        print('compile_many(max_workers=%i): %.3fs (speedup %.2fx)'
+              % (workers, elapsed, serial / elapsed))
+        workers *= 2
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,58 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compare the IR-build time of the unoptimized front end of
+examples/bf.py, which makes a location per character, with debuginfo
+off: with locations created eagerly, with Context.set_lazy_locations,
+and without locations.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import gccjit
+from benchmarks.bf import make_program
+from examples import bf
+
+def bench(path, locations, lazy):
+    c = bf.Compiler(locations=locations)
+    c.ctxt.set_bool_option(gccjit.BoolOption.DEBUGINFO, False)
+    c.ctxt.set_lazy_locations(lazy)
+    start = time.perf_counter()
+    c.parse_into_ctxt(path)
+    return time.perf_counter() - start
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 2000
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.bf',
+                                     delete=False) as f:
+        f.write(make_program(n))
+    try:
+        print('%i bytes of bf, debuginfo off' % os.path.getsize(f.name))
+        for label, locations, lazy in (('eager locations', True, False),
+                                       ('lazy locations', True, True),
+                                       ('no locations', False, False)):
+            elapsed = bench(f.name.encode('utf-8'), locations, lazy)
+            print('%-16s %7.3fs' % (label, elapsed))
+    finally:
+        os.unlink(f.name)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,66 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compare squaring every element of an array by calling a jitted
+"int square(int)" once per element against a single Result.map() call
+over a loop generated by gccjit.make_map_function().
+"""
+
+from array import array
+import sys
+import time
+
+import gccjit
+
+def create_result():
+    ctxt = gccjit.Context()
+    ctxt.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL, 2)
+    int_type = ctxt.get_type(gccjit.TypeKind.INT)
+    param_i = ctxt.new_param(int_type, b'i')
+    fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                           int_type, b"square", [param_i])
+    fn.new_block(b'entry').end_with_return(
+        ctxt.new_binary_op(gccjit.BinaryOp.MULT, int_type, param_i, param_i))
+    gccjit.make_map_function(ctxt, fn, int_type, int_type, b"square_all")
+    return ctxt.compile()
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000000
+    result = create_result()
+    square = result.get_function(b"square",
+                                 gccjit.TypeKind.INT, [gccjit.TypeKind.INT])
+    data = array('i', range(n))
+    out = array('i', bytes(data.itemsize * n))
+
+    start = time.perf_counter()
+    for i in range(n):
+        out[i] = square(data[i])
+    per_element = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result.map(b"square_all", data, out)
+    mapped = time.perf_counter() - start
+
+    print('%i elements' % n)
+    print('per-element calls: %.3fs (%.1fns per element)'
+          % (per_element, per_element / n * 1e9))
+    print('Result.map: %.3fs (%.1fns per element)'
+          % (mapped, mapped / n * 1e9))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,73 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compare building N small jobs that each declare the same set of
+structs and imported functions against sharing those declarations via
+a gccjit.pool.ContextPool.
+"""
+
+import sys
+import time
+
+import gccjit
+from gccjit.pool import ContextPool
+
+NUM_DECLS = 200
+
+def populate(ctxt):
+    int_type = ctxt.get_type(gccjit.TypeKind.INT)
+    decls = {'int': int_type}
+    for i in range(NUM_DECLS):
+        fields = [ctxt.new_field(int_type, b'f%i' % j) for j in range(8)]
+        decls[b's%i' % i] = ctxt.new_struct(b's%i' % i, fields)
+        decls[b'fn%i' % i] = ctxt.new_function(
+            gccjit.FunctionKind.IMPORTED, int_type, b'fn%i' % i,
+            [ctxt.new_param(int_type, b'x')])
+    return decls
+
+def build(ctxt, decls):
+    int_type = decls['int']
+    param_x = ctxt.new_param(int_type, b'x')
+    fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                           int_type, b'job', [param_x])
+    fn.new_block().end_with_return(
+        ctxt.new_call(decls[b'fn0'], [param_x]))
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000
+
+    start = time.perf_counter()
+    for i in range(n):
+        with gccjit.Context() as ctxt:
+            build(ctxt, populate(ctxt))
+    unshared = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pool = ContextPool(populate)
+    for i in range(n):
+        with pool.child() as ctxt:
+            build(ctxt, pool.decls)
+    shared = time.perf_counter() - start
+
+    print('%i jobs, each using %i shared structs and functions' % (n, NUM_DECLS))
+    print('declaring per job: %.3fs' % unshared)
+    print('ContextPool: %.3fs' % shared)
+    print('ContextPool.get_stats(): %r' % pool.get_stats())
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,66 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compare the time taken to build N statements of the form
+  total += arr[i] * k;
+through the Python API, with and without recording, against the time
+taken to rebuild the same IR from the recording with Context.replay().
+"""
+
+import sys
+import time
+
+import gccjit
+
+def build(ctxt, n):
+    int_type = ctxt.get_type(gccjit.TypeKind.INT)
+    param_arr = ctxt.new_param(int_type.get_pointer(), b'arr')
+    fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                           int_type, b'f', [param_arr])
+    total = fn.new_local(int_type, b'total')
+    block = fn.new_block(b'entry')
+    PLUS, MULT = gccjit.BinaryOp.PLUS, gccjit.BinaryOp.MULT
+    for i in range(n):
+        k = ctxt.new_rvalue_from_int(int_type, i)
+        element = ctxt.new_array_access(param_arr, k)
+        block.add_assignment_op(total, PLUS,
+                                ctxt.new_binary_op(MULT, int_type, element, k))
+    block.end_with_return(total)
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    print('%i statements' % n)
+
+    start = time.perf_counter()
+    build(gccjit.Context(), n)
+    print('Python API: %.3fs' % (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    ctxt = gccjit.Context()
+    ctxt.start_recording()
+    build(ctxt, n)
+    recording = ctxt.get_recording()
+    print('Python API, recording: %.3fs (%i bytes recorded)'
+          % (time.perf_counter() - start, len(recording)))
+
+    start = time.perf_counter()
+    gccjit.Context().replay(recording)
+    print('replay: %.3fs' % (time.perf_counter() - start))
+
+if __name__ == '__main__':
+    main(sys.argv)
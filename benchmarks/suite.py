@@ -0,0 +1,245 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+A suite of benchmarks of the binding itself, writing its results as
+JSON so that runs can be compared across commits:
+
+  python -m benchmarks.suite -o before.json
+  ...
+  python -m benchmarks.suite -o after.json
+
+Each benchmark is timed several times and the fastest run is kept.
+"--quick" uses far fewer iterations, to check that the suite works
+(it is run that way by the test suite) rather than to get stable
+numbers.
+"""
+
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import gccjit
+
+from examples.square import create_fn
+
+def best_of(repeat, fn):
+    """Call fn() repeat times; return the shortest time taken."""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def make_sum_function(ctxt, num_terms):
+    """
+    Make a function with a long straight-line body:
+      int
+      sum (int x)
+      {
+        int total = 0;
+        total += x * 0;
+        total += x * 1;
+        ...
+        return total;
+      }
+    """
+    int_type = ctxt.get_type(gccjit.TypeKind.INT)
+    param_x = ctxt.new_param(int_type, b'x')
+    fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                           int_type, b'sum', [param_x])
+    total = fn.new_local(int_type, b'total')
+    block = fn.new_block(b'entry')
+    block.add_assignment(total, ctxt.zero(int_type))
+    for i in range(num_terms):
+        block.add_assignment_op(
+            total, gccjit.BinaryOp.PLUS,
+            ctxt.new_binary_op(gccjit.BinaryOp.MULT, int_type, param_x,
+                               ctxt.new_rvalue_from_int(int_type, i)))
+    block.end_with_return(total)
+    return fn
+
+def bench_object_creation(iterations, repeat):
+    """
+    Time creating wrapper objects for types, rvalues and params, each of
+    which goes through one of the *_from_c helpers.
+
+    Interned objects are avoided (by using fresh values each time), so
+    that this measures creating wrappers rather than looking them up.
+    """
+    ctxt = gccjit.Context()
+    int_type = ctxt.get_type(gccjit.TypeKind.INT)
+    one = ctxt.one(int_type)
+    # Ints above those interned by new_rvalue_from_int, and line
+    # numbers, distinct across every call in every repeat
+    values = itertools.count(2000)
+    results = {}
+    for name, fn in (
+            ('rvalue_get_type',
+             lambda: one.get_type()),
+            ('new_rvalue_from_int',
+             lambda: ctxt.new_rvalue_from_int(int_type, next(values))),
+            ('new_param',
+             lambda: ctxt.new_param(int_type, b'p')),
+            ('new_location',
+             lambda: ctxt.new_location(b'foo.c', next(values), 0))):
+        def loop():
+            for i in range(iterations):
+                fn()
+        results['object_creation.' + name] = (best_of(repeat, loop),
+                                              iterations)
+    return results
+
+def bench_ir_build(num_terms, repeat):
+    """
+    Time building a function with num_terms statements, one call at a
+    time and via the bulk entrypoints.
+    """
+    def build():
+        make_sum_function(gccjit.Context(), num_terms)
+    def build_bulk():
+        ctxt = gccjit.Context()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        param_x = ctxt.new_param(int_type, b'x')
+        fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                               int_type, b'sum', [param_x])
+        total = fn.new_local(int_type, b'total')
+        block = fn.new_block(b'entry')
+        products = ctxt.new_binary_ops(
+            [(gccjit.BinaryOp.MULT, int_type, param_x,
+              ctxt.new_rvalue_from_int(int_type, i))
+             for i in range(num_terms)])
+        block.add_statements(
+            [(gccjit.StatementKind.ASSIGN, total, ctxt.zero(int_type))]
+            + [(gccjit.StatementKind.ASSIGN_OP, total, gccjit.BinaryOp.PLUS, p)
+               for p in products])
+        block.end_with_return(total)
+    return {'ir_build.statements': (best_of(repeat, build), num_terms),
+            'ir_build.add_statements': (best_of(repeat, build_bulk),
+                                        num_terms)}
+
+def bench_compile(num_terms, repeat):
+    """Time compiling the same function at each optimization level."""
+    results = {}
+    for opt_level in range(4):
+        def build_and_compile():
+            ctxt = gccjit.Context()
+            ctxt.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL,
+                                opt_level)
+            make_sum_function(ctxt, num_terms)
+            ctxt.compile()
+        # Subtract the time taken to build the IR, so that only
+        # compilation is counted.
+        def build():
+            ctxt = gccjit.Context()
+            ctxt.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL,
+                                opt_level)
+            make_sum_function(ctxt, num_terms)
+        elapsed = best_of(repeat, build_and_compile) - best_of(repeat, build)
+        results['compile.O%i' % opt_level] = (max(elapsed, 0.0), 1)
+    return results
+
+def bench_get_code(iterations, repeat):
+    """Time looking up a function within a Result."""
+    result = create_fn()
+    def loop():
+        for i in range(iterations):
+            result.get_code(b'square')
+    return {'result.get_code': (best_of(repeat, loop), iterations)}
+
+def bench_call(iterations, repeat):
+    """Time calling a trivial function via ctypes and via a Callable."""
+    import ctypes
+    result = create_fn()
+    int_int_func_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int)
+    results = {}
+    for name, fn in (
+            ('ctypes',
+             int_int_func_type(result.get_code(b'square'))),
+            ('get_function',
+             result.get_function(b'square',
+                                 gccjit.TypeKind.INT,
+                                 [gccjit.TypeKind.INT]))):
+        def loop():
+            for i in range(iterations):
+                fn(5)
+        results['call.' + name] = (best_of(repeat, loop), iterations)
+    return results
+
+def get_commit():
+    """Get the git commit of the source tree, if there is one."""
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                      stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode('ascii').strip()
+
+def run(quick=False):
+    """
+    Run every benchmark, returning a JSON-serializable dict.  Each
+    benchmark is reported as its total time in seconds, the number of
+    iterations within that time, and the mean time per iteration in
+    nanoseconds.
+    """
+    if quick:
+        iterations, num_terms, repeat = 100, 50, 1
+    else:
+        iterations, num_terms, repeat = 100000, 5000, 5
+    raw = {}
+    raw.update(bench_object_creation(iterations, repeat))
+    raw.update(bench_ir_build(num_terms, repeat))
+    raw.update(bench_compile(num_terms // 10, repeat))
+    raw.update(bench_get_code(iterations, repeat))
+    raw.update(bench_call(iterations, repeat))
+
+    benchmarks = {}
+    for name, (seconds, count) in sorted(raw.items()):
+        benchmarks[name] = {'seconds': seconds,
+                            'iterations': count,
+                            'ns_per_iteration': seconds / count * 1e9}
+    return {'commit': get_commit(),
+            'python': platform.python_version(),
+            'libgccjit': gccjit.get_libgccjit_version(),
+            'quick': quick,
+            'benchmarks': benchmarks}
+
+def main(argv):
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-o", "--output", dest="outputfile",
+                      help="write JSON results to FILE", metavar="FILE")
+    parser.add_option("--quick", action="store_true",
+                      dest="quick", default=False,
+                      help="run far fewer iterations")
+    (options, args) = parser.parse_args(argv[1:])
+    results = run(quick=options.quick)
+    if options.outputfile:
+        with open(options.outputfile, 'w') as f_out:
+            json.dump(results, f_out, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,68 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compare time-to-first-call and steady-state throughput of the
+"loop_test" function from examples/sum_of_squares.py compiled at -O0,
+at -O3, and via gccjit.tiered.TieredFunction.
+"""
+
+import sys
+import time
+
+import gccjit
+from gccjit.tiered import TieredFunction
+
+from examples.sum_of_squares import populate_ctxt
+
+SIGNATURE = (b'loop_test', gccjit.TypeKind.INT, [gccjit.TypeKind.INT])
+
+def single_tier(level):
+    ctxt = gccjit.Context()
+    ctxt.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL, level)
+    populate_ctxt(ctxt)
+    return ctxt.compile().get_function(*SIGNATURE)
+
+def tiered(threshold):
+    ctxt = gccjit.Context()
+    populate_ctxt(ctxt)
+    return TieredFunction(ctxt, *SIGNATURE, threshold=threshold)
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    arg = 10000
+    print('%i calls of loop_test(%i)' % (n, arg))
+    for desc, make in (('-O0', lambda: single_tier(0)),
+                       ('-O3', lambda: single_tier(3)),
+                       ('tiered', lambda: tiered(threshold=100))):
+        start = time.perf_counter()
+        fn = make()
+        fn(arg)
+        first_call = time.perf_counter() - start
+
+        if isinstance(fn, TieredFunction):
+            # Measure the steady state, once the recompilation is done.
+            fn.wait()
+        start = time.perf_counter()
+        for i in range(n):
+            fn(arg)
+        steady = time.perf_counter() - start
+        print('%s: time to first call %.1fms, steady state %.1fus per call'
+              % (desc, first_call * 1e3, steady / n * 1e6))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -23,6 +23,8 @@ import gccjit
 
 import datetime
 from contextlib import contextmanager
+from functools import partial
+import re
 
 @contextmanager
 def timer(desc):
@@ -48,8 +50,85 @@ class CompileError(Exception):
         return ("%s:%i:%i: %s"
                 % (self.filename, self.line, self.column, self.msg))
 
+# Optimizing front end
+#
+# Rather than emitting statements for each source character as it is
+# read, the Compiler can first parse the source into a list of
+# operations, with runs of "+-<>" folded together, and pointer movement
+# turned into offsets from "idx":
+#
+#   ('add', loc, offset, n)        data[idx + offset] += n
+#   ('set', loc, offset, n)        data[idx + offset] = n
+#   ('mul', loc, src, dst, n)      data[idx + dst] += data[idx + src] * n
+#   ('move', loc, n)               idx += n
+#   ('out', loc, offset)           putchar (data[idx + offset])
+#   ('in', loc, offset)            data[idx + offset] = getchar ()
+#   ('loop', loc, body)            while (data[idx]) { body }
+#
+# where "loc" is the (line, column) of the source character responsible.
+# Loops that merely clear a cell ("[-]"), or that add multiples of one
+# cell to others ("[->+>++<<]") are replaced by straight-line code.
+
+def add_to_cell(ops, loc, offset, n):
+    """Append data[idx + offset] += n to ops, folding it into earlier
+    adds and sets of the same cell where possible."""
+    for i in range(len(ops) - 1, -1, -1):
+        kind = ops[i][0]
+        if kind not in ('add', 'set'):
+            break
+        if ops[i][2] == offset:
+            ops[i] = (kind, ops[i][1], offset, (ops[i][3] + n) % 256)
+            if kind == 'add' and ops[i][3] == 0:
+                del ops[i]
+            return
+    if n % 256:
+        ops.append(('add', loc, offset, n % 256))
+
+def set_cell(ops, loc, offset, n):
+    """Append data[idx + offset] = n to ops, dropping earlier adds and
+    sets of the same cell that it overwrites."""
+    for i in range(len(ops) - 1, -1, -1):
+        if ops[i][0] not in ('add', 'set'):
+            break
+        if ops[i][2] == offset:
+            del ops[i]
+            break
+    ops.append(('set', loc, offset, n))
+
+def simplify_loop(loc, body):
+    """Get the ops equivalent to ('loop', loc, body)."""
+    if body and all(op[0] == 'add' for op in body):
+        deltas = {}
+        for op in body:
+            deltas[op[2]] = (deltas.get(op[2], 0) + op[3]) % 256
+        # A loop that only changes cells by fixed amounts per iteration,
+        # decrementing (or incrementing) cell 0 by one, runs data[idx]
+        # (or 256 - data[idx]) times, so can be turned into
+        # multiplications.
+        if deltas.get(0) in (1, 255):
+            step = 1 if deltas[0] == 1 else -1
+            ops = [('mul', loc, 0, dst, (-step * n) % 256)
+                   for dst, n in sorted(deltas.items())
+                   if dst != 0 and n]
+            ops.append(('set', loc, 0, 0))
+            return ops
+    return [('loop', loc, body)]
+
+# A run of repeated "+-<>", or any other single bf character.
+TOKEN_PATTERN = re.compile(r'\++|-+|<+|>+|[.,\[\]]')
+
 class Compiler:
-    def __init__(self):
+    # The source is read and tokenized this many characters at a time,
+    # rather than all at once.
+    chunk_size = 64 * 1024
+
+    def __init__(self, optimize=False, locations=True):
+        # If optimize, parse the source into ops, optimize them, and
+        # then emit them, rather than emitting statements per character.
+        self.optimize = optimize
+        # If locations, create a gccjit.Location and comment per
+        # statement (so the generated code can be debugged).
+        self.locations = locations
         self.ctxt = gccjit.Context()
         if 1:
             self.ctxt.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL,
@@ -112,11 +191,30 @@ class Compiler:
                                         self.byte_zero,
                                         loc)
 
+    def get_data_at(self, offset, loc):
+        """Get 'data_cells[idx + offset]' as an lvalue. """
+        if offset == 0:
+            return self.get_current_data(loc)
+        index = self.ctxt.new_binary_op(gccjit.BinaryOp.PLUS,
+                                        self.int_type,
+                                        self.idx,
+                                        self.ctxt.new_rvalue_from_int(self.int_type,
+                                                                      offset),
+                                        loc)
+        return self.ctxt.new_array_access(self.data_cells, index, loc)
+
+    def make_location(self, line, column):
+        if not self.locations:
+            return None
+        return self.ctxt.new_location(self.filename, line, column)
+
+    def add_comment(self, block, text, loc):
+        if self.locations:
+            block.add_comment(text, loc)
+
     def compile_char(self, ch):
         """Compile one bf character."""
-        loc = self.ctxt.new_location(self.filename,
-                                     self.line,
-                                     self.column)
+        loc = self.make_location(self.line, self.column)
 
         # Turn this on to trace execution, by injecting putchar()
         # of each source char.
@@ -129,25 +227,25 @@ class Compiler:
             self.curblock.add_eval (call, loc)
 
         if ch == '>':
-            self.curblock.add_comment(b"'>': idx += 1;", loc)
+            self.add_comment(self.curblock, b"'>': idx += 1;", loc)
             self.curblock.add_assignment_op(self.idx,
                                             gccjit.BinaryOp.PLUS,
                                             self.int_one,
                                             loc)
         elif ch == '<':
-            self.curblock.add_comment(b"'<': idx -= 1;", loc)
+            self.add_comment(self.curblock, b"'<': idx -= 1;", loc)
             self.curblock.add_assignment_op(self.idx,
                                             gccjit.BinaryOp.MINUS,
                                             self.int_one,
                                             loc)
         elif ch == '+':
-            self.curblock.add_comment(b"'+': data[idx] += 1;", loc)
+            self.add_comment(self.curblock, b"'+': data[idx] += 1;", loc)
             self.curblock.add_assignment_op(self.get_current_data (loc),
                                             gccjit.BinaryOp.PLUS,
                                             self.byte_one,
                                             loc)
         elif ch == '-':
-            self.curblock.add_comment(b"'-': data[idx] -= 1;", loc)
+            self.add_comment(self.curblock, b"'-': data[idx] -= 1;", loc)
             self.curblock.add_assignment_op(self.get_current_data(loc),
                                             gccjit.BinaryOp.MINUS,
                                             self.byte_one,
@@ -159,12 +257,12 @@ class Compiler:
             call = self.ctxt.new_call(self.func_putchar,
                                       [arg],
                                       loc)
-            self.curblock.add_comment(b"'.': putchar ((int)data[idx]);",
+            self.add_comment(self.curblock, b"'.': putchar ((int)data[idx]);",
                                       loc)
             self.curblock.add_eval(call, loc)
         elif ch == ',':
             call = self.ctxt.new_call(self.func_getchar, [], loc)
-            self.curblock.add_comment(b"',': data[idx] = (unsigned char)getchar ();",
+            self.add_comment(self.curblock, b"',': data[idx] = (unsigned char)getchar ();",
                                       loc)
             self.curblock.add_assignment(self.get_current_data(loc),
                                          self.ctxt.new_cast(call,
@@ -178,7 +276,7 @@ class Compiler:
 
             self.curblock.end_with_jump(loop_test, loc)
 
-            loop_test.add_comment(b"'['", loc)
+            self.add_comment(loop_test, b"'['", loc)
             loop_test.end_with_conditional(self.current_data_is_zero(loc),
                                            on_zero,
                                            on_non_zero,
@@ -186,7 +284,7 @@ class Compiler:
             self.open_parens.append(Paren(loop_test, on_non_zero, on_zero))
             self.curblock = on_non_zero;
         elif ch == ']':
-            self.curblock.add_comment(b"']'", loc)
+            self.add_comment(self.curblock, b"']'", loc)
             if not self.open_parens:
                 raise CompileError(self, "mismatching parens")
             paren = self.open_parens.pop()
@@ -200,6 +298,169 @@ class Compiler:
             self.column += 1
 
 
+    def tokenize(self, chunks):
+        """
+        Generate (run, line, column) for each run of bf characters within
+        the given chunks of source text, where a run is a repeated
+        "+", "-", "<" or ">", or a single ".", ",", "[" or "]".
+
+        Line and column tracking carries across chunk boundaries (a run
+        that straddles one is merely split in two).
+        """
+        line = self.line
+        column = self.column
+        for chunk in chunks:
+            for i, text in enumerate(chunk.split('\n')):
+                if i:
+                    line += 1
+                    column = 0
+                for m in TOKEN_PATTERN.finditer(text):
+                    yield (m.group(), line, column + m.start())
+                column += len(text)
+            self.line = line
+            self.column = column
+
+    def parse_ops(self, tokens):
+        """
+        Parse (run, line, column) tokens into a list of optimized ops.
+        """
+        ops = []
+        offset = 0
+        open_loops = []
+        for run, line, column in tokens:
+            loc = (line, column)
+            ch = run[0]
+            if ch == '+':
+                add_to_cell(ops, loc, offset, len(run))
+            elif ch == '-':
+                add_to_cell(ops, loc, offset, -len(run))
+            elif ch == '>':
+                offset += len(run)
+            elif ch == '<':
+                offset -= len(run)
+            elif ch == '.':
+                ops.append(('out', loc, offset))
+            elif ch == ',':
+                ops.append(('in', loc, offset))
+            else:
+                # Loops test data[idx], so flush any pending movement.
+                if offset:
+                    ops.append(('move', loc, offset))
+                    offset = 0
+                if ch == '[':
+                    open_loops.append((ops, loc))
+                    ops = []
+                else:
+                    if not open_loops:
+                        self.line, self.column = loc
+                        raise CompileError(self, "mismatching parens")
+                    body = ops
+                    ops, loop_loc = open_loops.pop()
+                    if not ops and not open_loops:
+                        # The cells start out zeroed, so a loop at the
+                        # very start of the program is never entered
+                        # (typically it holds a comment).
+                        continue
+                    for op in simplify_loop(loop_loc, body):
+                        if op[0] == 'set':
+                            set_cell(ops, op[1], op[2], op[3])
+                        else:
+                            ops.append(op)
+        if open_loops:
+            self.line, self.column = open_loops[-1][1]
+            raise CompileError(self, "mismatching parens")
+        if offset:
+            ops.append(('move', (self.line, self.column), offset))
+        return ops
+
+    def emit_ops(self, ops):
+        """Emit a list of ops into the current block."""
+        for op in ops:
+            kind = op[0]
+            loc = self.make_location(*op[1])
+            if kind == 'add':
+                offset, n = op[2:]
+                self.add_comment(self.curblock,
+                                 b"data[idx + %i] += %i;" % (offset, n), loc)
+                self.curblock.add_assignment_op(
+                    self.get_data_at(offset, loc),
+                    gccjit.BinaryOp.PLUS,
+                    self.ctxt.new_rvalue_from_int(self.byte_type, n),
+                    loc)
+            elif kind == 'set':
+                offset, n = op[2:]
+                self.add_comment(self.curblock,
+                                 b"data[idx + %i] = %i;" % (offset, n), loc)
+                self.curblock.add_assignment(
+                    self.get_data_at(offset, loc),
+                    self.ctxt.new_rvalue_from_int(self.byte_type, n),
+                    loc)
+            elif kind == 'mul':
+                src, dst, n = op[2:]
+                self.add_comment(self.curblock,
+                                 (b"data[idx + %i] += data[idx + %i] * %i;"
+                                  % (dst, src, n)),
+                                 loc)
+                product = self.get_data_at(src, loc)
+                if n != 1:
+                    product = self.ctxt.new_binary_op(
+                        gccjit.BinaryOp.MULT,
+                        self.byte_type,
+                        product,
+                        self.ctxt.new_rvalue_from_int(self.byte_type, n),
+                        loc)
+                self.curblock.add_assignment_op(self.get_data_at(dst, loc),
+                                                gccjit.BinaryOp.PLUS,
+                                                product,
+                                                loc)
+            elif kind == 'move':
+                n = op[2]
+                self.add_comment(self.curblock, b"idx += %i;" % n, loc)
+                self.curblock.add_assignment_op(
+                    self.idx,
+                    gccjit.BinaryOp.PLUS,
+                    self.ctxt.new_rvalue_from_int(self.int_type, n),
+                    loc)
+            elif kind == 'out':
+                offset = op[2]
+                arg = self.ctxt.new_cast(self.get_data_at(offset, loc),
+                                         self.int_type,
+                                         loc)
+                self.add_comment(self.curblock,
+                                 b"putchar ((int)data[idx + %i]);" % offset,
+                                 loc)
+                self.curblock.add_eval(self.ctxt.new_call(self.func_putchar,
+                                                          [arg],
+                                                          loc),
+                                       loc)
+            elif kind == 'in':
+                offset = op[2]
+                call = self.ctxt.new_call(self.func_getchar, [], loc)
+                self.add_comment(self.curblock,
+                                 (b"data[idx + %i] = (unsigned char)getchar ();"
+                                  % offset),
+                                 loc)
+                self.curblock.add_assignment(self.get_data_at(offset, loc),
+                                             self.ctxt.new_cast(call,
+                                                                self.byte_type,
+                                                                loc),
+                                             loc)
+            elif kind == 'loop':
+                loop_test = self.func.new_block()
+                on_zero = self.func.new_block()
+                on_non_zero = self.func.new_block()
+                self.curblock.end_with_jump(loop_test, loc)
+                self.add_comment(loop_test, b"'['", loc)
+                loop_test.end_with_conditional(self.current_data_is_zero(loc),
+                                               on_zero,
+                                               on_non_zero,
+                                               loc)
+                self.curblock = on_non_zero
+                self.emit_ops(op[2])
+                self.add_comment(self.curblock, b"']'", loc)
+                self.curblock.end_with_jump(loop_test, loc)
+                self.curblock = on_zero
+
     def parse_into_ctxt(self, filename):
         """
         Parse the given .bf file into the gccjit.Context, containing a
@@ -209,8 +470,15 @@ class Compiler:
         self.line = 1
         self.column = 0
         with open(filename) as f_in:
-            for ch in f_in.read():
-                self.compile_char(ch)
+            chunks = iter(partial(f_in.read, self.chunk_size), '')
+            if self.optimize:
+                self.emit_ops(self.parse_ops(self.tokenize(chunks)))
+            else:
+                for run, line, column in self.tokenize(chunks):
+                    for i, ch in enumerate(run):
+                        self.line = line
+                        self.column = column + i
+                        self.compile_char(ch)
         self.curblock.end_with_void_return()
 
     # Compiling to an executable
@@ -242,11 +510,17 @@ def main(argv):
     parser = OptionParser()
     parser.add_option("-o", "--output", dest="outputfile",
                       help="compile to FILE", metavar="FILE")
+    parser.add_option("-O", "--optimize", action="store_true",
+                      dest="optimize", default=False,
+                      help="optimize the bf code before emitting it")
+    parser.add_option("--no-locations", action="store_false",
+                      dest="locations", default=True,
+                      help="don't emit source locations and comments")
     (options, args) = parser.parse_args()
     if len(args) != 1:
         raise ValueError('No input file')
     inputfile = args[0]
-    c = Compiler()
+    c = Compiler(optimize=options.optimize, locations=options.locations)
     with timer("total"):
         with timer("parsing"):
             c.parse_into_ctxt(inputfile)
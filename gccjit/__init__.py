@@ -21,6 +21,9 @@ from __future__ import absolute_import
 from ._gccjit import (Context,
                       Object,
                       Result,
+                      FunctionTable,
+                      LibraryResult,
+                      Callable,
                       RValue,
                       LValue,
                       Type,
@@ -34,6 +37,7 @@ from ._gccjit import (Context,
                       UnaryOp,
                       BinaryOp,
                       Comparison,
+                      StatementKind,
                       StrOption,
                       IntOption,
                       BoolOption,
@@ -41,6 +45,11 @@ from ._gccjit import (Context,
                       TypeKind,
                       GlobalKind,
                       Error,
+                      CompileStats,
+                      add_compile_hook,
+                      remove_compile_hook,
+                      get_libgccjit_version,
+                      get_perf_map_path,
                       )
 
 # Make it easy to make a "main" function:
@@ -65,3 +74,76 @@ def make_main(ctxt):
                                   b"main",
                                   [param_argc, param_argv])
     return (func_main, param_argc, param_argv)
+
+def compile_many(contexts, max_workers=None):
+    """
+    Compile each of the given contexts on a pool of threads.
+    Return a list of gccjit.Result, in the same order as the input.
+
+    The GIL is released whilst each context is being compiled, so
+    other Python threads can run in the meantime.  Note that libgccjit
+    serializes the GCC part of compilation within a process behind its
+    own mutex, so the scaling that can be expected is bounded by the
+    proportion of time spent outside of it.
+
+    If any compilation fails, the gccjit.Error from the first failing
+    context (in input order) is raised.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    contexts = list(contexts)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(Context.compile, contexts))
+
+def make_map_function(ctxt, func, in_type, out_type, name):
+    """
+    Make a function that applies the given function elementwise, for
+    use with Result.map:
+      void
+      name (const in_type *in, out_type *out, size_t n)
+      {
+        for (size_t i = 0; i < n; i++)
+          out[i] = func (in[i]);
+      }
+    The loop is built within the same context as func, so func can be
+    inlined into it (e.g. by making it FunctionKind.ALWAYS_INLINE).
+    The element types are recorded via Context.set_map_formats, so that
+    Result.map can check the buffers it is given against them.
+    Return the new Function.
+    """
+    void_type = ctxt.get_type(TypeKind.VOID)
+    size_type = ctxt.get_type(TypeKind.SIZE_T)
+    param_in = ctxt.new_param(in_type.get_const().get_pointer(), b"in")
+    param_out = ctxt.new_param(out_type.get_pointer(), b"out")
+    param_n = ctxt.new_param(size_type, b"n")
+    loop_func = ctxt.new_function(FunctionKind.EXPORTED,
+                                  void_type,
+                                  name,
+                                  [param_in, param_out, param_n])
+    i = loop_func.new_local(size_type, b"i")
+
+    entry_block = loop_func.new_block(b"entry")
+    cond_block = loop_func.new_block(b"cond")
+    loop_block = loop_func.new_block(b"loop")
+    after_loop_block = loop_func.new_block(b"after_loop")
+
+    # i = 0
+    entry_block.add_assignment(i, ctxt.zero(size_type))
+    entry_block.end_with_jump(cond_block)
+
+    # while (i < n)
+    cond_block.end_with_conditional(
+        ctxt.new_comparison(Comparison.LT, i, param_n),
+        loop_block,
+        after_loop_block)
+
+    # out[i] = func (in[i]);
+    loop_block.add_assignment(
+        ctxt.new_array_access(param_out, i),
+        ctxt.new_call(func, [ctxt.new_array_access(param_in, i)]))
+    # i++
+    loop_block.add_assignment_op(i, BinaryOp.PLUS, ctxt.one(size_type))
+    loop_block.end_with_jump(cond_block)
+
+    after_loop_block.end_with_void_return()
+    ctxt.set_map_formats(name, in_type.format, out_type.format)
+    return loop_func
@@ -0,0 +1,194 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Ahead-of-time bundling of many contexts into a single shared library,
+with a JSON manifest describing the functions within it.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from ._gccjit import Error, LibraryResult, OutputKind
+
+MANIFEST_VERSION = 2
+
+def get_manifest_path(path):
+    """Get the path of the manifest for the bundle at path."""
+    return path + '.json'
+
+def _get_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _get_tmp_path(path):
+    # A name alongside path, so that it can be renamed over path.
+    return '%s.tmp-%i-%s' % (path, os.getpid(), os.urandom(4).hex())
+
+class Bundle:
+    """
+    A collection of contexts to be compiled to object files and linked
+    into one shared library, so that loading them all costs a single
+    dlopen.
+    """
+    def __init__(self):
+        self._contexts = []
+        self._signatures = {}
+        self._map_formats = {}
+        self._profiled = []
+
+    def add(self, ctxt, signatures):
+        """
+        Add a context, given a dict mapping the name (as bytes) of each
+        exported function within it to a (restype, argtypes) pair of
+        TypeKind values, as per Result.get_function.
+        """
+        for name in signatures:
+            if name in self._signatures:
+                raise ValueError('duplicate function: %r' % name)
+        self._contexts.append(ctxt)
+        for name, (restype, argtypes) in signatures.items():
+            self._signatures[name] = (restype, list(argtypes))
+        self._map_formats.update(ctxt.get_map_formats())
+        self._profiled.extend(ctxt.get_profiled_functions())
+
+    def write(self, path, cc='gcc'):
+        """
+        Compile every context to an object file, link them with cc into
+        a shared library at path, and write its manifest alongside it.
+
+        Both files are written under temporary names and then renamed
+        into place, the manifest last.  The manifest records a digest
+        of the library, so a reader that races with the renames gets an
+        error from load rather than a mismatched pair.
+        """
+        path = os.fsdecode(path)
+        manifest_path = get_manifest_path(path)
+        tmp_lib = _get_tmp_path(path)
+        tmp_manifest = _get_tmp_path(manifest_path)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            objects = []
+            for i, ctxt in enumerate(self._contexts):
+                obj = os.path.join(tmpdir, '%i.o' % i)
+                ctxt.compile_to_file(OutputKind.OBJECT_FILE, os.fsencode(obj))
+                objects.append(obj)
+            proc = subprocess.Popen([cc, '-shared', '-o', tmp_lib] + objects,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            out, _ = proc.communicate()
+            if proc.returncode != 0:
+                raise Error(out)
+
+            manifest = {
+                'version': MANIFEST_VERSION,
+                'library': os.path.basename(path),
+                'sha256': _get_digest(tmp_lib),
+                'functions': {name.decode('utf-8'): {'restype': restype,
+                                                     'argtypes': argtypes}
+                              for name, (restype, argtypes)
+                              in sorted(self._signatures.items())},
+                'map_formats': {name.decode('utf-8'): list(formats)
+                                for name, formats
+                                in sorted(self._map_formats.items())},
+                'profiled': [[name.decode('utf-8'),
+                              counter_name.decode('utf-8')]
+                             for name, counter_name in self._profiled],
+            }
+            with open(tmp_manifest, 'x') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+
+            os.replace(tmp_lib, path)
+            os.replace(tmp_manifest, manifest_path)
+        finally:
+            shutil.rmtree(tmpdir)
+            for tmp_path in (tmp_lib, tmp_manifest):
+                try:
+                    os.unlink(tmp_path)
+                except FileNotFoundError:
+                    pass
+
+class BundleResult:
+    """
+    A bundle written by Bundle.write, loaded into the process.  This can
+    be used in place of a Result, other than for get_table.
+    """
+    def __init__(self, path):
+        path = os.fsdecode(path)
+        with open(get_manifest_path(path)) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise Error(b'unsupported bundle manifest version')
+        if _get_digest(path) != manifest['sha256']:
+            raise Error(b'bundle manifest does not match the library')
+        self.signatures = {
+            name.encode('utf-8'): (sig['restype'], sig['argtypes'])
+            for name, sig in manifest['functions'].items()}
+        map_formats = {
+            name.encode('utf-8'): tuple(formats)
+            for name, formats in manifest['map_formats'].items()}
+        profiled = [(name.encode('utf-8'), counter_name.encode('utf-8'))
+                    for name, counter_name in manifest['profiled']]
+        self.library = LibraryResult(os.fsencode(path), map_formats,
+                                     profiled)
+
+    def get_code(self, funcname):
+        return self.library.get_code(funcname)
+
+    def get_global(self, name):
+        return self.library.get_global(name)
+
+    def get_profile(self, reset=False):
+        """As per Result.get_profile."""
+        return self.library.get_profile(reset)
+
+    def get_function(self, funcname, restype=None, argtypes=None):
+        """
+        As per Result.get_function, but the signature defaults to the one
+        recorded in the manifest.
+        """
+        if restype is None and argtypes is None:
+            try:
+                restype, argtypes = self.signatures[funcname]
+            except KeyError:
+                raise Error(b'unknown function: ' + funcname)
+        return self.library.get_function(funcname, restype, argtypes)
+
+    def map(self, funcname, in_buffer, out_buffer, formats=None):
+        self.library.map(funcname, in_buffer, out_buffer, formats)
+
+    def close(self):
+        self.library.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def load(path):
+    """Load the bundle written to path by Bundle.write."""
+    return BundleResult(path)
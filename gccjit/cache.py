@@ -0,0 +1,234 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Caches of compiled code, keyed by Context.get_fingerprint().
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import os
+import tempfile
+import threading
+import time
+
+from ._gccjit import Error, LibraryResult, OutputKind
+
+class CachedResult:
+    """
+    One caller's handle on a Result shared through a ResultCache.
+
+    It behaves like the Result, except that closing it merely gives up
+    this handle's reference, after which using the handle raises
+    gccjit.Error; the shared Result is only released once the cache
+    and every handle on it have let go of it.  The handles share
+    everything else, including the profile counters (so a reset via
+    one handle's get_profile affects them all) and the perf map
+    entries.
+    """
+    def __init__(self, result):
+        self._result = result
+
+    def __getattr__(self, name):
+        # Only called for names not found on the handle itself.
+        result = self.__dict__.get('_result')
+        if result is None:
+            raise Error(b'result is closed')
+        return getattr(result, name)
+
+    def close(self):
+        """Give up this handle on the shared Result."""
+        self._result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ResultCache:
+    """
+    An in-memory, least-recently-used cache of Result instances, so that
+    compiling a context whose code is identical to one that was compiled
+    earlier reuses the earlier Result rather than invoking GCC again.
+
+    Each call to compile returns a new CachedResult handle, so one
+    caller closing its handle can't free code that another is using.
+    Evicting an entry (or clearing the cache) only drops the cache's
+    reference: the underlying gcc_jit_result is released once every
+    handle on it has been closed or garbage-collected too.
+    """
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def compile(self, ctxt):
+        """
+        compile(self, ctxt:Context) -> CachedResult
+
+        Get a handle on the Result of compiling ctxt, reusing an earlier
+        Result if there is one for identical code and options.
+        """
+        key = ctxt.get_fingerprint()
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return CachedResult(result)
+            self.misses += 1
+
+        # Don't hold the lock whilst compiling; if another thread races
+        # us to compile the same code, the later Result wins.
+        result = ctxt.compile()
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.capacity:
+                self._results.popitem(last=False)
+        return CachedResult(result)
+
+    def clear(self):
+        """Drop every entry in the cache."""
+        with self._lock:
+            self._results.clear()
+
+class DiskCache:
+    """
+    A directory of shared libraries built from contexts, which
+    persists from one process to the next.
+
+    Entries are written to a temporary file and renamed into place, so
+    several processes can safely share one directory: a reader only
+    ever sees complete libraries, and concurrent misses on the same
+    context simply race to rename identical files into place.
+
+    When the total size of the directory exceeds max_bytes, the least
+    recently used entries are deleted.  Deleting a library that another
+    process has loaded is harmless; its mapping stays valid.
+    """
+    suffix = '.so'
+    tmp_prefix = '.tmp-'
+
+    # Temporary files older than this are assumed to have been left
+    # behind by a process that died mid-compile.
+    stale_tmp_age = 60 * 60
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = os.fsdecode(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def compile(self, ctxt):
+        """
+        compile(self, ctxt:Context) -> LibraryResult
+
+        Get the compiled code for ctxt, from the cache if possible,
+        otherwise by compiling it to a shared library in the cache.
+        """
+        key = ctxt.get_fingerprint()
+        path = self.get_path(key)
+        map_formats = ctxt.get_map_formats()
+        profiled = ctxt.get_profiled_functions()
+        result = self._load(path, map_formats, profiled)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory,
+                                        prefix=self.tmp_prefix,
+                                        suffix=self.suffix)
+        os.close(fd)
+        try:
+            ctxt.compile_to_file(OutputKind.DYNAMIC_LIBRARY,
+                                 os.fsencode(tmp_path))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict(keep=path)
+        return LibraryResult(os.fsencode(path), map_formats, profiled)
+
+    def _load(self, path, map_formats, profiled):
+        try:
+            result = LibraryResult(os.fsencode(path), map_formats, profiled)
+        except Error:
+            # Either not present, or evicted between us checking and
+            # loading it.
+            return None
+        try:
+            # Mark it as recently used.
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def evict(self, keep=None):
+        """
+        Delete least-recently-used entries until the directory is no
+        larger than max_bytes.
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.startswith(self.tmp_prefix):
+                if now - st.st_mtime > self.stale_tmp_age:
+                    self._unlink(path)
+                continue
+            if not name.endswith(self.suffix):
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+            total += st.st_size
+        entries.sort()
+        for mtime, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._unlink(path)
+            total -= size
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # Another process got there first.
+            pass
+
+    def clear(self):
+        """Delete every entry in the cache."""
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                self._unlink(os.path.join(self.directory, name))
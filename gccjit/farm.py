@@ -0,0 +1,170 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compiling recorded contexts on a pool of worker processes.
+"""
+
+from __future__ import absolute_import
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import tempfile
+import threading
+
+from ._gccjit import Context, Error, LibraryResult, OutputKind
+
+def get_default_directory():
+    """
+    Get the directory in which workers write shared libraries: a tmpfs
+    if there is one, so that they never touch the disk.
+    """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+def _get_mp_context():
+    # Forking a process that may hold locks in other threads (including
+    # libgccjit's own mutex) can deadlock the child, so start workers
+    # from a clean process instead.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+def _compile_recording(recording, path):
+    # Run within a worker: rebuild the context and compile it to a
+    # shared library at path (which the parent owns, and removes even if
+    # the worker dies), returning what the parent needs to know about
+    # the context to load it.
+    ctxt = Context()
+    try:
+        ctxt.replay(recording)
+        ctxt.compile_to_file(OutputKind.DYNAMIC_LIBRARY, os.fsencode(path))
+        return ctxt.get_map_formats(), ctxt.get_profiled_functions()
+    finally:
+        ctxt.close()
+
+class Farm:
+    """
+    A pool of worker processes, each compiling contexts recorded with
+    Context.start_recording and Context.get_recording.
+
+    Each worker replays the recording into a fresh Context and compiles
+    it to a shared library in directory; the parent loads the library as
+    a LibraryResult and unlinks the file.  Compiles in different workers
+    run truly in parallel.
+
+    A crash within GCC kills the worker, which breaks the whole pool:
+    every compile then in flight fails with it.  Those compiles are
+    rerun, each in a worker process of its own, so that only the one
+    that crashes again fails, with a gccjit.Error; the pool is restarted
+    for subsequent compiles.
+    """
+    def __init__(self, max_workers=None, directory=None):
+        self.max_workers = max_workers
+        self.directory = directory or get_default_directory()
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers,
+                                             mp_context=_get_mp_context())
+
+    def _submit(self, recording, path):
+        with self._lock:
+            try:
+                return self._executor.submit(_compile_recording, recording,
+                                             path)
+            except BrokenProcessPool:
+                # A worker died (e.g. GCC crashed); start afresh.
+                self._executor.shutdown(wait=False)
+                self._executor = ProcessPoolExecutor(
+                    self.max_workers, mp_context=_get_mp_context())
+                return self._executor.submit(_compile_recording, recording,
+                                             path)
+
+    def _submit_isolated(self, recording, path):
+        # Compile in a process of its own, so that a crash can only
+        # fail this compile.
+        executor = ProcessPoolExecutor(1, mp_context=_get_mp_context())
+        try:
+            return executor.submit(_compile_recording, recording, path)
+        finally:
+            executor.shutdown(wait=False)
+
+    def submit(self, recording):
+        """
+        Compile a recording, returning a concurrent.futures.Future for
+        the LibraryResult.
+        """
+        result = Future()
+        fd, path = tempfile.mkstemp(prefix='gccjit-farm-', suffix='.so',
+                                    dir=self.directory)
+        os.close(fd)
+        def done(inner, isolated):
+            try:
+                map_formats, profiled = inner.result()
+                result.set_result(LibraryResult(os.fsencode(path),
+                                                map_formats, profiled))
+            except BrokenProcessPool:
+                if not isolated:
+                    # This compile may merely have been in flight when
+                    # another one crashed the pool: rerun it alone.
+                    try:
+                        self._submit_isolated(recording, path) \
+                            .add_done_callback(lambda f: done(f, True))
+                        return
+                    except BaseException as exc:
+                        result.set_exception(exc)
+                else:
+                    result.set_exception(Error(b'compiler process died'))
+            except BaseException as exc:
+                result.set_exception(exc)
+            finally:
+                # Once the outcome is known, the file can go: the library
+                # stays mapped once loaded, and otherwise the worker may
+                # have left a partial one behind.
+                if result.done():
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+        try:
+            inner = self._submit(recording, path)
+        except BaseException:
+            os.unlink(path)
+            raise
+        inner.add_done_callback(lambda f: done(f, False))
+        return result
+
+    def compile_many(self, recordings):
+        """
+        Compile each of the given recordings, returning a list of
+        LibraryResult in the same order.  If any compile fails, the
+        gccjit.Error from the first failing recording is raised.
+        """
+        futures = [self.submit(recording) for recording in recordings]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Shut down the worker processes."""
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -112,7 +112,7 @@ cdef extern from "libgccjit.h":
     gcc_jit_context *gcc_jit_context_acquire ()
     void gcc_jit_context_release (gcc_jit_context *ctxt)
 
-    gcc_jit_result *gcc_jit_context_compile (gcc_jit_context *ctxt)
+    gcc_jit_result *gcc_jit_context_compile (gcc_jit_context *ctxt) nogil
 
     cdef enum gcc_jit_output_kind:
         GCC_JIT_OUTPUT_KIND_ASSEMBLER
@@ -122,7 +122,7 @@ cdef extern from "libgccjit.h":
 
     void gcc_jit_context_compile_to_file (gcc_jit_context *ctxt,
                                           gcc_jit_output_kind output_kind,
-                                          char *output_path)
+                                          char *output_path) nogil
 
     void gcc_jit_context_dump_to_file (gcc_jit_context *ctxt,
                                        char *path,
@@ -134,6 +134,8 @@ cdef extern from "libgccjit.h":
 
     void *gcc_jit_result_get_code (gcc_jit_result *result, char *funcname)
 
+    void *gcc_jit_result_get_global (gcc_jit_result *result, char *name)
+
     void gcc_jit_result_release (gcc_jit_result *result)
 
     gcc_jit_context *gcc_jit_object_get_context (gcc_jit_object *obj)
@@ -16,64 +16,1381 @@
 #   along with this program.  If not, see
 #   <http://www.gnu.org/licenses/>.
 
+cimport cython
 from libc.stdlib cimport malloc, free
+from cpython.buffer cimport (PyObject_GetBuffer, PyBuffer_Release,
+                             PyBUF_ANY_CONTIGUOUS, PyBUF_WRITABLE,
+                             PyBUF_FORMAT)
+from posix.dlfcn cimport dlopen, dlsym, dlclose, dlerror, RTLD_NOW, RTLD_LOCAL
+from posix.stdio cimport fdopen, open_memstream
+from posix.unistd cimport dup, close
+from libc.stdio cimport FILE, fclose, fflush, setvbuf, _IOLBF
+from cpython.exc cimport PyErr_SetFromErrno
+from cpython cimport array
+from libc.string cimport memcpy
 cimport gccjit as c_api
 
+import array
+import fcntl
+import marshal
+import os
+import struct
+import sys
+import threading
+import time
+import weakref
+
+cdef extern from *:
+    """
+    /* gcc_jit_version_* only exist in newer versions of libgccjit.  */
+    #ifdef LIBGCCJIT_HAVE_gcc_jit_version
+    #define pygccjit_version_major() gcc_jit_version_major ()
+    #define pygccjit_version_minor() gcc_jit_version_minor ()
+    #define pygccjit_version_patchlevel() gcc_jit_version_patchlevel ()
+    #else
+    #define pygccjit_version_major() (-1)
+    #define pygccjit_version_minor() (-1)
+    #define pygccjit_version_patchlevel() (-1)
+    #endif
+    """
+    int pygccjit_version_major()
+    int pygccjit_version_minor()
+    int pygccjit_version_patchlevel()
+
+cdef extern from *:
+    """
+    /* Get the size of the ELF symbol containing the given address, or 0
+       if unknown.  dladdr1 is a GNU extension (Python.h defines
+       _GNU_SOURCE for us).  */
+    #include <dlfcn.h>
+    #ifdef __GLIBC__
+    #include <link.h>
+    #endif
+    static size_t pygccjit_get_symbol_size (void *addr)
+    {
+    #if defined(__GLIBC__) && defined(RTLD_DL_SYMENT)
+      Dl_info info;
+      const ElfW(Sym) *sym = NULL;
+      if (addr && dladdr1 (addr, &info, (void **)&sym, RTLD_DL_SYMENT) && sym)
+        return sym->st_size;
+    #endif
+      return 0;
+    }
+    """
+    size_t pygccjit_get_symbol_size(void *addr)
+
 class Error(Exception):
     def __init__(self, msg):
         self.msg = msg
 
+class CompileStats:
+    """
+    Statistics about one compilation of a Context, as given by
+    Result.stats (see Context.compile).
+
+    Times are wall-clock seconds; sizes are in bytes.
+    """
+    def __init__(self):
+        # Map from wrapper class name (e.g. 'RValue') to the number of
+        # objects of that kind created within the context (and any
+        # parents), excluding repeated requests for interned objects
+        self.object_counts = {}
+        # Time from creating the context to starting to compile it
+        self.build_time = None
+        # Time spent within gcc_jit_context_compile
+        self.compile_time = None
+        # Growth of the process's peak resident set size whilst
+        # compiling (from getrusage, so also covers other threads)
+        self.peak_rss_delta = None
+        # Map from exported function name to the size of its machine
+        # code, where known
+        self.function_sizes = {}
+        # List of (funcname, seconds) for each call to Result.get_code
+        self.lookups = []
+        # The optimization level the context was compiled at
+        self.opt_level = 0
+
+    @property
+    def code_size(self):
+        """Total size of the exported functions' machine code"""
+        return sum(self.function_sizes.values())
+
+    def as_dict(self):
+        """Get the stats as a JSON-serializable dict."""
+        return {'object_counts': dict(self.object_counts),
+                'build_time': self.build_time,
+                'compile_time': self.compile_time,
+                'peak_rss_delta': self.peak_rss_delta,
+                'code_size': self.code_size,
+                'function_sizes': {name.decode('utf-8'): size
+                                   for name, size in self.function_sizes.items()},
+                'lookups': [(name.decode('utf-8'), seconds)
+                            for name, seconds in self.lookups],
+                'opt_level': self.opt_level}
+
+# Callables to be called as hook(ctxt, result, stats) after every
+# successful Context.compile
+_compile_hooks = []
+
+def add_compile_hook(hook):
+    """add_compile_hook(hook)
+
+    Register hook(ctxt:Context, result:Result, stats:CompileStats) to be
+    called after every successful Context.compile; whilst any hooks are
+    registered, stats are gathered for every compilation."""
+    _compile_hooks.append(hook)
+
+def remove_compile_hook(hook):
+    """remove_compile_hook(hook)"""
+    _compile_hooks.remove(hook)
+
+def get_peak_rss():
+    """Get the peak resident set size of the process in bytes, or None."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def get_libgccjit_version():
+    """get_libgccjit_version() -> (major, minor, patchlevel), or None if unknown"""
+    if pygccjit_version_major() < 0:
+        return None
+    return (pygccjit_version_major(),
+            pygccjit_version_minor(),
+            pygccjit_version_patchlevel())
+
+# Logging
+#
+# libgccjit logs to the FILE * given to gcc_jit_context_set_logfile from
+# the context, its children, and any results compiled from them, so the
+# FILE * must outlive all of those.  Each of the corresponding wrappers
+# holds a reference to a _LogFile, which closes it once none remain.
+
+cdef class _LogFile:
+    cdef FILE *_c_file
+    # The buffer and its size, if logging to memory
+    cdef bint _in_memory
+    cdef char *_buf
+    cdef size_t _size
+
+    def __dealloc__(self):
+        if self._c_file != NULL:
+            fclose(self._c_file)
+        free(self._buf)
+
+    cdef bytes get_contents(self):
+        """Get everything logged so far to memory."""
+        # This updates _buf and _size.
+        fflush(self._c_file)
+        if self._buf == NULL:
+            return b''
+        return self._buf[:self._size]
+
+cdef _LogFile LogFile_from_fd(int fd):
+    """Make a _LogFile writing to a duplicate of the given fd, so that
+    closing it leaves the fd itself open."""
+    cdef _LogFile log = _LogFile()
+    cdef int new_fd = dup(fd)
+    if new_fd < 0:
+        PyErr_SetFromErrno(OSError)
+    log._c_file = fdopen(new_fd, "w")
+    if log._c_file == NULL:
+        close(new_fd)
+        PyErr_SetFromErrno(OSError)
+    # Write whole lines, to limit interleaving with other output.
+    setvbuf(log._c_file, NULL, _IOLBF, 0)
+    return log
+
+cdef _LogFile LogFile_in_memory():
+    cdef _LogFile log = _LogFile()
+    log._c_file = open_memstream(&log._buf, &log._size)
+    if log._c_file == NULL:
+        PyErr_SetFromErrno(OSError)
+    log._in_memory = True
+    return log
+
+
+# Interning of wrapper objects
+#
+# Repeated requests for the same type, constant or location within a
+# context return the same wrapper object, whilst it's alive, rather than
+# a fresh one (and, for types derived with get_const and get_volatile,
+# and for constants and locations, avoid creating another object within
+# libgccjit).
+#
+# Each Context owns a dict of weak references to the wrappers it has
+# handed out: the wrappers hold a reference to the Context, so holding
+# them strongly would make a cycle, keeping the Context (and its
+# gcc_jit_context) alive until the garbage collector next runs.
+cdef dict get_intern_table(c_api.gcc_jit_context *c_ctxt):
+    """Get the intern table for the given context, or None."""
+    cdef Context ctxt = get_context(c_ctxt)
+    if ctxt is None:
+        return None
+    return ctxt._interned
+
+cdef get_interned(dict table, key):
+    """Get the live wrapper interned in table under key, or None."""
+    ref = table.get(key)
+    if ref is None:
+        return None
+    return ref()
+
+# Lifetimes
+#
+# libgccjit requires that a context outlives any objects created within
+# it, and any child contexts.  Hence every wrapper object holds a
+# reference to its Context, and each child Context to its parent.
+#
+# Each live Context is registered here by the address of its
+# gcc_jit_context, with a weak reference, so that wrappers created from
+# a bare gcc_jit_context * (e.g. by Type.get_pointer) can find it.
+cdef dict _contexts = {}
+
+cdef Context get_context(c_api.gcc_jit_context *c_ctxt):
+    """Get the Context for the given gcc_jit_context, or None."""
+    ref = _contexts.get(<size_t>c_ctxt)
+    if ref is None:
+        return None
+    return ref()
+
+cdef set_owner(Object obj, Context ctxt):
+    """Record that obj was created within ctxt."""
+    cdef dict counts
+    obj._ctxt = ctxt
+    if ctxt is not None:
+        counts = ctxt._object_counts
+        cls = type(obj)
+        counts[cls] = counts.get(cls, 0) + 1
+
+cdef get_last_error(c_api.gcc_jit_context *c_ctxt):
+    """Get the last error on the given context (which may have been
+    closed) as bytes, for use in an Error."""
+    cdef char *err = NULL
+    if c_ctxt == NULL:
+        return b'context is closed'
+    err = c_api.gcc_jit_context_get_last_error(c_ctxt)
+    if err == NULL:
+        return b'unknown error'
+    return err
+
+# Recording
+#
+# A Context can record each call made to build IR within it, so that the
+# same IR can be rebuilt elsewhere (e.g. in another process) with
+# Context.replay.  Each call is recorded as a tuple:
+# an opcode, the id of the object that the method was called on (or -1
+# for the context itself), and the arguments, with each Object replaced
+# by its id (-1 for None).  Objects are numbered in the order in which
+# the recorded calls created them.
+cdef enum:
+    OP_SET_STR_OPTION
+    OP_SET_BOOL_OPTION
+    OP_SET_INT_OPTION
+    OP_GET_TYPE
+    OP_GET_INT_TYPE
+    OP_NEW_LOCATION
+    OP_NEW_GLOBAL
+    OP_NEW_ARRAY_TYPE
+    OP_NEW_FIELD
+    OP_NEW_STRUCT
+    OP_NEW_UNION
+    OP_NEW_FUNCTION_PTR_TYPE
+    OP_NEW_PARAM
+    OP_NEW_FUNCTION
+    OP_GET_BUILTIN_FUNCTION
+    OP_NEW_RVALUE_FROM_DOUBLE
+    OP_NEW_RVALUE_FROM_INT
+    OP_NEW_RVALUE_FROM_PTR
+    OP_NULL
+    OP_NEW_STRING_LITERAL
+    OP_NEW_UNARY_OP
+    OP_NEW_BINARY_OP
+    OP_NEW_COMPARISON
+    OP_NEW_CAST
+    OP_NEW_ARRAY_ACCESS
+    OP_NEW_CALL
+    OP_NEW_CALL_THROUGH_PTR
+    OP_GET_POINTER
+    OP_GET_CONST
+    OP_GET_VOLATILE
+    OP_SET_FIELDS
+    OP_DEREFERENCE_FIELD
+    OP_DEREFERENCE
+    OP_RVALUE_ACCESS_FIELD
+    OP_RVALUE_GET_TYPE
+    OP_GET_ADDRESS
+    OP_LVALUE_ACCESS_FIELD
+    OP_NEW_LOCAL
+    OP_NEW_BLOCK
+    OP_GET_PARAM
+    OP_ADD_EVAL
+    OP_ADD_ASSIGNMENT
+    OP_ADD_ASSIGNMENT_OP
+    OP_ADD_COMMENT
+    OP_END_WITH_CONDITIONAL
+    OP_END_WITH_JUMP
+    OP_END_WITH_RETURN
+    OP_END_WITH_VOID_RETURN
+    OP_GET_FUNCTION
+    OP_SET_MAP_FORMATS
+
+# For each opcode, the name of the method and the kinds of its arguments:
+#   'o': an Object, or None
+#   'O': a list of Objects, or None
+#   'i': an int
+#   'f': a float
+#   's': bytes, or None
+_OPS = (
+    ('set_str_option', 'is'),
+    ('set_bool_option', 'ii'),
+    ('set_int_option', 'ii'),
+    ('get_type', 'i'),
+    ('get_int_type', 'ii'),
+    ('new_location', 'sii'),
+    ('new_global', 'ioso'),
+    ('new_array_type', 'oio'),
+    ('new_field', 'oso'),
+    ('new_struct', 'sOo'),
+    ('new_union', 'sOo'),
+    ('new_function_ptr_type', 'oOoi'),
+    ('new_param', 'oso'),
+    ('new_function', 'iosOoi'),
+    ('get_builtin_function', 's'),
+    ('new_rvalue_from_double', 'of'),
+    ('new_rvalue_from_int', 'oi'),
+    ('new_rvalue_from_ptr', 'oi'),
+    ('null', 'o'),
+    ('new_string_literal', 's'),
+    ('new_unary_op', 'iooo'),
+    ('new_binary_op', 'ioooo'),
+    ('new_comparison', 'iooo'),
+    ('new_cast', 'ooo'),
+    ('new_array_access', 'ooo'),
+    ('new_call', 'oOo'),
+    ('new_call_through_ptr', 'oOo'),
+    ('get_pointer', ''),
+    ('get_const', ''),
+    ('get_volatile', ''),
+    ('set_fields', 'Oo'),
+    ('dereference_field', 'oo'),
+    ('dereference', 'o'),
+    ('access_field', 'oo'),
+    ('get_type', ''),
+    ('get_address', 'o'),
+    ('access_field', 'oo'),
+    ('new_local', 'oso'),
+    ('new_block', 's'),
+    ('get_param', 'i'),
+    ('add_eval', 'oo'),
+    ('add_assignment', 'ooo'),
+    ('add_assignment_op', 'oioo'),
+    ('add_comment', 'so'),
+    ('end_with_conditional', 'oooo'),
+    ('end_with_jump', 'oo'),
+    ('end_with_return', 'oo'),
+    ('end_with_void_return', 'o'),
+    ('get_function', ''),
+    ('set_map_formats', 'sss'),
+)
+
+# Bump this whenever the opcodes or their arguments change.
+_RECORDING_VERSION = 3
+
+cdef class _Recorder:
+    # The recorded calls, flattened into one array of ints: for each
+    # call, the opcode and target, then each argument in turn:
+    #   'o': the object's id
+    #   'O': the number of objects (-1 for None), then their ids
+    #   'i': the int itself
+    #   'f': the bits of the double
+    #   's': an index into strings (-1 for None)
+    cdef array.array codes
+    cdef list strings
+    cdef dict string_ids
+    # Map from the address of each recorded object to its id
+    cdef dict ids
+    cdef long long num_objects
+
+    def __cinit__(self):
+        self.codes = array.array('q')
+        self.strings = []
+        self.string_ids = {}
+        self.ids = {}
+        self.num_objects = 0
+
+    cdef int append(self, long long code) except -1:
+        cdef Py_ssize_t n = len(self.codes)
+        array.resize_smart(self.codes, n + 1)
+        self.codes.data.as_longlongs[n] = code
+        return 0
+
+    cdef long long get_id(self, obj) except -2:
+        if obj is None:
+            return -1
+        id_ = self.ids.get(<size_t>(<Object>obj)._c_object)
+        if id_ is None:
+            raise Error(b'object was not created whilst recording')
+        return id_
+
+    cdef long long get_string_id(self, s) except -2:
+        if s is None:
+            return -1
+        id_ = self.string_ids.get(s)
+        if id_ is None:
+            id_ = self.string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return id_
+
+    cdef record(self, int opcode, Object target, tuple args,
+                Object result=None):
+        """Record a call, and the object (if any) that it created."""
+        cdef Py_ssize_t start = len(self.codes)
+        cdef double d
+        cdef long long bits
+        try:
+            self.append(opcode)
+            self.append(self.get_id(target))
+            for kind, arg in zip(_OPS[opcode][1], args):
+                if kind == 'o':
+                    self.append(self.get_id(arg))
+                elif kind == 'O':
+                    if arg is None:
+                        self.append(-1)
+                    else:
+                        self.append(len(arg))
+                        for obj in arg:
+                            self.append(self.get_id(obj))
+                elif kind == 'i':
+                    self.append(arg)
+                elif kind == 'f':
+                    d = arg
+                    memcpy(&bits, &d, sizeof(double))
+                    self.append(bits)
+                else:
+                    self.append(self.get_string_id(arg))
+        except:
+            # Don't leave a partial call in the log.
+            array.resize(self.codes, start)
+            raise
+        if result is not None:
+            self.ids[<size_t>result._c_object] = self.num_objects
+            self.num_objects += 1
+
+    cdef bytes serialize(self):
+        return marshal.dumps((_RECORDING_VERSION, sys.byteorder,
+                              self.num_objects, self.codes.tobytes(),
+                              self.strings))
+
+cdef inline _Recorder get_recorder(Object obj):
+    """Get the recorder of the context that obj is within, or None."""
+    if obj._ctxt is None:
+        return None
+    return obj._ctxt._recorder
+
+# Replaying
+#
+# Recorded calls are replayed directly against the C API, without
+# creating wrapper objects or calling back into Python for each call.
+#
+# The kinds of object, as bits, so that each object's entry in the
+# table can say what it may be used as: a struct is also a type, and a
+# param is also an lvalue, which is also an rvalue.
+cdef enum:
+    K_LOCATION = 1 << 0
+    K_TYPE = 1 << 1
+    K_STRUCT = 1 << 2
+    K_FIELD = 1 << 3
+    K_FUNCTION = 1 << 4
+    K_BLOCK = 1 << 5
+    K_RVALUE = 1 << 6
+    K_LVALUE = 1 << 7
+    K_PARAM = 1 << 8
+
+cdef inline int get_target_kind(long long opcode) noexcept:
+    """The kind of object that the given call is made on, or 0 for the
+    context itself."""
+    if opcode in (OP_GET_POINTER, OP_GET_CONST, OP_GET_VOLATILE):
+        return K_TYPE
+    if opcode == OP_SET_FIELDS:
+        return K_STRUCT
+    if opcode in (OP_DEREFERENCE_FIELD, OP_DEREFERENCE,
+                  OP_RVALUE_ACCESS_FIELD, OP_RVALUE_GET_TYPE):
+        return K_RVALUE
+    if opcode in (OP_GET_ADDRESS, OP_LVALUE_ACCESS_FIELD):
+        return K_LVALUE
+    if opcode in (OP_NEW_LOCAL, OP_NEW_BLOCK, OP_GET_PARAM):
+        return K_FUNCTION
+    if opcode in (OP_ADD_EVAL, OP_ADD_ASSIGNMENT, OP_ADD_ASSIGNMENT_OP,
+                  OP_ADD_COMMENT, OP_END_WITH_CONDITIONAL,
+                  OP_END_WITH_JUMP, OP_END_WITH_RETURN,
+                  OP_END_WITH_VOID_RETURN, OP_GET_FUNCTION):
+        return K_BLOCK
+    return 0
+
+cdef inline int get_created_kinds(long long opcode) noexcept:
+    """The kinds that the object created by the given call may be used
+    as."""
+    if opcode == OP_NEW_LOCATION:
+        return K_LOCATION
+    if opcode == OP_NEW_STRUCT:
+        return K_STRUCT | K_TYPE
+    if opcode in (OP_GET_TYPE, OP_GET_INT_TYPE, OP_NEW_ARRAY_TYPE,
+                  OP_NEW_UNION, OP_NEW_FUNCTION_PTR_TYPE, OP_GET_POINTER,
+                  OP_GET_CONST, OP_GET_VOLATILE, OP_RVALUE_GET_TYPE):
+        return K_TYPE
+    if opcode == OP_NEW_FIELD:
+        return K_FIELD
+    if opcode in (OP_NEW_FUNCTION, OP_GET_BUILTIN_FUNCTION,
+                  OP_GET_FUNCTION):
+        return K_FUNCTION
+    if opcode == OP_NEW_BLOCK:
+        return K_BLOCK
+    if opcode in (OP_NEW_PARAM, OP_GET_PARAM):
+        return K_PARAM | K_LVALUE | K_RVALUE
+    if opcode in (OP_NEW_GLOBAL, OP_NEW_ARRAY_ACCESS, OP_DEREFERENCE_FIELD,
+                  OP_DEREFERENCE, OP_LVALUE_ACCESS_FIELD, OP_NEW_LOCAL):
+        return K_LVALUE | K_RVALUE
+    return K_RVALUE
+
+cdef struct _Reader:
+    long long *codes
+    Py_ssize_t pos
+    Py_ssize_t end
+    # The objects created so far, by id, and the kinds of each
+    void **objects
+    int *kinds
+    long long num_created
+    long long max_objects
+    # Set if the recording is malformed
+    bint bad
+
+cdef inline long long read_int(_Reader *r) noexcept:
+    if r.pos >= r.end:
+        r.bad = True
+        return 0
+    r.pos += 1
+    return r.codes[r.pos - 1]
+
+cdef inline double read_double(_Reader *r) noexcept:
+    cdef long long bits = read_int(r)
+    cdef double d
+    memcpy(&d, &bits, sizeof(double))
+    return d
+
+cdef inline void *read_obj(_Reader *r, int kind) noexcept:
+    """Read the id of an object of the given kind (or of None), getting
+    the object."""
+    cdef long long id_ = read_int(r)
+    if id_ == -1:
+        return NULL
+    if (id_ < 0 or id_ >= r.num_created
+        or not (r.kinds[id_] & kind)):
+        r.bad = True
+        return NULL
+    return r.objects[id_]
+
+cdef inline void add_obj(_Reader *r, void *obj, int kinds) noexcept:
+    if r.num_created >= r.max_objects:
+        r.bad = True
+        return
+    r.objects[r.num_created] = obj
+    r.kinds[r.num_created] = kinds
+    r.num_created += 1
+
+cdef const char *read_str(_Reader *r, list strings) noexcept:
+    cdef long long i = read_int(r)
+    if i == -1:
+        return NULL
+    cdef bytes s
+    if i < 0 or i >= len(strings) or type(strings[i]) is not bytes:
+        r.bad = True
+        return NULL
+    s = strings[i]
+    return s
+
+cdef void **read_objs(_Reader *r, int *count, int kind) noexcept:
+    """Read a list of objects of the given kind into a new array (to be
+    freed by the caller), setting count, which is -1 for None."""
+    cdef long long n = read_int(r)
+    cdef void **objs
+    cdef long long i
+    count[0] = -1
+    if n == -1 or r.bad:
+        return NULL
+    if n < 0 or n > r.end - r.pos:
+        r.bad = True
+        return NULL
+    objs = <void **>malloc((n + 1) * sizeof(void *))
+    if objs == NULL:
+        r.bad = True
+        return NULL
+    for i in range(n):
+        objs[i] = read_obj(r, kind)
+    count[0] = <int>n
+    return objs
+
+cdef format_to_bytes(format):
+    if format is None:
+        return None
+    return format.encode('ascii')
+
+cdef format_from_c(const char *format):
+    if format == NULL:
+        return None
+    return format.decode('ascii')
+
+cdef replay_ops(Context ctxt, array.array codes, list strings,
+                long long max_objects):
+    cdef c_api.gcc_jit_context *c_ctxt = ctxt._c_ctxt
+    cdef _Reader r
+    cdef long long opcode
+    cdef void *target
+    cdef void *obj
+    cdef void **objs
+    cdef void *tmp[3]
+    cdef int count
+    cdef double d
+    cdef const char *name
+    cdef const char *in_format
+    cdef const char *out_format
+    cdef long long kind
+    cdef long long value
+    r.codes = codes.data.as_longlongs
+    r.pos = 0
+    r.end = len(codes)
+    r.num_created = 0
+    r.max_objects = max_objects
+    r.bad = max_objects < 0
+    r.objects = <void **>malloc((max_objects + 1) * sizeof(void *))
+    r.kinds = <int *>malloc((max_objects + 1) * sizeof(int))
+    if r.objects == NULL or r.kinds == NULL:
+        free(r.objects)
+        free(r.kinds)
+        raise MemoryError()
+    try:
+        while r.pos < r.end and not r.bad:
+            opcode = read_int(&r)
+            # Calls on the context itself have no target (-1), which
+            # no object's kinds match.
+            target = read_obj(&r, get_target_kind(opcode))
+            obj = NULL
+            objs = NULL
+            # Options are mirrored into ctxt._options, as per the
+            # set_*_option methods.
+            if opcode == OP_SET_STR_OPTION:
+                kind = read_int(&r)
+                name = read_str(&r, strings)
+                c_api.gcc_jit_context_set_str_option(
+                    c_ctxt, <c_api.gcc_jit_str_option>kind, name)
+                ctxt._options[('str', kind)] = \
+                    <bytes>name if name != NULL else None
+                continue
+            elif opcode == OP_SET_BOOL_OPTION:
+                kind = read_int(&r)
+                value = read_int(&r)
+                c_api.gcc_jit_context_set_bool_option(
+                    c_ctxt, <c_api.gcc_jit_bool_option>kind, <int>value)
+                ctxt._options[('bool', kind)] = bool(value)
+                ctxt._update_defer_locations()
+                continue
+            elif opcode == OP_SET_INT_OPTION:
+                kind = read_int(&r)
+                value = read_int(&r)
+                c_api.gcc_jit_context_set_int_option(
+                    c_ctxt, <c_api.gcc_jit_int_option>kind, <int>value)
+                ctxt._options[('int', kind)] = <int>value
+                continue
+            elif opcode == OP_GET_TYPE:
+                obj = c_api.gcc_jit_context_get_type(
+                    c_ctxt, <c_api.gcc_jit_types>read_int(&r))
+            elif opcode == OP_GET_INT_TYPE:
+                kind = read_int(&r)
+                obj = c_api.gcc_jit_context_get_int_type(
+                    c_ctxt, <int>kind, <int>read_int(&r))
+            elif opcode == OP_NEW_LOCATION:
+                name = read_str(&r, strings)
+                kind = read_int(&r)
+                obj = c_api.gcc_jit_context_new_location(
+                    c_ctxt, name, <int>kind, <int>read_int(&r))
+            elif opcode == OP_NEW_GLOBAL:
+                kind = read_int(&r)
+                target = read_obj(&r, K_TYPE)
+                name = read_str(&r, strings)
+                obj = c_api.gcc_jit_context_new_global(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_global_kind>kind,
+                    <c_api.gcc_jit_type *>target, name)
+                # Rebuild the list of profiled functions from their
+                # counters, as per new_function.
+                if (obj != NULL and name != NULL
+                    and kind == c_api.GCC_JIT_GLOBAL_EXPORTED
+                    and (<bytes>name).startswith(_PROFILE_COUNTER_PREFIX)):
+                    ctxt._profiled.append(
+                        ((<bytes>name)[len(_PROFILE_COUNTER_PREFIX):],
+                         <bytes>name))
+            elif opcode == OP_NEW_ARRAY_TYPE:
+                target = read_obj(&r, K_TYPE)
+                kind = read_int(&r)
+                obj = c_api.gcc_jit_context_new_array_type(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_type *>target, <int>kind)
+            elif opcode == OP_NEW_FIELD:
+                target = read_obj(&r, K_TYPE)
+                name = read_str(&r, strings)
+                obj = c_api.gcc_jit_context_new_field(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_type *>target, name)
+            elif opcode == OP_NEW_STRUCT:
+                name = read_str(&r, strings)
+                objs = read_objs(&r, &count, K_FIELD)
+                target = read_obj(&r, K_LOCATION)
+                if count == -1:
+                    obj = c_api.gcc_jit_context_new_opaque_struct(
+                        c_ctxt, <c_api.gcc_jit_location *>target, name)
+                else:
+                    obj = c_api.gcc_jit_context_new_struct_type(
+                        c_ctxt, <c_api.gcc_jit_location *>target, name,
+                        count, <c_api.gcc_jit_field **>objs)
+            elif opcode == OP_NEW_UNION:
+                name = read_str(&r, strings)
+                objs = read_objs(&r, &count, K_FIELD)
+                obj = c_api.gcc_jit_context_new_union_type(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    name, count, <c_api.gcc_jit_field **>objs)
+            elif opcode == OP_NEW_FUNCTION_PTR_TYPE:
+                target = read_obj(&r, K_TYPE)
+                objs = read_objs(&r, &count, K_TYPE)
+                obj = read_obj(&r, K_LOCATION)
+                obj = c_api.gcc_jit_context_new_function_ptr_type(
+                    c_ctxt, <c_api.gcc_jit_location *>obj,
+                    <c_api.gcc_jit_type *>target,
+                    count, <c_api.gcc_jit_type **>objs, <int>read_int(&r))
+            elif opcode == OP_NEW_PARAM:
+                target = read_obj(&r, K_TYPE)
+                name = read_str(&r, strings)
+                obj = c_api.gcc_jit_context_new_param(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_type *>target, name)
+            elif opcode == OP_NEW_FUNCTION:
+                kind = read_int(&r)
+                target = read_obj(&r, K_TYPE)
+                name = read_str(&r, strings)
+                objs = read_objs(&r, &count, K_PARAM)
+                obj = read_obj(&r, K_LOCATION)
+                obj = c_api.gcc_jit_context_new_function(
+                    c_ctxt, <c_api.gcc_jit_location *>obj,
+                    <c_api.gcc_jit_function_kind>kind,
+                    <c_api.gcc_jit_type *>target, name,
+                    count, <c_api.gcc_jit_param **>objs, <int>read_int(&r))
+                if obj != NULL and kind == c_api.GCC_JIT_FUNCTION_EXPORTED:
+                    ctxt._exported.append(<bytes>name)
+            elif opcode == OP_GET_BUILTIN_FUNCTION:
+                obj = c_api.gcc_jit_context_get_builtin_function(
+                    c_ctxt, read_str(&r, strings))
+            elif opcode == OP_NEW_RVALUE_FROM_DOUBLE:
+                target = read_obj(&r, K_TYPE)
+                d = read_double(&r)
+                obj = c_api.gcc_jit_context_new_rvalue_from_double(
+                    c_ctxt, <c_api.gcc_jit_type *>target, d)
+                ctxt._doubles.append(d)
+            elif opcode == OP_NEW_RVALUE_FROM_INT:
+                target = read_obj(&r, K_TYPE)
+                obj = c_api.gcc_jit_context_new_rvalue_from_int(
+                    c_ctxt, <c_api.gcc_jit_type *>target, <int>read_int(&r))
+            elif opcode == OP_NEW_RVALUE_FROM_PTR:
+                target = read_obj(&r, K_TYPE)
+                obj = c_api.gcc_jit_context_new_rvalue_from_ptr(
+                    c_ctxt, <c_api.gcc_jit_type *>target, <void *>read_int(&r))
+            elif opcode == OP_NULL:
+                obj = c_api.gcc_jit_context_null(
+                    c_ctxt, <c_api.gcc_jit_type *>read_obj(&r, K_TYPE))
+            elif opcode == OP_NEW_STRING_LITERAL:
+                obj = c_api.gcc_jit_context_new_string_literal(
+                    c_ctxt, read_str(&r, strings))
+            elif opcode == OP_NEW_UNARY_OP:
+                kind = read_int(&r)
+                target = read_obj(&r, K_TYPE)
+                obj = read_obj(&r, K_RVALUE)
+                obj = c_api.gcc_jit_context_new_unary_op(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_unary_op>kind,
+                    <c_api.gcc_jit_type *>target,
+                    <c_api.gcc_jit_rvalue *>obj)
+            elif opcode == OP_NEW_BINARY_OP:
+                kind = read_int(&r)
+                target = read_obj(&r, K_TYPE)
+                tmp[0] = read_obj(&r, K_RVALUE)
+                tmp[1] = read_obj(&r, K_RVALUE)
+                obj = c_api.gcc_jit_context_new_binary_op(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_binary_op>kind,
+                    <c_api.gcc_jit_type *>target,
+                    <c_api.gcc_jit_rvalue *>tmp[0],
+                    <c_api.gcc_jit_rvalue *>tmp[1])
+            elif opcode == OP_NEW_COMPARISON:
+                kind = read_int(&r)
+                target = read_obj(&r, K_RVALUE)
+                obj = read_obj(&r, K_RVALUE)
+                obj = c_api.gcc_jit_context_new_comparison(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_comparison>kind,
+                    <c_api.gcc_jit_rvalue *>target,
+                    <c_api.gcc_jit_rvalue *>obj)
+            elif opcode == OP_NEW_CAST:
+                target = read_obj(&r, K_RVALUE)
+                obj = read_obj(&r, K_TYPE)
+                obj = c_api.gcc_jit_context_new_cast(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_rvalue *>target,
+                    <c_api.gcc_jit_type *>obj)
+            elif opcode == OP_NEW_ARRAY_ACCESS:
+                target = read_obj(&r, K_RVALUE)
+                obj = read_obj(&r, K_RVALUE)
+                obj = c_api.gcc_jit_context_new_array_access(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_rvalue *>target,
+                    <c_api.gcc_jit_rvalue *>obj)
+            elif opcode == OP_NEW_CALL:
+                target = read_obj(&r, K_FUNCTION)
+                objs = read_objs(&r, &count, K_RVALUE)
+                obj = c_api.gcc_jit_context_new_call(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_function *>target,
+                    count, <c_api.gcc_jit_rvalue **>objs)
+            elif opcode == OP_NEW_CALL_THROUGH_PTR:
+                target = read_obj(&r, K_RVALUE)
+                objs = read_objs(&r, &count, K_RVALUE)
+                obj = c_api.gcc_jit_context_new_call_through_ptr(
+                    c_ctxt, <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_rvalue *>target,
+                    count, <c_api.gcc_jit_rvalue **>objs)
+            elif opcode == OP_GET_POINTER:
+                obj = c_api.gcc_jit_type_get_pointer(
+                    <c_api.gcc_jit_type *>target)
+            elif opcode == OP_GET_CONST:
+                obj = c_api.gcc_jit_type_get_const(
+                    <c_api.gcc_jit_type *>target)
+            elif opcode == OP_GET_VOLATILE:
+                obj = c_api.gcc_jit_type_get_volatile(
+                    <c_api.gcc_jit_type *>target)
+            elif opcode == OP_SET_FIELDS:
+                objs = read_objs(&r, &count, K_FIELD)
+                c_api.gcc_jit_struct_set_fields(
+                    <c_api.gcc_jit_struct *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    count, <c_api.gcc_jit_field **>objs)
+                free(objs)
+                continue
+            elif opcode == OP_DEREFERENCE_FIELD:
+                obj = read_obj(&r, K_FIELD)
+                obj = c_api.gcc_jit_rvalue_dereference_field(
+                    <c_api.gcc_jit_rvalue *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_field *>obj)
+            elif opcode == OP_DEREFERENCE:
+                obj = c_api.gcc_jit_rvalue_dereference(
+                    <c_api.gcc_jit_rvalue *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION))
+            elif opcode == OP_RVALUE_ACCESS_FIELD:
+                obj = read_obj(&r, K_FIELD)
+                obj = c_api.gcc_jit_rvalue_access_field(
+                    <c_api.gcc_jit_rvalue *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_field *>obj)
+            elif opcode == OP_RVALUE_GET_TYPE:
+                obj = c_api.gcc_jit_rvalue_get_type(
+                    <c_api.gcc_jit_rvalue *>target)
+            elif opcode == OP_GET_ADDRESS:
+                obj = c_api.gcc_jit_lvalue_get_address(
+                    <c_api.gcc_jit_lvalue *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION))
+            elif opcode == OP_LVALUE_ACCESS_FIELD:
+                obj = read_obj(&r, K_FIELD)
+                obj = c_api.gcc_jit_lvalue_access_field(
+                    <c_api.gcc_jit_lvalue *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_field *>obj)
+            elif opcode == OP_NEW_LOCAL:
+                obj = read_obj(&r, K_TYPE)
+                name = read_str(&r, strings)
+                obj = c_api.gcc_jit_function_new_local(
+                    <c_api.gcc_jit_function *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_type *>obj, name)
+            elif opcode == OP_NEW_BLOCK:
+                obj = c_api.gcc_jit_function_new_block(
+                    <c_api.gcc_jit_function *>target, read_str(&r, strings))
+            elif opcode == OP_GET_PARAM:
+                obj = c_api.gcc_jit_function_get_param(
+                    <c_api.gcc_jit_function *>target, <int>read_int(&r))
+            elif opcode == OP_ADD_EVAL:
+                obj = read_obj(&r, K_RVALUE)
+                c_api.gcc_jit_block_add_eval(
+                    <c_api.gcc_jit_block *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_rvalue *>obj)
+                continue
+            elif opcode == OP_ADD_ASSIGNMENT:
+                tmp[0] = read_obj(&r, K_LVALUE)
+                tmp[1] = read_obj(&r, K_RVALUE)
+                c_api.gcc_jit_block_add_assignment(
+                    <c_api.gcc_jit_block *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_lvalue *>tmp[0],
+                    <c_api.gcc_jit_rvalue *>tmp[1])
+                continue
+            elif opcode == OP_ADD_ASSIGNMENT_OP:
+                tmp[0] = read_obj(&r, K_LVALUE)
+                kind = read_int(&r)
+                tmp[1] = read_obj(&r, K_RVALUE)
+                c_api.gcc_jit_block_add_assignment_op(
+                    <c_api.gcc_jit_block *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_lvalue *>tmp[0],
+                    <c_api.gcc_jit_binary_op>kind,
+                    <c_api.gcc_jit_rvalue *>tmp[1])
+                continue
+            elif opcode == OP_ADD_COMMENT:
+                name = read_str(&r, strings)
+                c_api.gcc_jit_block_add_comment(
+                    <c_api.gcc_jit_block *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION), name)
+                continue
+            elif opcode == OP_END_WITH_CONDITIONAL:
+                tmp[0] = read_obj(&r, K_RVALUE)
+                tmp[1] = read_obj(&r, K_BLOCK)
+                tmp[2] = read_obj(&r, K_BLOCK)
+                c_api.gcc_jit_block_end_with_conditional(
+                    <c_api.gcc_jit_block *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_rvalue *>tmp[0],
+                    <c_api.gcc_jit_block *>tmp[1],
+                    <c_api.gcc_jit_block *>tmp[2])
+                continue
+            elif opcode == OP_END_WITH_JUMP:
+                obj = read_obj(&r, K_BLOCK)
+                c_api.gcc_jit_block_end_with_jump(
+                    <c_api.gcc_jit_block *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_block *>obj)
+                continue
+            elif opcode == OP_END_WITH_RETURN:
+                obj = read_obj(&r, K_RVALUE)
+                c_api.gcc_jit_block_end_with_return(
+                    <c_api.gcc_jit_block *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION),
+                    <c_api.gcc_jit_rvalue *>obj)
+                continue
+            elif opcode == OP_END_WITH_VOID_RETURN:
+                c_api.gcc_jit_block_end_with_void_return(
+                    <c_api.gcc_jit_block *>target,
+                    <c_api.gcc_jit_location *>read_obj(&r, K_LOCATION))
+                continue
+            elif opcode == OP_GET_FUNCTION:
+                obj = c_api.gcc_jit_block_get_function(
+                    <c_api.gcc_jit_block *>target)
+            elif opcode == OP_SET_MAP_FORMATS:
+                name = read_str(&r, strings)
+                in_format = read_str(&r, strings)
+                out_format = read_str(&r, strings)
+                if name == NULL:
+                    r.bad = True
+                if not r.bad:
+                    ctxt._map_formats[<bytes>name] = (
+                        format_from_c(in_format), format_from_c(out_format))
+                continue
+            else:
+                r.bad = True
+                break
+            free(objs)
+            if r.bad:
+                break
+            if obj == NULL:
+                raise Error(get_last_error(c_ctxt))
+            add_obj(&r, obj, get_created_kinds(opcode))
+        if r.bad:
+            raise Error(b'malformed recording')
+        if c_api.gcc_jit_context_get_first_error(c_ctxt):
+            raise Error(ctxt.get_first_error())
+    finally:
+        free(r.objects)
+        free(r.kinds)
+
+# Locations are needed by these options, so aren't deferred whilst any
+# of them is enabled (see Context.set_lazy_locations).
+_LOCATION_OPTIONS = (c_api.GCC_JIT_BOOL_OPTION_DEBUGINFO,
+                     c_api.GCC_JIT_BOOL_OPTION_DUMP_INITIAL_TREE,
+                     c_api.GCC_JIT_BOOL_OPTION_DUMP_INITIAL_GIMPLE,
+                     c_api.GCC_JIT_BOOL_OPTION_DUMP_GENERATED_CODE,
+                     c_api.GCC_JIT_BOOL_OPTION_DUMP_SUMMARY,
+                     c_api.GCC_JIT_BOOL_OPTION_DUMP_EVERYTHING)
+
+# The prefix of the name of the global counting calls to a function, for
+# Context.set_profiling.
+_PROFILE_COUNTER_PREFIX = b'__pygccjit_calls_'
+
+# Ints within this range are interned by new_rvalue_from_int.
+cdef enum:
+    _MIN_INTERNED_INT = -256
+    _MAX_INTERNED_INT = 1024
+
+# The garbage collector must not clear a child's reference to its parent
+# when breaking a reference cycle, or the parent could be released first.
+@cython.no_gc_clear
 cdef class Context:
     cdef c_api.gcc_jit_context* _c_ctxt
+    cdef dict _options
+    cdef dict _interned
+    cdef Context _parent
+    cdef object _children
+    cdef object __weakref__
+    cdef _LogFile _log
+    # For CompileStats: counts of objects created by wrapper class, the
+    # names of exported functions, and when the context was created
+    cdef dict _object_counts
+    cdef list _exported
+    cdef double _created
+    cdef _Recorder _recorder
+    # See set_lazy_locations: whether it's enabled, and whether locations
+    # are currently being deferred
+    cdef bint _lazy_locations
+    cdef bint _defer_locations
+    # See set_profiling: the counters of profiled functions that don't
+    # have an entry block yet, by address of function (None if profiling
+    # is disabled), and the (function name, counter name) pairs
+    cdef dict _profile_counters
+    cdef list _profiled
+    # The value of each double constant, in order of creation: the dump
+    # used by get_fingerprint rounds them
+    cdef list _doubles
+    # See set_map_formats
+    cdef dict _map_formats
 
     def __cinit__(self, acquire=True):
+        self._options = {}
+        self._interned = {}
+        self._children = weakref.WeakSet()
+        self._object_counts = {}
+        self._exported = []
+        self._profiled = []
+        self._doubles = []
+        self._map_formats = {}
+        self._created = time.perf_counter()
         if acquire:
-            self._c_ctxt = c_api.gcc_jit_context_acquire()
+            self._set_c_context(c_api.gcc_jit_context_acquire())
         else:
             self._c_ctxt = NULL
 
+    cdef _set_c_context(self, c_api.gcc_jit_context *c_ctxt):
+        self._c_ctxt = c_ctxt
+        _contexts[<size_t>c_ctxt] = weakref.ref(self)
+
     def __dealloc__(self):
+        # Any children hold a reference to us, so are already gone.
+        if self._c_ctxt != NULL:
+            _contexts.pop(<size_t>self._c_ctxt, None)
+            c_api.gcc_jit_context_release(self._c_ctxt)
+
+    def close(self):
+        """close(self)
+
+        Release the underlying gcc_jit_context, and those of any child
+        contexts, now rather than when the Context is garbage-collected.
+        Using the Context or any object created within it afterwards
+        (other than to close it again) raises gccjit.Error.
+        """
+        if self._c_ctxt == NULL:
+            return
+        for child in list(self._children):
+            child.close()
+        _contexts.pop(<size_t>self._c_ctxt, None)
+        self._interned.clear()
         c_api.gcc_jit_context_release(self._c_ctxt)
+        self._c_ctxt = NULL
+        self._log = None
+
+    cdef int _check_open(self) except -1:
+        if self._c_ctxt == NULL:
+            raise Error(b'context is closed')
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    property closed:
+        """Whether close() has been called"""
+        def __get__(self):
+            return self._c_ctxt == NULL
 
     def set_str_option(self, opt, val):
         """set_int_option(self, opt:StrOption, val:str)"""
+        self._check_open()
         c_api.gcc_jit_context_set_str_option(self._c_ctxt, opt, val)
+        self._options[('str', opt)] = val
+        if self._recorder is not None:
+            self._recorder.record(OP_SET_STR_OPTION, None, (opt, val))
 
     def set_bool_option(self, opt, val):
         """set_int_option(self, opt:BoolOption, val:bool)"""
+        self._check_open()
         c_api.gcc_jit_context_set_bool_option(self._c_ctxt, opt, val)
+        self._options[('bool', opt)] = bool(val)
+        self._update_defer_locations()
+        if self._recorder is not None:
+            self._recorder.record(OP_SET_BOOL_OPTION, None, (opt, val))
 
     def set_int_option(self, opt, val):
         """set_int_option(self, opt:IntOption, val:int)"""
+        self._check_open()
         c_api.gcc_jit_context_set_int_option(self._c_ctxt, opt, val)
+        self._options[('int', opt)] = val
+        if self._recorder is not None:
+            self._recorder.record(OP_SET_INT_OPTION, None, (opt, val))
+
+    def set_lazy_locations(self, lazy):
+        """set_lazy_locations(self, lazy:bool)
+
+        If lazy, new_location only creates a location within libgccjit
+        when it is first used whilst debuginfo or a dump option is
+        enabled; otherwise the location is silently dropped.
+        """
+        self._lazy_locations = bool(lazy)
+        self._update_defer_locations()
+
+    def set_profiling(self, enabled):
+        """set_profiling(self, enabled:bool)
+
+        If enabled, each exported or internal function created from now
+        on counts its calls, in an exported global incremented at the
+        start of its first block, for use by Result.get_profile.
+        """
+        if not enabled:
+            self._profile_counters = None
+        elif self._profile_counters is None:
+            self._profile_counters = {}
+
+    cdef _update_defer_locations(self):
+        cdef bint wanted = False
+        if self._lazy_locations:
+            for opt in _LOCATION_OPTIONS:
+                if self._options.get(('bool', opt)):
+                    wanted = True
+        self._defer_locations = self._lazy_locations and not wanted
 
     def get_type(self, type_enum):
         """get_type(self, type_enum:TypeKind) -> Type"""
-        return Type_from_c(self._c_ctxt,
-                           c_api.gcc_jit_context_get_type(self._c_ctxt, type_enum))
+        self._check_open()
+        key = ('type', type_enum)
+        t = get_interned(self._interned, key)
+        if t is None:
+            t = Type_from_c(self._c_ctxt,
+                            c_api.gcc_jit_context_get_type(self._c_ctxt, type_enum))
+            (<Type>t).format = _TYPE_FORMATS.get(type_enum)
+            self._interned[key] = weakref.ref(t)
+            if self._recorder is not None:
+                self._recorder.record(OP_GET_TYPE, None, (type_enum,), t)
+        return t
 
     def get_int_type(self, num_bytes, is_signed):
         """get_int_type(self, num_bytes:int, is_signed:bool) -> Type"""
-        return Type_from_c(self._c_ctxt,
-                           c_api.gcc_jit_context_get_int_type(self._c_ctxt, num_bytes, is_signed))
-
-    def compile(self):
-        """compile(self) -> Result"""
+        self._check_open()
+        key = ('int_type', num_bytes, bool(is_signed))
+        t = get_interned(self._interned, key)
+        if t is None:
+            t = Type_from_c(self._c_ctxt,
+                            c_api.gcc_jit_context_get_int_type(self._c_ctxt, num_bytes, is_signed))
+            fmt = _INT_TYPE_FORMATS.get(num_bytes)
+            if fmt is not None and not is_signed:
+                fmt = fmt.upper()
+            (<Type>t).format = fmt
+            self._interned[key] = weakref.ref(t)
+            if self._recorder is not None:
+                self._recorder.record(OP_GET_INT_TYPE, None,
+                                      (num_bytes, is_signed), t)
+        return t
+
+    def compile(self, stats=False, perf_map=False):
+        """compile(self, stats:bool=False, perf_map:bool=False) -> Result
+
+        If stats is true (or any compile hooks are registered), the
+        Result's "stats" attribute is a CompileStats.
+
+        If perf_map is true, the exported functions are listed in
+        /tmp/perf-<pid>.map for the "perf" profiler until the Result is
+        closed (or, once it has been garbage-collected, until the map is
+        next updated)."""
         cdef c_api.gcc_jit_result *c_result
-        c_result = c_api.gcc_jit_context_compile(self._c_ctxt)
+        cdef Result r
+        cdef double start
+        self._check_open()
+        stats = stats or bool(_compile_hooks)
+        if stats:
+            s = CompileStats()
+            s.build_time = time.perf_counter() - self._created
+            rss_before = get_peak_rss()
+            start = time.perf_counter()
+        # Don't hold the GIL whilst GCC runs, so that other Python threads
+        # can make progress.  The context itself must not be touched by
+        # other threads during this call.
+        with nogil:
+            c_result = c_api.gcc_jit_context_compile(self._c_ctxt)
         if c_result == NULL:
             raise Error(self.get_first_error())
         r = Result()
         r._set_c_ptr(c_result)
+        r._exported = self._get_exported()
+        r._profiled = self._get_profiled()
+        r._map_formats = self.get_map_formats()
+        # The result logs to the same place as the context.
+        r._log = self._log
+        if perf_map:
+            r._perf_map_lines = add_perf_map_entries(c_result, r._exported)
+        if stats:
+            s.compile_time = time.perf_counter() - start
+            if rss_before is not None:
+                s.peak_rss_delta = get_peak_rss() - rss_before
+            s.opt_level = self._options.get(('int', IntOption.OPTIMIZATION_LEVEL), 0)
+            ctxt = self
+            while ctxt is not None:
+                for cls, count in ctxt._object_counts.items():
+                    s.object_counts[cls.__name__] = \
+                        s.object_counts.get(cls.__name__, 0) + count
+                for name in ctxt._exported:
+                    s.function_sizes[name] = pygccjit_get_symbol_size(
+                        c_api.gcc_jit_result_get_code(c_result, name))
+                ctxt = ctxt._parent
+            r.stats = s
+            for hook in list(_compile_hooks):
+                hook(self, r, s)
         return r
 
+    cdef tuple _get_exported(self):
+        # The names of exported functions visible to a compile of this
+        # context, outermost ancestor first, in order of creation
+        cdef list names = []
+        ctxt = self
+        while ctxt is not None:
+            names[0:0] = ctxt._exported
+            ctxt = ctxt._parent
+        return tuple(names)
+
+    cdef tuple _get_profiled(self):
+        # As per _get_exported, for the profiled functions
+        cdef list profiled = []
+        ctxt = self
+        while ctxt is not None:
+            profiled[0:0] = ctxt._profiled
+            ctxt = ctxt._parent
+        return tuple(profiled)
+
+    def get_profiled_functions(self):
+        """get_profiled_functions(self) -> tuple
+
+        Get a (function name, counter name) pair for each function
+        profiled within this context and its ancestors (see
+        set_profiling), for use with LibraryResult."""
+        return self._get_profiled()
+
+    def set_map_formats(self, name, in_format, out_format):
+        """set_map_formats(self, name:bytes, in_format:str, out_format:str) -> None
+
+        Record the element types of the loop function "name", as built
+        by gccjit.make_map_function, as struct module format characters
+        (or None if unknown), so that Result.map can check the buffers
+        that it is given against them."""
+        self._map_formats[name] = (in_format, out_format)
+        if self._recorder is not None:
+            self._recorder.record(OP_SET_MAP_FORMATS, None,
+                                  (name, format_to_bytes(in_format),
+                                   format_to_bytes(out_format)))
+
+    def get_map_formats(self):
+        """get_map_formats(self) -> dict
+
+        Get the element formats recorded by set_map_formats within this
+        context and its ancestors, as a dict mapping each function name
+        to an (in_format, out_format) pair."""
+        formats = {}
+        ctxt = self
+        while ctxt is not None:
+            for name, pair in ctxt._map_formats.items():
+                formats.setdefault(name, pair)
+            ctxt = ctxt._parent
+        return formats
+
     def compile_to_file(self, kind, path):
         """compile_to_file(self, OutputKind:kind, path) -> None"""
-        c_api.gcc_jit_context_compile_to_file(self._c_ctxt, kind, path)
+        cdef c_api.gcc_jit_output_kind c_kind = kind
+        cdef char *c_path = path
+        self._check_open()
+        with nogil:
+            c_api.gcc_jit_context_compile_to_file(self._c_ctxt, c_kind, c_path)
+        if c_api.gcc_jit_context_get_first_error(self._c_ctxt):
+            raise Error(self.get_first_error())
+
+    def compile_async(self, executor=None, stats=False, perf_map=False):
+        """compile_async(self, executor=None, stats:bool=False, perf_map:bool=False) -> asyncio.Future of Result"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(executor, self.compile, stats, perf_map)
+
+    def compile_to_file_async(self, kind, path, executor=None):
+        """compile_to_file_async(self, kind:OutputKind, path, executor=None) -> asyncio.Future"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(executor, self.compile_to_file, kind, path)
 
     def dump_to_file(self, path, update_locations):
+        self._check_open()
         c_api.gcc_jit_context_dump_to_file(self._c_ctxt, path, update_locations)
 
+    def get_fingerprint(self):
+        """get_fingerprint(self) -> str
+
+        Get a hex digest identifying the code within this context, the
+        options set on it, and the version of libgccjit, for use as a key
+        when caching the results of compiling it."""
+        import hashlib
+        import os
+        import re
+        import tempfile
+        fd, path = tempfile.mkstemp(suffix='.c')
+        os.close(fd)
+        try:
+            self.dump_to_file(path.encode('utf-8'), False)
+            with open(path, 'rb') as f:
+                dump = f.read()
+        finally:
+            os.unlink(path)
+
+        # Unnamed blocks are dumped using their address; number them
+        # in order of appearance instead, so that the dump is the same
+        # from one process to the next.
+        block_ids = {}
+        def number_block(m):
+            return b'<UNNAMED BLOCK %i>' % block_ids.setdefault(m.group(0),
+                                                              len(block_ids))
+        dump = re.sub(rb'<UNNAMED BLOCK 0x[0-9a-fA-F]+>', number_block, dump)
+
+        h = hashlib.sha256()
+        h.update(repr(get_libgccjit_version()).encode('utf-8'))
+        h.update(repr(sorted(self._options.items())).encode('utf-8'))
+        # The dump only covers this context, not its parent.
+        if self._parent is not None:
+            h.update(self._parent.get_fingerprint().encode('ascii'))
+        h.update(dump)
+        # The dump prints doubles with "%f", losing all but six decimal
+        # places, so hash their exact values too.
+        for d in self._doubles:
+            h.update(float.hex(d).encode('ascii'))
+        return h.hexdigest()
+
     def get_first_error(self):
         cdef char *err = c_api.gcc_jit_context_get_first_error(self._c_ctxt)
         if err:
@@ -87,23 +1404,130 @@ cdef class Context:
         return None
 
     def dump_reproducer_to_file(self, path):
+        self._check_open()
         c_api.gcc_jit_context_dump_reproducer_to_file(self._c_ctxt, path)
 
     def set_logfile(self, f):
-        cdef c_api.FILE *c_fileptr = c_api.fdopen(f.fileno(), "w")
+        """set_logfile(self, f:file or None)
+
+        Log the activity of this context (and its children and results)
+        to the given file object, or stop logging if f is None."""
+        self._check_open()
+        if f is None:
+            self._set_log(None)
+            return
+        f.flush()
+        self._set_log(LogFile_from_fd(f.fileno()))
+
+    def capture_log(self):
+        """capture_log(self)
+
+        Log the activity of this context (and its children and results)
+        to an in-memory buffer, readable via get_log."""
+        self._check_open()
+        self._set_log(LogFile_in_memory())
+
+    def get_log(self):
+        """get_log(self) -> bytes or None
+
+        Get everything logged so far after a call to capture_log, or None
+        if the log isn't being captured."""
+        if self._log is None or not self._log._in_memory:
+            return None
+        return self._log.get_contents()
+
+    def start_recording(self):
+        """start_recording(self)
+
+        Record each call made from now on to build IR within this
+        context, for use by get_recording.  This must be called before
+        any objects are created within the context.
+        """
+        if self._recorder is not None:
+            return
+        if self._object_counts:
+            raise Error(b'recording must start before any objects are created')
+        self._recorder = _Recorder()
+        # Options set so far are part of the recording.
+        for (kind, opt), val in sorted(self._options.items()):
+            if kind == 'str':
+                self._recorder.record(OP_SET_STR_OPTION, None, (opt, val))
+            elif kind == 'bool':
+                self._recorder.record(OP_SET_BOOL_OPTION, None, (opt, val))
+            else:
+                self._recorder.record(OP_SET_INT_OPTION, None, (opt, val))
+
+    def get_recording(self):
+        """get_recording(self) -> bytes
+
+        Get the calls recorded since start_recording, serialized as
+        bytes, for use with Context.replay.
+        """
+        if self._recorder is None:
+            raise Error(b'context is not recording')
+        return self._recorder.serialize()
+
+    def replay(self, recording):
+        """replay(self, recording:bytes)
+
+        Rebuild the IR recorded by get_recording within this context.
+        The calls are made directly against libgccjit, so no wrapper
+        objects are created for what they build.
+        """
+        cdef array.array codes
+        self._check_open()
+        if self._recorder is not None:
+            raise Error(b'cannot replay into a context that is recording')
+        try:
+            data = marshal.loads(recording)
+        except (EOFError, ValueError, TypeError):
+            raise Error(b'malformed recording')
+        if (not isinstance(data, tuple) or len(data) != 5
+            or data[0] != _RECORDING_VERSION or data[1] != sys.byteorder):
+            raise Error(b'unsupported recording')
+        _, _, num_objects, code_bytes, strings = data
+        codes = array.array('q')
+        try:
+            codes.frombytes(code_bytes)
+        except (ValueError, TypeError):
+            raise Error(b'malformed recording')
+        if not isinstance(strings, list):
+            raise Error(b'malformed recording')
+        # Every object takes at least one code to create, which bounds
+        # the size of the table that replay_ops allocates for them.
+        if (not isinstance(num_objects, int)
+            or not 0 <= num_objects <= len(codes)):
+            raise Error(b'malformed recording')
+        replay_ops(self, codes, strings, num_objects)
+
+    cdef _set_log(self, _LogFile log):
         c_api.gcc_jit_context_set_logfile(self._c_ctxt,
-                                          c_fileptr,
+                                          log._c_file if log is not None else NULL,
                                           0,
                                           0)
-        # FIXME: no good way to clean this up, beyond a flag
-        # for the context to take ownership of the FILE *.
+        # Keep any previous _LogFile alive until now, as libgccjit may
+        # have logged to it whilst switching.
+        self._log = log
 
     def new_location(self, filename, line, column):
         """new_location(self, filename:str, line:int, column:int) -> Location"""
-        cdef c_api.gcc_jit_location *c_loc
-        c_loc = c_api.gcc_jit_context_new_location(self._c_ctxt, filename, line, column)
-        loc = Location()
-        loc._set_c_location(c_loc)
+        cdef Location loc
+        self._check_open()
+        key = ('location', filename, line, column)
+        loc = get_interned(self._interned, key)
+        if loc is None:
+            loc = Location()
+            loc._filename = filename
+            loc._line = line
+            loc._column = column
+            set_owner(loc, self)
+            # Recordings refer to locations by address, so need them now.
+            if not self._defer_locations or self._recorder is not None:
+                loc._materialize()
+            self._interned[key] = weakref.ref(loc)
+            if self._recorder is not None:
+                self._recorder.record(OP_NEW_LOCATION, None,
+                                      (filename, line, column), loc)
         return loc
 
     def new_global(self, kind, Type type_, name, Location loc=None):
@@ -113,7 +1537,11 @@ cdef class Context:
                                                     kind,
                                                     type_._get_c_type(),
                                                     name)
-        return LValue_from_c(self._c_ctxt, c_lvalue)
+        lvalue = LValue_from_c(self._c_ctxt, c_lvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_GLOBAL, None,
+                                  (kind, type_, name, loc), lvalue)
+        return lvalue
 
     def new_array_type(self, Type element_type, int num_elements, Location loc=None):
         """new_array_type(self, element_type:Type, num_elements:int, loc:Location=None) -> Type"""
@@ -121,8 +1549,12 @@ cdef class Context:
                                                       get_c_location(loc),
                                                       element_type._get_c_type(),
                                                       num_elements)
-        return Type_from_c(self._c_ctxt,
-                           c_type)
+        t = Type_from_c(self._c_ctxt,
+                        c_type)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_ARRAY_TYPE, None,
+                                  (element_type, num_elements, loc), t)
+        return t
 
     def new_field(self, Type type_, name, Location loc=None):
         """new_field(self, type_:Type, name:str, loc:Location=None) -> Field"""
@@ -132,6 +1564,9 @@ cdef class Context:
                                                   name)
         field = Field()
         field._set_c_field(c_field)
+        set_owner(field, self)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_FIELD, None, (type_, name, loc), field)
         return field
 
     def new_struct(self, name, fields=None, Location loc=None):
@@ -140,6 +1575,7 @@ cdef class Context:
         cdef c_api.gcc_jit_field **c_fields = NULL
         cdef Field field
         cdef c_api.gcc_jit_struct *c_struct
+        self._check_open()
 
         if fields is None:
             c_struct = c_api.gcc_jit_context_new_opaque_struct(self._c_ctxt,
@@ -165,7 +1601,11 @@ cdef class Context:
                                                              c_fields)
         py_struct = Struct()
         py_struct._set_c_struct(c_struct)
+        set_owner(py_struct, self)
         free(c_fields)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_STRUCT, None, (name, fields, loc),
+                                  py_struct)
         return py_struct
 
     def new_union(self, name, fields=None, Location loc=None):
@@ -174,6 +1614,7 @@ cdef class Context:
         cdef c_api.gcc_jit_field **c_fields = NULL
         cdef Field field
         cdef c_api.gcc_jit_type *c_type
+        self._check_open()
 
         fields = list(fields)
         num_fields = len(fields)
@@ -194,7 +1635,11 @@ cdef class Context:
                                                       c_fields)
         py_type = Type()
         py_type._set_c_type(c_type)
+        set_owner(py_type, self)
         free(c_fields)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_UNION, None, (name, fields, loc),
+                                  py_type)
         return py_type
 
     def new_function_ptr_type(self, Type return_type, param_types, Location loc=None, is_variadic=False):
@@ -224,7 +1669,12 @@ cdef class Context:
                                                                      is_variadic)
         py_type = Type()
         py_type._set_c_type(c_fn_ptr_type)
+        set_owner(py_type, self)
         free(c_param_types)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_FUNCTION_PTR_TYPE, None,
+                                  (return_type, param_types, loc, is_variadic),
+                                  py_type)
         return py_type
 
     def new_param(self, Type type_, name, Location loc=None):
@@ -233,7 +1683,10 @@ cdef class Context:
                                                    get_c_location(loc),
                                                    type_._get_c_type(),
                                                    name)
-        return Param_from_c(self._c_ctxt, c_result)
+        param = Param_from_c(self._c_ctxt, c_result)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_PARAM, None, (type_, name, loc), param)
+        return param
 
     def new_function(self, kind, Type return_type, name, params,
                      Location loc=None,
@@ -258,56 +1711,106 @@ cdef class Context:
                                                         c_params,
                                                         is_variadic)
         free(c_params)
-        return Function_from_c(self._c_ctxt, c_function)
+        fn = Function_from_c(self._c_ctxt, c_function)
+        if kind == FunctionKind.EXPORTED:
+            self._exported.append(name)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_FUNCTION, None,
+                                  (kind, return_type, name, params, loc,
+                                   is_variadic),
+                                  fn)
+        if (self._profile_counters is not None
+            and kind in (c_api.GCC_JIT_FUNCTION_EXPORTED,
+                         c_api.GCC_JIT_FUNCTION_INTERNAL)):
+            counter_name = _PROFILE_COUNTER_PREFIX + name
+            self._profile_counters[<size_t>fn._c_object] = \
+                self.new_global(c_api.GCC_JIT_GLOBAL_EXPORTED,
+                                self.get_type(c_api.GCC_JIT_TYPE_LONG_LONG),
+                                counter_name)
+            self._profiled.append((name, counter_name))
+        return fn
 
     def get_builtin_function(self, name):
         """get_builtin_function(self, name:str) -> Function"""
+        self._check_open()
         c_function = c_api.gcc_jit_context_get_builtin_function (self._c_ctxt, name)
-        return Function_from_c(self._c_ctxt, c_function)
+        fn = Function_from_c(self._c_ctxt, c_function)
+        if self._recorder is not None:
+            self._recorder.record(OP_GET_BUILTIN_FUNCTION, None, (name,), fn)
+        return fn
 
     def zero(self, Type type_):
         """zero(self, type_:Type) -> RValue"""
-        c_rvalue = c_api.gcc_jit_context_zero(self._c_ctxt,
-                                              type_._get_c_type())
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        return self.new_rvalue_from_int(type_, 0)
 
     def one(self, Type type_):
         """one(self, type_:Type) -> RValue"""
-        c_rvalue = c_api.gcc_jit_context_one(self._c_ctxt,
-                                             type_._get_c_type())
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        return self.new_rvalue_from_int(type_, 1)
 
     def new_rvalue_from_double(self, Type numeric_type, double value):
         """new_rvalue_from_double(self, numeric_type:Type, value:float) -> RValue"""
         c_rvalue = c_api.gcc_jit_context_new_rvalue_from_double(self._c_ctxt,
                                                                 numeric_type._get_c_type(),
                                                                 value)
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        rvalue = RValue_from_c(self._c_ctxt, c_rvalue)
+        self._doubles.append(value)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_RVALUE_FROM_DOUBLE, None,
+                                  (numeric_type, value), rvalue)
+        return rvalue
 
     def new_rvalue_from_int(self, Type type_, int value):
         """new_rvalue_from_int(self, type_:Type, value:int) -> RValue"""
-        c_rvalue = c_api.gcc_jit_context_new_rvalue_from_int(self._c_ctxt,
-                                                             type_._get_c_type(),
-                                                             value)
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        if not _MIN_INTERNED_INT <= value <= _MAX_INTERNED_INT:
+            c_rvalue = c_api.gcc_jit_context_new_rvalue_from_int(self._c_ctxt,
+                                                                 type_._get_c_type(),
+                                                                 value)
+            rvalue = RValue_from_c(self._c_ctxt, c_rvalue)
+            if self._recorder is not None:
+                self._recorder.record(OP_NEW_RVALUE_FROM_INT, None,
+                                      (type_, value), rvalue)
+            return rvalue
+        key = ('int', <size_t>type_._get_c_type(), value)
+        rvalue = get_interned(self._interned, key)
+        if rvalue is None:
+            c_rvalue = c_api.gcc_jit_context_new_rvalue_from_int(self._c_ctxt,
+                                                                 type_._get_c_type(),
+                                                                 value)
+            rvalue = RValue_from_c(self._c_ctxt, c_rvalue)
+            self._interned[key] = weakref.ref(rvalue)
+            if self._recorder is not None:
+                self._recorder.record(OP_NEW_RVALUE_FROM_INT, None,
+                                      (type_, value), rvalue)
+        return rvalue
 
     def new_rvalue_from_ptr(self, Type pointer_type, long long value):
         c_rvalue = c_api.gcc_jit_context_new_rvalue_from_ptr(self._c_ctxt,
                                                              pointer_type._get_c_type(),
                                                              <void *>value)
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        rvalue = RValue_from_c(self._c_ctxt, c_rvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_RVALUE_FROM_PTR, None,
+                                  (pointer_type, value), rvalue)
+        return rvalue
 
     def null(self, Type pointer_type):
         """null(self, pointer_type:Type) -> RValue"""
         c_rvalue = c_api.gcc_jit_context_null(self._c_ctxt,
                                               pointer_type._get_c_type())
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        rvalue = RValue_from_c(self._c_ctxt, c_rvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NULL, None, (pointer_type,), rvalue)
+        return rvalue
 
     def new_string_literal(self, char *value):
         """new_string_literal(self, value:str) -> RValue"""
+        self._check_open()
         c_rvalue = c_api.gcc_jit_context_new_string_literal(self._c_ctxt,
                                                             value)
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        rvalue = RValue_from_c(self._c_ctxt, c_rvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_STRING_LITERAL, None, (value,), rvalue)
+        return rvalue
 
     def new_unary_op(self, op, Type result_type, RValue rvalue, Location loc=None):
         """new_unary_op(self, op:UnaryOp, result_type:Type, rvalue:RValue, loc:Location=None) -> RValue"""
@@ -316,7 +1819,11 @@ cdef class Context:
                                                        op,
                                                        result_type._get_c_type(),
                                                        rvalue._get_c_rvalue())
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        result = RValue_from_c(self._c_ctxt, c_rvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_UNARY_OP, None,
+                                  (op, result_type, rvalue, loc), result)
+        return result
 
     def new_binary_op(self, op, Type result_type, RValue a, RValue b, Location loc=None):
         """new_binary_op(self, op:BinaryOp, result_type:Type, a:RValue, b:RValue, loc:Location=None) -> RValue"""
@@ -326,7 +1833,40 @@ cdef class Context:
                                                        result_type._get_c_type(),
                                                        a._get_c_rvalue(),
                                                        b._get_c_rvalue())
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        rvalue = RValue_from_c(self._c_ctxt, c_rvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_BINARY_OP, None,
+                                  (op, result_type, a, b, loc), rvalue)
+        return rvalue
+
+    def new_binary_ops(self, ops):
+        """new_binary_ops(self, ops:iterable of tuple) -> list of RValue
+
+        Bulk version of new_binary_op, taking a sequence of
+        (op, result_type, a, b[, loc]) tuples.
+        """
+        cdef tuple t
+        cdef Type result_type
+        cdef RValue a, b
+        result = []
+        for t in ops:
+            result_type = t[1]
+            a = t[2]
+            b = t[3]
+            c_rvalue = c_api.gcc_jit_context_new_binary_op(self._c_ctxt,
+                                                           get_c_location(get_tuple_location(t, 4)),
+                                                           t[0],
+                                                           result_type._get_c_type(),
+                                                           a._get_c_rvalue(),
+                                                           b._get_c_rvalue())
+            rvalue = RValue_from_c(self._c_ctxt, c_rvalue)
+            if self._recorder is not None:
+                self._recorder.record(OP_NEW_BINARY_OP, None,
+                                      (t[0], result_type, a, b,
+                                       get_tuple_location(t, 4)),
+                                      rvalue)
+            result.append(rvalue)
+        return result
 
     def new_comparison(self, op, RValue a, RValue b, Location loc=None):
         """new_comparison(self, op:Comparison, a:RValue, b:RValue, loc:Location=None) -> RValue"""
@@ -336,16 +1876,31 @@ cdef class Context:
                                                         a._get_c_rvalue(),
                                                         b._get_c_rvalue())
 
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        rvalue = RValue_from_c(self._c_ctxt, c_rvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_COMPARISON, None, (op, a, b, loc),
+                                  rvalue)
+        return rvalue
 
     def new_child_context(self):
         """new_child_context(self) -> Context"""
+        self._check_open()
         c_child_ctxt = c_api.gcc_jit_context_new_child_context(self._c_ctxt)
         if c_child_ctxt == NULL:
             raise Exception("Unknown error creating child context.")
 
         py_child_ctxt = Context(acquire=False)
-        py_child_ctxt._c_ctxt = c_child_ctxt
+        py_child_ctxt._set_c_context(c_child_ctxt)
+        py_child_ctxt._parent = self
+        # libgccjit gives the child the parent's logger.
+        py_child_ctxt._log = self._log
+        # libgccjit copies the parent's options into the child.
+        py_child_ctxt._options = dict(self._options)
+        py_child_ctxt._lazy_locations = self._lazy_locations
+        py_child_ctxt._defer_locations = self._defer_locations
+        if self._profile_counters is not None:
+            py_child_ctxt._profile_counters = {}
+        self._children.add(py_child_ctxt)
         return py_child_ctxt
 
     def new_cast(self, RValue rvalue, Type type_, Location loc=None):
@@ -354,7 +1909,11 @@ cdef class Context:
                                                   get_c_location(loc),
                                                   rvalue._get_c_rvalue(),
                                                   type_._get_c_type())
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        result = RValue_from_c(self._c_ctxt, c_rvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_CAST, None, (rvalue, type_, loc),
+                                  result)
+        return result
 
     def new_array_access(self, RValue ptr, RValue index, Location loc=None):
         """new_array_access(self, ptr:RValue, index:RValue, loc:Location=None) -> LValue"""
@@ -362,7 +1921,35 @@ cdef class Context:
                                                           get_c_location(loc),
                                                           ptr._get_c_rvalue(),
                                                           index._get_c_rvalue())
-        return LValue_from_c(self._c_ctxt, c_lvalue)
+        lvalue = LValue_from_c(self._c_ctxt, c_lvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_ARRAY_ACCESS, None, (ptr, index, loc),
+                                  lvalue)
+        return lvalue
+
+    def new_array_accesses(self, accesses):
+        """new_array_accesses(self, accesses:iterable of tuple) -> list of LValue
+
+        Bulk version of new_array_access, taking a sequence of
+        (ptr, index[, loc]) tuples.
+        """
+        cdef tuple t
+        cdef RValue ptr, index
+        result = []
+        for t in accesses:
+            ptr = t[0]
+            index = t[1]
+            c_lvalue = c_api.gcc_jit_context_new_array_access(self._c_ctxt,
+                                                              get_c_location(get_tuple_location(t, 2)),
+                                                              ptr._get_c_rvalue(),
+                                                              index._get_c_rvalue())
+            lvalue = LValue_from_c(self._c_ctxt, c_lvalue)
+            if self._recorder is not None:
+                self._recorder.record(OP_NEW_ARRAY_ACCESS, None,
+                                      (ptr, index, get_tuple_location(t, 2)),
+                                      lvalue)
+            result.append(lvalue)
+        return result
 
     def new_call(self, Function func, args, Location loc=None):
         """new_call(self, func:Function, args:list of RValue, loc:Location=None) -> RValue"""
@@ -385,7 +1972,10 @@ cdef class Context:
                                                   c_args)
 
         free(c_args)
-        return RValue_from_c(self._c_ctxt, c_rvalue)
+        result = RValue_from_c(self._c_ctxt, c_rvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_CALL, None, (func, args, loc), result)
+        return result
 
     def new_call_through_ptr(self, RValue fn_ptr, args, Location loc=None):
         """new_call(self, fn_ptr:RValue, args:list of RValue, loc:Location=None) -> RValue"""
@@ -408,85 +1998,808 @@ cdef class Context:
                                                               c_args)
 
         free(c_args)
-        return RValue_from_c(self._c_ctxt, c_rvalue)
-
+        result = RValue_from_c(self._c_ctxt, c_rvalue)
+        if self._recorder is not None:
+            self._recorder.record(OP_NEW_CALL_THROUGH_PTR, None,
+                                  (fn_ptr, args, loc), result)
+        return result
+
+# __dealloc__ needs the log and the perf map lines, so the garbage
+# collector must not clear them first when breaking a reference cycle.
+@cython.no_gc_clear
 cdef class Result:
     cdef c_api.gcc_jit_result* _c_result
+    cdef _LogFile _log
+    # A CompileStats, if requested when compiling
+    cdef readonly object stats
+    # Names of the exported functions, and a weak reference to their
+    # FunctionTable once built (the table refers back to the Result)
+    cdef tuple _exported
+    cdef object _table
+    # (function name, counter name) pairs, from Context.set_profiling
+    cdef tuple _profiled
+    # Lines written to the perf map, if requested when compiling
+    cdef list _perf_map_lines
+    # Element formats of map functions, from Context.set_map_formats
+    cdef dict _map_formats
+
     def __cinit__(self):
         self._c_result = NULL
+        self._exported = ()
+        self._profiled = ()
+        self._map_formats = {}
 
     def __dealloc__(self):
-        c_api.gcc_jit_result_release(self._c_result)
+        if self._c_result != NULL:
+            if self._perf_map_lines:
+                # Rewriting the file here could block (or deadlock, if
+                # garbage collection was triggered by this thread whilst
+                # it held the lock), so leave that to the next caller.
+                _stale_perf_map_lines.extend(self._perf_map_lines)
+            c_api.gcc_jit_result_release(self._c_result)
 
     cdef _set_c_ptr(self, c_api.gcc_jit_result* c_result):
         self._c_result = c_result
 
+    cdef FunctionTable _get_cached_table(self):
+        if self._table is None:
+            return None
+        return self._table()
+
+    def close(self):
+        """close(self)
+
+        Unload the compiled code now, rather than when the Result is
+        garbage-collected.  Calling a Callable from it, or looking up
+        code within it, afterwards raises gccjit.Error; addresses
+        already obtained via get_code must no longer be used.
+        """
+        if self._c_result != NULL:
+            table = self._get_cached_table()
+            if table is not None:
+                table._clear()
+            if self._perf_map_lines:
+                remove_perf_map_entries(self._perf_map_lines)
+                self._perf_map_lines = None
+            c_api.gcc_jit_result_release(self._c_result)
+            self._c_result = NULL
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def get_code(self, funcname):
+        cdef double start
+        if self._c_result == NULL:
+            raise Error(b'result is closed')
+        if self.stats is None:
+            return <unsigned long>c_api.gcc_jit_result_get_code(self._c_result, funcname)
+        start = time.perf_counter()
         cdef void *ptr = c_api.gcc_jit_result_get_code(self._c_result, funcname)
+        self.stats.lookups.append((funcname, time.perf_counter() - start))
         return <unsigned long>ptr
 
+    def get_global(self, name):
+        """get_global(self, name:str) -> int
+
+        Get the address of an exported global, or 0 if there is no
+        such global.
+        """
+        if self._c_result == NULL:
+            raise Error(b'result is closed')
+        return <size_t>c_api.gcc_jit_result_get_global(self._c_result, name)
+
+    def get_function(self, funcname, restype, argtypes):
+        """get_function(self, funcname:str, restype:TypeKind, argtypes:list of TypeKind) -> Callable"""
+        return Callable_from_code(self, funcname, self.get_code(funcname),
+                                  restype, argtypes)
+
+    def map(self, funcname, in_buffer, out_buffer, formats=None):
+        """map(self, funcname:str, in_buffer, out_buffer, formats:tuple=None) -> None"""
+        if formats is None:
+            formats = self._map_formats.get(funcname)
+        map_code(funcname, self.get_code(funcname), in_buffer, out_buffer,
+                 formats)
+
+    def get_profile(self, reset=False):
+        """get_profile(self, reset=False) -> dict
+
+        Get the number of calls so far to each function profiled via
+        Context.set_profiling, by name, optionally resetting the counts
+        to zero.  The counts are read whilst the code may be running in
+        other threads, and aren't updated atomically, so are
+        approximate.
+        """
+        if self._c_result == NULL:
+            raise Error(b'result is closed')
+        return read_profile(self, self._profiled, reset)
+
+    def get_table(self):
+        """get_table(self) -> FunctionTable
+
+        Look up every exported function once, returning a table of their
+        addresses indexed by ordinal, in the order the functions were
+        created.
+        """
+        cdef FunctionTable table
+        cdef int i
+        if self._c_result == NULL:
+            raise Error(b'result is closed')
+        table = self._get_cached_table()
+        if table is None:
+            table = FunctionTable.__new__(FunctionTable)
+            table.result = self
+            table.names = self._exported
+            table._ordinals = {name: i
+                               for i, name in enumerate(self._exported)}
+            table._size = len(self._exported)
+            table._c_entries = <void **>malloc(table._size * sizeof(void *))
+            if table._c_entries == NULL and table._size:
+                raise MemoryError()
+            for i, name in enumerate(self._exported):
+                table._c_entries[i] = \
+                    c_api.gcc_jit_result_get_code(self._c_result, name)
+            self._table = weakref.ref(table)
+        return table
+
+
+# perf maps
+#
+# The "perf" profiler looks up the names of JIT-compiled functions in
+# /tmp/perf-<pid>.map, which holds a "START SIZE name" line (in hex) per
+# function.  Lines are appended, and removed by rewriting the file, with
+# an exclusive flock held on it throughout; only writers that take the
+# same lock are guaranteed not to lose lines appended concurrently with
+# a removal.
+#
+# Lines of Results released by garbage collection, which are removed
+# by the next call to add or remove lines.
+_stale_perf_map_lines = []
+
+def get_perf_map_path():
+    """Get the path of the perf map for this process."""
+    return '/tmp/perf-%i.map' % os.getpid()
+
+cdef list add_perf_map_entries(c_api.gcc_jit_result *c_result, tuple names):
+    """Write perf map entries for the given functions, returning the
+    lines written."""
+    cdef void *addr
+    cdef size_t size
+    cdef list lines = []
+    for name in names:
+        addr = c_api.gcc_jit_result_get_code(c_result, name)
+        size = pygccjit_get_symbol_size(addr)
+        # perf needs the size, which isn't known on every platform.
+        if addr == NULL or size == 0:
+            continue
+        lines.append('%x %x %s\n' % (<size_t>addr, size,
+                                     name.decode('utf-8', 'replace')))
+    if lines:
+        with open(get_perf_map_path(), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.writelines(lines)
+    if _stale_perf_map_lines:
+        remove_perf_map_entries([])
+    return lines
+
+cdef remove_perf_map_entries(list lines):
+    """Remove the given lines (and any left by garbage-collected Results)
+    from the perf map, rewriting it in place under the lock."""
+    cdef set to_remove = set(lines)
+    # Take the stale lines atomically, in case of concurrent callers.
+    while True:
+        try:
+            to_remove.add(_stale_perf_map_lines.pop())
+        except IndexError:
+            break
+    if not to_remove:
+        return
+    try:
+        with open(get_perf_map_path(), 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            kept = [line for line in f if line not in to_remove]
+            f.seek(0)
+            f.writelines(kept)
+            f.truncate()
+    except OSError:
+        pass
+
+
+cdef class FunctionTable:
+    """
+    The addresses of all of the exported functions within a Result,
+    indexed by a stable ordinal, so that dispatching needs no lookups by
+    name.  The entries are held in a C array of pointers, for use by
+    native code via the address property.
+    """
+    cdef void **_c_entries
+    cdef Py_ssize_t _size
+    cdef dict _ordinals
+    cdef readonly object result
+    cdef readonly tuple names
+    cdef object __weakref__
+
+    def __dealloc__(self):
+        free(self._c_entries)
+
+    cdef _clear(self):
+        # Called when the result is closed
+        free(self._c_entries)
+        self._c_entries = NULL
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, Py_ssize_t ordinal):
+        if ordinal < 0 or ordinal >= self._size:
+            raise IndexError(ordinal)
+        return <size_t>self._c_entries[ordinal]
+
+    def ordinal(self, funcname):
+        """ordinal(self, funcname:str) -> int"""
+        try:
+            return self._ordinals[funcname]
+        except KeyError:
+            raise Error(b'unknown function: ' + funcname)
+
+    def as_dict(self):
+        """as_dict(self) -> dict"""
+        return {name: <size_t>self._c_entries[i]
+                for i, name in enumerate(self.names[:self._size])}
+
+    def get_function(self, Py_ssize_t ordinal, restype, argtypes):
+        """get_function(self, ordinal:int, restype:TypeKind, argtypes:list of TypeKind) -> Callable"""
+        return Callable_from_code(self.result, self.names[ordinal],
+                                  self[ordinal], restype, argtypes)
+
+    property address:
+        """The address of the underlying array of function pointers."""
+        def __get__(self):
+            if self._c_entries == NULL:
+                raise Error(b'result is closed')
+            return <size_t>self._c_entries
+
+
+cdef class LibraryResult:
+    """
+    A shared library, as built by Context.compile_to_file with
+    OutputKind.DYNAMIC_LIBRARY, loaded into the process.  This can be
+    used in place of a Result.
+    """
+    cdef void *_c_handle
+    cdef readonly object path
+    # Element formats of map functions, as per Context.get_map_formats
+    cdef dict _map_formats
+    # As per Context.get_profiled_functions
+    cdef tuple _profiled
+
+    def __cinit__(self, path, map_formats=None, profiled=None):
+        self._c_handle = dlopen(path, RTLD_NOW | RTLD_LOCAL)
+        if self._c_handle == NULL:
+            raise Error(dlerror())
+        self.path = path
+        self._map_formats = dict(map_formats) if map_formats else {}
+        self._profiled = tuple([tuple(pair) for pair in profiled or ()])
+
+    def __dealloc__(self):
+        if self._c_handle != NULL:
+            dlclose(self._c_handle)
+
+    def close(self):
+        """close(self)
+
+        Unload the library now, rather than when the LibraryResult is
+        garbage-collected.
+        """
+        if self._c_handle != NULL:
+            dlclose(self._c_handle)
+            self._c_handle = NULL
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_code(self, funcname):
+        if self._c_handle == NULL:
+            # dlsym would treat NULL as RTLD_DEFAULT
+            raise Error(b'result is closed')
+        cdef void *ptr = dlsym(self._c_handle, funcname)
+        return <unsigned long>ptr
+
+    def get_global(self, name):
+        """get_global(self, name:str) -> int"""
+        # Globals are looked up in the same way as functions.
+        return self.get_code(name)
+
+    def get_profile(self, reset=False):
+        """get_profile(self, reset=False) -> dict"""
+        if self._c_handle == NULL:
+            raise Error(b'result is closed')
+        return read_profile(self, self._profiled, reset)
+
+    def get_function(self, funcname, restype, argtypes):
+        """get_function(self, funcname:str, restype:TypeKind, argtypes:list of TypeKind) -> Callable"""
+        return Callable_from_code(self, funcname, self.get_code(funcname),
+                                  restype, argtypes)
+
+    def map(self, funcname, in_buffer, out_buffer, formats=None):
+        """map(self, funcname:str, in_buffer, out_buffer, formats:tuple=None) -> None"""
+        if formats is None:
+            formats = self._map_formats.get(funcname)
+        map_code(funcname, self.get_code(funcname), in_buffer, out_buffer,
+                 formats)
+
+
+cdef dict read_profile(result, tuple profiled, bint reset):
+    """
+    Read the call counters of the given profiled functions within a
+    Result or LibraryResult, optionally resetting them to zero.
+    """
+    cdef long long *counter
+    profile = {}
+    for name, counter_name in profiled:
+        counter = <long long *><size_t>result.get_global(counter_name)
+        if counter == NULL:
+            continue
+        profile[name] = counter[0]
+        if reset:
+            counter[0] = 0
+    return profile
+
+
+ctypedef void (*_map_fn)(void *in_, void *out, size_t n) noexcept nogil
+
+# The struct module format characters of the standard types
+_TYPE_FORMATS = {c_api.GCC_JIT_TYPE_BOOL: '?',
+                 c_api.GCC_JIT_TYPE_SIGNED_CHAR: 'b',
+                 c_api.GCC_JIT_TYPE_UNSIGNED_CHAR: 'B',
+                 c_api.GCC_JIT_TYPE_SHORT: 'h',
+                 c_api.GCC_JIT_TYPE_UNSIGNED_SHORT: 'H',
+                 c_api.GCC_JIT_TYPE_INT: 'i',
+                 c_api.GCC_JIT_TYPE_UNSIGNED_INT: 'I',
+                 c_api.GCC_JIT_TYPE_LONG: 'l',
+                 c_api.GCC_JIT_TYPE_UNSIGNED_LONG: 'L',
+                 c_api.GCC_JIT_TYPE_LONG_LONG: 'q',
+                 c_api.GCC_JIT_TYPE_UNSIGNED_LONG_LONG: 'Q',
+                 c_api.GCC_JIT_TYPE_FLOAT: 'f',
+                 c_api.GCC_JIT_TYPE_DOUBLE: 'd',
+                 c_api.GCC_JIT_TYPE_SIZE_T: 'N'}
+
+# ...and of the signed types from Context.get_int_type, by size
+_INT_TYPE_FORMATS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+# Format characters whose values are interchangeable at the same size
+_FORMAT_CLASSES = {c: cls
+                   for chars, cls in (('bhilqn', 'signed'),
+                                      ('BHILQN', 'unsigned'),
+                                      ('efd', 'float'),
+                                      ('?', 'bool'))
+                   for c in chars}
+
+_NATIVE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+cdef check_map_format(funcname, what, Py_buffer *view, expected):
+    if view.format == NULL:
+        actual = 'B'
+    else:
+        actual = view.format.decode('ascii')
+    # Only native byte order will do.
+    if actual[:1] in ('@', '=', _NATIVE_ORDER):
+        code = actual[1:]
+    else:
+        code = actual
+    cls = _FORMAT_CLASSES.get(code)
+    if (cls is None or cls != _FORMAT_CLASSES.get(expected)
+        or view.itemsize != struct.calcsize(expected)):
+        raise Error(('%s buffer of %s has format %r and itemsize %i, but'
+                     ' %r is required'
+                     % (what, funcname.decode('utf-8', 'replace'), actual,
+                        view.itemsize, expected)).encode('utf-8'))
+
+cdef map_code(funcname, size_t address, in_buffer, out_buffer, formats):
+    """
+    Call a loop function built by gccjit.make_map_function on the
+    contents of a pair of buffers, without copying them, after checking
+    that their elements are of the (in_format, out_format) given.
+    """
+    cdef Py_buffer in_view
+    cdef Py_buffer out_view
+    cdef size_t n
+    cdef _map_fn fn = <_map_fn>address
+    if address == 0:
+        raise Error(b'unknown function: ' + funcname)
+    if formats is None or len(formats) != 2 or None in formats:
+        raise Error(b'unknown element types for ' + funcname
+                    + b': pass formats=(in_format, out_format)')
+    in_format, out_format = formats
+    if (_FORMAT_CLASSES.get(in_format) is None
+        or _FORMAT_CLASSES.get(out_format) is None):
+        raise Error(b'unsupported element types for ' + funcname)
+    PyObject_GetBuffer(in_buffer, &in_view,
+                       PyBUF_ANY_CONTIGUOUS | PyBUF_FORMAT)
+    try:
+        PyObject_GetBuffer(out_buffer, &out_view,
+                           PyBUF_ANY_CONTIGUOUS | PyBUF_WRITABLE
+                           | PyBUF_FORMAT)
+        try:
+            check_map_format(funcname, 'input', &in_view, in_format)
+            check_map_format(funcname, 'output', &out_view, out_format)
+            n = in_view.len // in_view.itemsize
+            if <size_t>(out_view.len // out_view.itemsize) != n:
+                raise ValueError('input has %i elements, but output has %i'
+                                 % (n, out_view.len // out_view.itemsize))
+            with nogil:
+                fn(in_view.buf, out_view.buf, n)
+        finally:
+            PyBuffer_Release(&out_view)
+    finally:
+        PyBuffer_Release(&in_view)
+
+
+# Calling machine code from Python.
+#
+# Arguments and return values are passed through an array of these
+# unions to a "trampoline" function, built with libgccjit for each
+# signature, which unpacks the arguments and makes a direct call to the
+# real function.  Hence each call costs one indirect call from Cython,
+# with no per-call marshalling beyond unboxing the arguments.
+
+cdef union _Slot:
+    int i
+    long l
+    double d
+    void *p
+
+ctypedef void (*_trampoline_fn)(void *fn, _Slot *args, _Slot *ret) noexcept
+
+cdef enum:
+    _MAX_CALLABLE_ARGS = 8
+
+# Map from supported TypeKind values to the corresponding field of _Slot
+# (CONST_CHAR_PTR, being a pointer too, shares the representation of p)
+_SLOT_FIELDS = {c_api.GCC_JIT_TYPE_INT: b'i',
+                c_api.GCC_JIT_TYPE_LONG: b'l',
+                c_api.GCC_JIT_TYPE_DOUBLE: b'd',
+                c_api.GCC_JIT_TYPE_VOID_PTR: b'p',
+                c_api.GCC_JIT_TYPE_CONST_CHAR_PTR: b'cp'}
+
+# Map from (restype, argtypes) to (Result, address of trampoline)
+_trampolines = {}
+
+cdef _get_trampoline(restype, argtypes):
+    cdef c_api.gcc_jit_result *c_result
+    cdef Result result
+    key = (restype, argtypes)
+    if key in _trampolines:
+        return _trampolines[key][1]
+
+    ctxt = Context()
+    ctxt.set_int_option(IntOption.OPTIMIZATION_LEVEL, 2)
+    void_type = ctxt.get_type(TypeKind.VOID)
+    int_type = ctxt.get_type(TypeKind.INT)
+    fields = {}
+    for kind in _SLOT_FIELDS:
+        fields[kind] = ctxt.new_field(ctxt.get_type(kind), _SLOT_FIELDS[kind])
+    slot_ptr = ctxt.new_union(b'slot', fields.values()).get_pointer()
+
+    fn_ptr_type = ctxt.new_function_ptr_type(
+        ctxt.get_type(restype),
+        [ctxt.get_type(kind) for kind in argtypes])
+
+    # void trampoline (void *fn, union slot *args, union slot *ret)
+    param_fn = ctxt.new_param(ctxt.get_type(TypeKind.VOID_PTR), b'fn')
+    param_args = ctxt.new_param(slot_ptr, b'args')
+    param_ret = ctxt.new_param(slot_ptr, b'ret')
+    func = ctxt.new_function(FunctionKind.EXPORTED, void_type, b'trampoline',
+                             [param_fn, param_args, param_ret])
+    block = func.new_block(b'entry')
+
+    # ((restype (*)(argtypes))fn) (args[0].i, args[1].d, ...)
+    args = [ctxt.new_array_access(param_args,
+                                  ctxt.new_rvalue_from_int(int_type, i))
+                .access_field(fields[kind])
+            for i, kind in enumerate(argtypes)]
+    call = ctxt.new_call_through_ptr(ctxt.new_cast(param_fn, fn_ptr_type),
+                                     args)
+    if restype == TypeKind.VOID:
+        block.add_eval(call)
+    else:
+        # ret[0].l = ...
+        block.add_assignment(
+            ctxt.new_array_access(param_ret, ctxt.zero(int_type))
+                .access_field(fields[restype]),
+            call)
+    block.end_with_void_return()
+
+    # Compile via the C API rather than Context.compile, so that this
+    # internal compile isn't seen by compile hooks or counted in stats.
+    with nogil:
+        c_result = c_api.gcc_jit_context_compile(ctxt._c_ctxt)
+    if c_result == NULL:
+        raise Error(ctxt.get_first_error())
+    result = Result()
+    result._set_c_ptr(c_result)
+    ctxt.close()
+    address = <size_t>c_api.gcc_jit_result_get_code(c_result, b'trampoline')
+    _trampolines[key] = (result, address)
+    return address
+
+cdef bint is_closed_result(result):
+    """Whether result is a Result or LibraryResult that has been closed."""
+    if type(result) is Result:
+        return (<Result>result)._c_result == NULL
+    if type(result) is LibraryResult:
+        return (<LibraryResult>result)._c_handle == NULL
+    return False
+
+cdef class Callable:
+    """
+    A function within a Result (or LibraryResult), callable from Python
+    with a fixed C signature.  It holds a reference to the result, so
+    the code can't be freed whilst the Callable is alive.
+    """
+    cdef void *_c_fn
+    cdef _trampoline_fn _c_trampoline
+    cdef int _num_args
+    cdef int _c_restype
+    cdef int _c_argtypes[_MAX_CALLABLE_ARGS]
+    cdef readonly object result
+    cdef readonly object name
+
+    def __call__(self, *args):
+        cdef _Slot c_args[_MAX_CALLABLE_ARGS]
+        cdef _Slot c_ret
+        cdef Py_buffer views[_MAX_CALLABLE_ARGS]
+        cdef int num_views = 0
+        cdef int i
+        cdef int flags
+        if is_closed_result(self.result):
+            # The code is no longer mapped.
+            raise Error(b'result is closed')
+        if len(args) != self._num_args:
+            raise TypeError('%s() takes %i arguments (%i given)'
+                            % (self.name.decode('utf-8', 'replace'),
+                               self._num_args, len(args)))
+        try:
+            for i in range(self._num_args):
+                kind = self._c_argtypes[i]
+                arg = args[i]
+                if kind == c_api.GCC_JIT_TYPE_INT:
+                    c_args[i].i = arg
+                elif kind == c_api.GCC_JIT_TYPE_LONG:
+                    c_args[i].l = arg
+                elif kind == c_api.GCC_JIT_TYPE_DOUBLE:
+                    c_args[i].d = arg
+                elif arg is None:
+                    c_args[i].p = NULL
+                elif isinstance(arg, int):
+                    c_args[i].p = <void *><size_t>arg
+                else:
+                    # Pass a pointer to the memory of a buffer-protocol
+                    # object, holding on to it for the duration of the call.
+                    # The code may write through a VOID_PTR, so only a
+                    # CONST_CHAR_PTR accepts a read-only buffer.
+                    if kind == c_api.GCC_JIT_TYPE_VOID_PTR:
+                        flags = PyBUF_ANY_CONTIGUOUS | PyBUF_WRITABLE
+                    else:
+                        flags = PyBUF_ANY_CONTIGUOUS
+                    PyObject_GetBuffer(arg, &views[num_views], flags)
+                    c_args[i].p = views[num_views].buf
+                    num_views += 1
+            self._c_trampoline(self._c_fn, c_args, &c_ret)
+        finally:
+            for i in range(num_views):
+                PyBuffer_Release(&views[i])
+        if self._c_restype == c_api.GCC_JIT_TYPE_INT:
+            return c_ret.i
+        elif self._c_restype == c_api.GCC_JIT_TYPE_LONG:
+            return c_ret.l
+        elif self._c_restype == c_api.GCC_JIT_TYPE_DOUBLE:
+            return c_ret.d
+        elif (self._c_restype == c_api.GCC_JIT_TYPE_VOID_PTR
+              or self._c_restype == c_api.GCC_JIT_TYPE_CONST_CHAR_PTR):
+            return <size_t>c_ret.p
+        return None
+
+    def get_code(self):
+        """get_code(self) -> int"""
+        return <size_t>self._c_fn
+
+cdef Callable Callable_from_code(result, funcname, size_t address,
+                                 restype, argtypes):
+    if address == 0:
+        raise Error(b'unknown function: ' + funcname)
+    argtypes = tuple(argtypes)
+    if len(argtypes) > _MAX_CALLABLE_ARGS:
+        raise ValueError('at most %i arguments are supported'
+                         % _MAX_CALLABLE_ARGS)
+    for kind in argtypes:
+        if kind not in _SLOT_FIELDS:
+            raise ValueError('unsupported argument type: %r' % kind)
+    if restype not in _SLOT_FIELDS and restype != TypeKind.VOID:
+        raise ValueError('unsupported return type: %r' % restype)
+
+    cdef Callable c = Callable.__new__(Callable)
+    c._c_fn = <void *>address
+    c._c_trampoline = <_trampoline_fn><size_t>_get_trampoline(restype, argtypes)
+    c._num_args = len(argtypes)
+    c._c_restype = restype
+    for i, kind in enumerate(argtypes):
+        c._c_argtypes[i] = kind
+    c.result = result
+    c.name = funcname
+    return c
+
 
 cdef class Object:
     cdef c_api.gcc_jit_object *_c_object
+    # The Context that this object is within, keeping it alive.
+    cdef Context _ctxt
+    # The decoded debug string, once built
+    cdef str _debug_string
+    # For the intern tables
+    cdef object __weakref__
 
     def __cinit__(self):
         self._c_object = NULL
 
     def __str__(self):
-        if self._c_object:
-            # Require UTF-8 encoding for now
-            return c_api.gcc_jit_object_get_debug_string(self._c_object).decode('utf-8')
-        else:
+        if not self._c_object:
             return 'NULL'
-
-    def __richcmp__(Object self, Object other, int op):
+        self._check_open()
+        if self._debug_string is None:
+            # Require UTF-8 encoding for now
+            self._debug_string = \
+                c_api.gcc_jit_object_get_debug_string(self._c_object).decode('utf-8')
+        return self._debug_string
+
+    def __richcmp__(Object self, other, int op):
+        # Compare by the address of the underlying gcc_jit_object,
+        # without building debug strings.
+        if not isinstance(other, Object):
+            return NotImplemented
         if op == 2: # ==
-            return self._c_object == other._c_object
+            return self._c_object == (<Object>other)._c_object
         elif op == 3: # !=
-            return self._c_object != other._c_object
-
-    cdef c_api.gcc_jit_context* _get_c_context(self):
+            return self._c_object != (<Object>other)._c_object
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(<size_t>self._c_object)
+
+    property address:
+        """The address of the underlying gcc_jit_object, as an int"""
+        def __get__(self):
+            return <size_t>self._c_object
+
+    cdef int _check_open(self) except -1:
+        # The underlying object is freed along with its context, so
+        # mustn't be passed to libgccjit once the Context is closed.
+        if self._ctxt is not None and self._ctxt._c_ctxt == NULL:
+            raise Error(b'context is closed')
+        return 0
+
+    cdef c_api.gcc_jit_context* _get_c_context(self) except NULL:
+        self._check_open()
         return c_api.gcc_jit_object_get_context(self._c_object)
 
 cdef class Type(Object):
-    cdef c_api.gcc_jit_type* _get_c_type(self):
+    # The struct module format character for values of this type, or
+    # None if there isn't one
+    cdef readonly object format
+
+    cdef c_api.gcc_jit_type* _get_c_type(self) except NULL:
+        self._check_open()
         return <c_api.gcc_jit_type*>self._c_object
 
     cdef _set_c_type(self, c_api.gcc_jit_type* c_type):
         self._c_object = <c_api.gcc_jit_object *>c_type
 
+    cdef _get_derived(self, kind):
+        cdef c_api.gcc_jit_context *c_ctxt = self._get_c_context()
+        cdef c_api.gcc_jit_type *c_type
+        cdef int opcode
+        table = get_intern_table(c_ctxt)
+        key = (kind, <size_t>self._c_object)
+        if table is not None:
+            t = get_interned(table, key)
+            if t is not None:
+                return t
+        if kind == 'pointer':
+            c_type = c_api.gcc_jit_type_get_pointer(self._get_c_type())
+            opcode = OP_GET_POINTER
+        elif kind == 'const':
+            c_type = c_api.gcc_jit_type_get_const(self._get_c_type())
+            opcode = OP_GET_CONST
+        else:
+            c_type = c_api.gcc_jit_type_get_volatile(self._get_c_type())
+            opcode = OP_GET_VOLATILE
+        t = Type_from_c(c_ctxt, c_type)
+        if kind != 'pointer':
+            (<Type>t).format = self.format
+        if table is not None:
+            table[key] = weakref.ref(t)
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(opcode, self, (), t)
+        return t
+
     def get_pointer(self):
         """get_pointer(self) -> Type"""
-        return Type_from_c(self._get_c_context(),
-                           c_api.gcc_jit_type_get_pointer(self._get_c_type()))
+        return self._get_derived('pointer')
 
     def get_const(self):
         """get_const(self) -> Type"""
-        return Type_from_c(self._get_c_context(),
-                           c_api.gcc_jit_type_get_const(self._get_c_type()))
+        return self._get_derived('const')
 
     def get_volatile(self):
         """get_volatile(self) -> Type"""
-        return Type_from_c(self._get_c_context(),
-                           c_api.gcc_jit_type_get_volatile(self._get_c_type()))
+        return self._get_derived('volatile')
 
 cdef Type_from_c(c_api.gcc_jit_context *c_ctxt,
                  c_api.gcc_jit_type *c_type):
     if c_type == NULL:
-        raise Error(c_api.gcc_jit_context_get_last_error(c_ctxt))
+        raise Error(get_last_error(c_ctxt))
     t = Type()
     t._set_c_type(c_type)
+    set_owner(t, get_context(c_ctxt))
     return t
 
 
 cdef class Location(Object):
-    cdef c_api.gcc_jit_location* _get_c_location(self):
+    # The location itself, for creating the gcc_jit_location when it's
+    # first needed (see Context.set_lazy_locations).
+    cdef bytes _filename
+    cdef int _line
+    cdef int _column
+
+    cdef c_api.gcc_jit_location* _get_c_location(self) except? NULL:
+        self._check_open()
+        if self._c_object == NULL and not self._ctxt._defer_locations:
+            self._materialize()
         return <c_api.gcc_jit_location*>self._c_object
 
     cdef _set_c_location(self, c_api.gcc_jit_location* c_location):
         self._c_object = <c_api.gcc_jit_object *>c_location
 
-cdef c_api.gcc_jit_location* get_c_location(Location py_location):
+    cdef _materialize(self):
+        self._set_c_location(
+            c_api.gcc_jit_context_new_location(self._ctxt._c_ctxt,
+                                               self._filename,
+                                               self._line,
+                                               self._column))
+
+    def __str__(self):
+        if self._c_object == NULL:
+            # As per libgccjit's debug string for a location
+            return '%s:%i:%i' % (self._filename.decode('utf-8'),
+                                 self._line, self._column)
+        return Object.__str__(self)
+
+    def __richcmp__(Location self, other, int op):
+        # A location that hasn't been created within libgccjit yet has
+        # no address, but is only ever equal to itself, since they are
+        # interned.
+        if not isinstance(other, Location):
+            return NotImplemented
+        if op == 2: # ==
+            return self is other or (self._c_object != NULL
+                                     and self._c_object == (<Location>other)._c_object)
+        elif op == 3: # !=
+            return not (self is other or (self._c_object != NULL
+                                          and self._c_object == (<Location>other)._c_object))
+        return NotImplemented
+
+    def __hash__(self):
+        # Stable whether or not the location has been created yet.
+        return hash((self._filename, self._line, self._column))
+
+cdef c_api.gcc_jit_location* get_c_location(Location py_location) except? NULL:
     """Get a C location pointer given a Python object, handling None."""
     if py_location is None:
         return NULL
@@ -495,7 +2808,8 @@ cdef c_api.gcc_jit_location* get_c_location(Location py_location):
 
 
 cdef class Field(Object):
-    cdef c_api.gcc_jit_field* _get_c_field(self):
+    cdef c_api.gcc_jit_field* _get_c_field(self) except NULL:
+        self._check_open()
         return <c_api.gcc_jit_field*>self._c_object
 
     cdef _set_c_field(self, c_api.gcc_jit_field* c_field):
@@ -503,7 +2817,8 @@ cdef class Field(Object):
 
 
 cdef class Struct(Type):
-    cdef c_api.gcc_jit_struct* _get_c_struct(self):
+    cdef c_api.gcc_jit_struct* _get_c_struct(self) except NULL:
+        self._check_open()
         return <c_api.gcc_jit_struct*>self._c_object
 
     cdef _set_c_struct(self, c_api.gcc_jit_struct* c_struct):
@@ -530,9 +2845,13 @@ cdef class Struct(Type):
                                         c_fields)
 
         free(c_fields)
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_SET_FIELDS, self, (fields, loc))
 
 cdef class RValue(Object):
-    cdef c_api.gcc_jit_rvalue* _get_c_rvalue(self):
+    cdef c_api.gcc_jit_rvalue* _get_c_rvalue(self) except NULL:
+        self._check_open()
         return <c_api.gcc_jit_rvalue*>self._c_object
 
     cdef _set_c_rvalue(self, c_api.gcc_jit_rvalue* c_rvalue):
@@ -540,33 +2859,58 @@ cdef class RValue(Object):
 
     def dereference_field(self, Field field, Location loc=None):
         """dereference_field(self, field:Field, loc:Location=None) -> LValue"""
-        return LValue_from_c(self._get_c_context(),
-                             c_api.gcc_jit_rvalue_dereference_field (self._get_c_rvalue(),
-                                                                     get_c_location(loc),
-                                                                     field._get_c_field()))
+        lvalue = LValue_from_c(self._get_c_context(),
+                               c_api.gcc_jit_rvalue_dereference_field (self._get_c_rvalue(),
+                                                                       get_c_location(loc),
+                                                                       field._get_c_field()))
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_DEREFERENCE_FIELD, self, (field, loc), lvalue)
+        return lvalue
 
     def dereference(self, loc=None):
         """dereference(self, loc:Location=None) -> LValue"""
-        return LValue_from_c(self._get_c_context(),
-                             c_api.gcc_jit_rvalue_dereference (self._get_c_rvalue(),
-                                                               get_c_location(loc)))
+        lvalue = LValue_from_c(self._get_c_context(),
+                               c_api.gcc_jit_rvalue_dereference (self._get_c_rvalue(),
+                                                                 get_c_location(loc)))
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_DEREFERENCE, self, (loc,), lvalue)
+        return lvalue
+
+    def access_field(self, Field field, Location loc=None):
+        """access_field(self, field:Field, loc:Location=None) -> RValue"""
+        rvalue = RValue_from_c(self._get_c_context(),
+                               c_api.gcc_jit_rvalue_access_field (self._get_c_rvalue(),
+                                                                  get_c_location(loc),
+                                                                  field._get_c_field()))
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_RVALUE_ACCESS_FIELD, self, (field, loc), rvalue)
+        return rvalue
 
     def get_type(self):
-        return Type_from_c(self._get_c_context(),
-                           c_api.gcc_jit_rvalue_get_type (self._get_c_rvalue()))
+        t = Type_from_c(self._get_c_context(),
+                        c_api.gcc_jit_rvalue_get_type (self._get_c_rvalue()))
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_RVALUE_GET_TYPE, self, (), t)
+        return t
 
 cdef RValue RValue_from_c(c_api.gcc_jit_context *c_ctxt,
                           c_api.gcc_jit_rvalue *c_rvalue):
     if c_rvalue == NULL:
-        raise Error(c_api.gcc_jit_context_get_last_error(c_ctxt))
+        raise Error(get_last_error(c_ctxt))
 
     py_rvalue = RValue()
     py_rvalue._set_c_rvalue(c_rvalue)
+    set_owner(py_rvalue, get_context(c_ctxt))
     return py_rvalue
 
 
 cdef class LValue(RValue):
-    cdef c_api.gcc_jit_lvalue* _get_c_lvalue(self):
+    cdef c_api.gcc_jit_lvalue* _get_c_lvalue(self) except NULL:
+        self._check_open()
         return <c_api.gcc_jit_lvalue*>self._c_object
 
     cdef _set_c_lvalue(self, c_api.gcc_jit_lvalue* c_lvalue):
@@ -574,22 +2918,39 @@ cdef class LValue(RValue):
 
     def get_address(self, Location loc=None):
         """get_address(self, loc:Location=None) -> RValue"""
-        return RValue_from_c(self._get_c_context(),
-                             c_api.gcc_jit_lvalue_get_address(self._get_c_lvalue(),
-                                                              get_c_location(loc)))
+        rvalue = RValue_from_c(self._get_c_context(),
+                               c_api.gcc_jit_lvalue_get_address(self._get_c_lvalue(),
+                                                                get_c_location(loc)))
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_GET_ADDRESS, self, (loc,), rvalue)
+        return rvalue
+
+    def access_field(self, Field field, Location loc=None):
+        """access_field(self, field:Field, loc:Location=None) -> LValue"""
+        lvalue = LValue_from_c(self._get_c_context(),
+                               c_api.gcc_jit_lvalue_access_field (self._get_c_lvalue(),
+                                                                  get_c_location(loc),
+                                                                  field._get_c_field()))
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_LVALUE_ACCESS_FIELD, self, (field, loc), lvalue)
+        return lvalue
 
 cdef LValue LValue_from_c(c_api.gcc_jit_context *c_ctxt,
                           c_api.gcc_jit_lvalue *c_lvalue):
     if c_lvalue == NULL:
-        raise Error(c_api.gcc_jit_context_get_last_error(c_ctxt))
+        raise Error(get_last_error(c_ctxt))
 
     py_lvalue = LValue()
     py_lvalue._set_c_lvalue(c_lvalue)
+    set_owner(py_lvalue, get_context(c_ctxt))
     return py_lvalue
 
 
 cdef class Param(LValue):
-    cdef c_api.gcc_jit_param* _get_c_param(self):
+    cdef c_api.gcc_jit_param* _get_c_param(self) except NULL:
+        self._check_open()
         return <c_api.gcc_jit_param*>self._c_object
 
     cdef _set_c_param(self, c_api.gcc_jit_param* c_param):
@@ -598,15 +2959,17 @@ cdef class Param(LValue):
 cdef Param Param_from_c(c_api.gcc_jit_context *c_ctxt,
                         c_api.gcc_jit_param *c_param):
     if c_param == NULL:
-        raise Error(c_api.gcc_jit_context_get_last_error(c_ctxt))
+        raise Error(get_last_error(c_ctxt))
 
     p = Param()
     p._set_c_param(c_param)
+    set_owner(p, get_context(c_ctxt))
     return p
 
 
 cdef class Function(Object):
-    cdef c_api.gcc_jit_function* _get_c_function(self):
+    cdef c_api.gcc_jit_function* _get_c_function(self) except NULL:
+        self._check_open()
         return <c_api.gcc_jit_function*>self._c_object
 
     cdef _set_c_function(self, c_api.gcc_jit_function* c_function):
@@ -618,8 +2981,12 @@ cdef class Function(Object):
                                                     get_c_location(loc),
                                                     type_._get_c_type(),
                                                     name)
-        return LValue_from_c(self._get_c_context(),
-                             c_lvalue)
+        lvalue = LValue_from_c(self._get_c_context(),
+                               c_lvalue)
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_NEW_LOCAL, self, (type_, name, loc), lvalue)
+        return lvalue
 
     def new_block(self, name=None):
         """new_block(self, name:str) -> Block"""
@@ -631,16 +2998,33 @@ cdef class Function(Object):
         c_block = c_api.gcc_jit_function_new_block(self._get_c_function(),
                                                    c_name)
         if c_block == NULL:
-            raise Error(c_api.gcc_jit_context_get_last_error(self._get_c_context()))
+            raise Error(get_last_error(self._get_c_context()))
         block = Block()
         block._set_c_block(c_block)
+        set_owner(block, self._ctxt)
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_NEW_BLOCK, self, (name,), block)
+        if self._ctxt is not None and self._ctxt._profile_counters:
+            # The first block is the entry block; count calls there.
+            counter = self._ctxt._profile_counters.pop(<size_t>self._c_object,
+                                                       None)
+            if counter is not None:
+                block.add_assignment_op(
+                    counter, c_api.GCC_JIT_BINARY_OP_PLUS,
+                    self._ctxt.one(
+                        self._ctxt.get_type(c_api.GCC_JIT_TYPE_LONG_LONG)))
         return block
 
     def get_param(self, index):
         """get_param(self, index:int) -> Param"""
         c_param = c_api.gcc_jit_function_get_param (self._get_c_function(), index)
-        return Param_from_c(self._get_c_context(),
-                            c_param)
+        param = Param_from_c(self._get_c_context(),
+                             c_param)
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_GET_PARAM, self, (index,), param)
+        return param
 
     def dump_to_dot(self, char *path):
         """dump_to_dot(self, path:str)"""
@@ -650,14 +3034,16 @@ cdef class Function(Object):
 cdef Function Function_from_c(c_api.gcc_jit_context *c_ctxt,
                               c_api.gcc_jit_function *c_function):
     if c_function == NULL:
-        raise Error(c_api.gcc_jit_context_get_last_error(c_ctxt))
+        raise Error(get_last_error(c_ctxt))
     f = Function()
     f._set_c_function(c_function)
+    set_owner(f, get_context(c_ctxt))
     return f
 
 
 cdef class Block(Object):
-    cdef c_api.gcc_jit_block* _get_c_block(self):
+    cdef c_api.gcc_jit_block* _get_c_block(self) except NULL:
+        self._check_open()
         return <c_api.gcc_jit_block*>self._c_object
 
     cdef _set_c_block(self, c_api.gcc_jit_block* c_block):
@@ -668,6 +3054,9 @@ cdef class Block(Object):
         c_api.gcc_jit_block_add_eval(self._get_c_block(),
                                      get_c_location(loc),
                                      rvalue._get_c_rvalue())
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_ADD_EVAL, self, (rvalue, loc))
 
     def add_assignment(self, LValue lvalue, RValue rvalue, Location loc=None):
         """add_assignment(self, lvalue:LValue, rvalue:RValue, loc:Location=None)"""
@@ -675,6 +3064,9 @@ cdef class Block(Object):
                                            get_c_location(loc),
                                            lvalue._get_c_lvalue(),
                                            rvalue._get_c_rvalue())
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_ADD_ASSIGNMENT, self, (lvalue, rvalue, loc))
 
     def add_assignment_op(self, LValue lvalue, op, RValue rvalue, Location loc=None):
         """add_assignment(self, lvalue:LValue, op:BinaryOp, rvalue:RValue, loc:Location=None)"""
@@ -683,12 +3075,77 @@ cdef class Block(Object):
                                               lvalue._get_c_lvalue(),
                                               op,
                                               rvalue._get_c_rvalue())
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_ADD_ASSIGNMENT_OP, self,
+                            (lvalue, op, rvalue, loc))
 
     def add_comment(self, text, Location loc=None):
         """add_comment(self, text:str, loc:Location=None)"""
         c_api.gcc_jit_block_add_comment (self._get_c_block(),
                                          get_c_location(loc),
                                          text)
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_ADD_COMMENT, self, (text, loc))
+
+    def add_statements(self, statements):
+        """add_statements(self, statements:iterable of tuple)
+
+        Add a sequence of statements in one call, each given as a tuple:
+          (StatementKind.EVAL, rvalue[, loc])
+          (StatementKind.ASSIGN, lvalue, rvalue[, loc])
+          (StatementKind.ASSIGN_OP, lvalue, op, rvalue[, loc])
+          (StatementKind.COMMENT, text[, loc])
+        """
+        cdef c_api.gcc_jit_block *c_block = self._get_c_block()
+        cdef _Recorder recorder = get_recorder(self)
+        cdef tuple stmt
+        cdef int kind
+        cdef LValue lvalue
+        cdef RValue rvalue
+        for stmt in statements:
+            kind = stmt[0]
+            if kind == c_STATEMENT_EVAL:
+                rvalue = stmt[1]
+                c_api.gcc_jit_block_add_eval(c_block,
+                                             get_c_location(get_tuple_location(stmt, 2)),
+                                             rvalue._get_c_rvalue())
+                if recorder is not None:
+                    recorder.record(OP_ADD_EVAL, self,
+                                    (rvalue, get_tuple_location(stmt, 2)))
+            elif kind == c_STATEMENT_ASSIGN:
+                lvalue = stmt[1]
+                rvalue = stmt[2]
+                c_api.gcc_jit_block_add_assignment(c_block,
+                                                   get_c_location(get_tuple_location(stmt, 3)),
+                                                   lvalue._get_c_lvalue(),
+                                                   rvalue._get_c_rvalue())
+                if recorder is not None:
+                    recorder.record(OP_ADD_ASSIGNMENT, self,
+                                    (lvalue, rvalue,
+                                     get_tuple_location(stmt, 3)))
+            elif kind == c_STATEMENT_ASSIGN_OP:
+                lvalue = stmt[1]
+                rvalue = stmt[3]
+                c_api.gcc_jit_block_add_assignment_op(c_block,
+                                                      get_c_location(get_tuple_location(stmt, 4)),
+                                                      lvalue._get_c_lvalue(),
+                                                      stmt[2],
+                                                      rvalue._get_c_rvalue())
+                if recorder is not None:
+                    recorder.record(OP_ADD_ASSIGNMENT_OP, self,
+                                    (lvalue, stmt[2], rvalue,
+                                     get_tuple_location(stmt, 4)))
+            elif kind == c_STATEMENT_COMMENT:
+                c_api.gcc_jit_block_add_comment(c_block,
+                                                get_c_location(get_tuple_location(stmt, 2)),
+                                                stmt[1])
+                if recorder is not None:
+                    recorder.record(OP_ADD_COMMENT, self,
+                                    (stmt[1], get_tuple_location(stmt, 2)))
+            else:
+                raise ValueError('unknown statement kind: %r' % (stmt[0],))
 
     def end_with_conditional(self, RValue boolval,
                              Block on_true,
@@ -700,29 +3157,69 @@ cdef class Block(Object):
                                                  boolval._get_c_rvalue(),
                                                  on_true._get_c_block(),
                                                  on_false._get_c_block() if on_false else NULL)
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_END_WITH_CONDITIONAL, self,
+                            (boolval, on_true, on_false, loc))
 
     def end_with_jump(self, Block target, Location loc=None):
         """end_with_jump(self, target:Block, loc:Location=None)"""
         c_api.gcc_jit_block_end_with_jump(self._get_c_block(),
                                           get_c_location(loc),
                                           target._get_c_block())
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_END_WITH_JUMP, self, (target, loc))
 
     def end_with_return(self, RValue rvalue, loc=None):
         """end_with_return(self, rvalue:RValue, loc:Location=None)"""
         c_api.gcc_jit_block_end_with_return(self._get_c_block(),
                                             get_c_location(loc),
                                             rvalue._get_c_rvalue())
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_END_WITH_RETURN, self, (rvalue, loc))
 
     def end_with_void_return(self, loc=None):
         """end_with_void_return(self, loc:Location=None)"""
         c_api.gcc_jit_block_end_with_void_return(self._get_c_block(),
                                                  get_c_location(loc))
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_END_WITH_VOID_RETURN, self, (loc,))
 
     def get_function(self):
         """get_function(self) -> Function"""
         c_function = c_api.gcc_jit_block_get_function (self._get_c_block())
-        return Function_from_c(self._get_c_context(),
-                               c_function)
+        fn = Function_from_c(self._get_c_context(),
+                             c_function)
+        recorder = get_recorder(self)
+        if recorder is not None:
+            recorder.record(OP_GET_FUNCTION, self, (), fn)
+        return fn
+
+
+cdef Location get_tuple_location(tuple t, Py_ssize_t index):
+    """Get the optional trailing Location of a tuple passed to one of the
+    bulk APIs."""
+    if len(t) > index + 1:
+        raise ValueError('too many items in %r' % (t,))
+    if len(t) == index + 1:
+        return t[index]
+    return None
+
+
+cdef enum:
+    c_STATEMENT_EVAL
+    c_STATEMENT_ASSIGN
+    c_STATEMENT_ASSIGN_OP
+    c_STATEMENT_COMMENT
+
+cdef class StatementKind:
+    EVAL = c_STATEMENT_EVAL
+    ASSIGN = c_STATEMENT_ASSIGN
+    ASSIGN_OP = c_STATEMENT_ASSIGN_OP
+    COMMENT = c_STATEMENT_COMMENT
 
 
 cdef class FunctionKind:
@@ -0,0 +1,577 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Compile elementwise arithmetic expressions over arrays, such as:
+
+  a*b + c
+  where(x > 0, x, -x)
+
+into a single fused loop, so that evaluating them creates no
+temporary arrays.  For example:
+
+  out = gccjit.kernels.evaluate('a*b + c', a=a, b=b, c=c)
+
+where a, b and c are array.array, NumPy arrays or any other contiguous
+objects supporting the buffer protocol.
+"""
+
+from __future__ import absolute_import
+
+import array
+import ast
+from collections import OrderedDict
+import threading
+
+from ._gccjit import (BinaryOp, Comparison, Context, Error, FunctionKind,
+                      IntOption, TypeKind, UnaryOp)
+
+# The supported element types, as (TypeKind, array.array typecode)
+DTYPES = OrderedDict([('int32', (TypeKind.INT, 'i')),
+                      ('int64', (TypeKind.LONG_LONG, 'q')),
+                      ('float32', (TypeKind.FLOAT, 'f')),
+                      ('float64', (TypeKind.DOUBLE, 'd'))])
+
+_FLOAT_DTYPES = ('float32', 'float64')
+
+# Map from buffer-protocol format characters to dtype, by itemsize
+_FORMATS = {('i', 4): 'int32', ('l', 4): 'int32',
+            ('l', 8): 'int64', ('q', 8): 'int64',
+            ('f', 4): 'float32', ('d', 8): 'float64'}
+
+_BINARY_OPS = {ast.Add: BinaryOp.PLUS,
+               ast.Sub: BinaryOp.MINUS,
+               ast.Mult: BinaryOp.MULT,
+               ast.Div: BinaryOp.DIVIDE,
+               ast.BitAnd: BinaryOp.BITWISE_AND,
+               ast.BitOr: BinaryOp.BITWISE_OR,
+               ast.BitXor: BinaryOp.BITWISE_XOR}
+
+_INT_ONLY_OPS = (ast.BitAnd, ast.BitOr, ast.BitXor)
+
+# What kernels return: whether they stopped at a division by zero
+_OK = 0
+_ZERO_DIVISION = 1
+
+_COMPARISONS = {ast.Eq: Comparison.EQ,
+                ast.NotEq: Comparison.NE,
+                ast.Lt: Comparison.LT,
+                ast.LtE: Comparison.LE,
+                ast.Gt: Comparison.GT,
+                ast.GtE: Comparison.GE}
+
+# Largest constant exponent that "x ** n" is expanded for
+MAX_POWER = 8
+
+class KernelError(Error):
+    """An expression that can't be compiled into a kernel."""
+    pass
+
+def get_dtype(buf):
+    """get_dtype(buf) -> str: the dtype of a buffer-protocol object"""
+    view = memoryview(buf)
+    fmt = view.format.lstrip('@=<')
+    try:
+        return _FORMATS[(fmt, view.itemsize)]
+    except KeyError:
+        raise KernelError('unsupported buffer format: %r' % view.format)
+
+def _num_elements(buf):
+    view = memoryview(buf)
+    return view.nbytes // view.itemsize
+
+def _common_dtype(dtypes):
+    # The "widest" of the given dtypes, in the order of DTYPES
+    order = list(DTYPES)
+    return max(dtypes, key=order.index)
+
+class _Canonicalizer(ast.NodeTransformer):
+    """
+    Rename the arrays within an expression to arg0, arg1, ... in order
+    of first appearance, so that expressions of the same shape share a
+    kernel.
+    """
+    def __init__(self):
+        self.names = []
+
+    def visit_Call(self, node):
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_Name(self, node):
+        if node.id not in self.names:
+            self.names.append(node.id)
+        return ast.Name(id='arg%i' % self.names.index(node.id),
+                        ctx=node.ctx)
+
+class _Lowering:
+    """
+    Lower an expression tree to libgccjit rvalues within a loop body,
+    splitting the body into further blocks for any where() calls.
+
+    Each lowered value is a pair (rvalue, is_bool), since comparisons
+    yield booleans rather than values of the kernel's type.
+    """
+    def __init__(self, ctxt, func, compute_type, is_float, args, index):
+        self.ctxt = ctxt
+        self.func = func
+        self.compute_type = compute_type
+        self.is_float = is_float
+        self.bool_type = ctxt.get_type(TypeKind.BOOL)
+        self.args = args
+        self.index = index
+        self.block = None
+        self.num_temps = 0
+        # Returns _ZERO_DIVISION, once needed
+        self.zero_division_block = None
+
+    def new_temp(self, value=None):
+        tmp = self.func.new_local(self.compute_type,
+                                  b'tmp%i' % self.num_temps)
+        self.num_temps += 1
+        if value is not None:
+            self.block.add_assignment(tmp, value)
+        return tmp
+
+    def as_value(self, value):
+        rvalue, is_bool = value
+        if is_bool:
+            return self.ctxt.new_cast(rvalue, self.compute_type)
+        return rvalue
+
+    def as_bool(self, value):
+        rvalue, is_bool = value
+        if is_bool:
+            return rvalue
+        return self.ctxt.new_comparison(Comparison.NE, rvalue,
+                                        self.ctxt.zero(self.compute_type))
+
+    def lower(self, node):
+        method = getattr(self, 'lower_' + type(node).__name__, None)
+        if method is None:
+            raise KernelError('unsupported syntax: %s' % ast.dump(node))
+        return method(node)
+
+    def lower_Name(self, node):
+        # argN[i]
+        param, param_type = self.args[int(node.id[3:])]
+        rvalue = self.ctxt.new_array_access(param, self.index)
+        if param_type != self.compute_type:
+            rvalue = self.ctxt.new_cast(rvalue, self.compute_type)
+        return (rvalue, False)
+
+    def lower_Constant(self, node):
+        if not isinstance(node.value, (int, float)):
+            raise KernelError('unsupported constant: %r' % node.value)
+        if isinstance(node.value, bool):
+            return (self.ctxt.new_rvalue_from_int(self.bool_type,
+                                                  int(node.value)),
+                    True)
+        if isinstance(node.value, float) or self.is_float:
+            return (self.ctxt.new_rvalue_from_double(self.compute_type,
+                                                     float(node.value)),
+                    False)
+        if not -2 ** 31 <= node.value < 2 ** 31:
+            raise KernelError('integer constant out of range: %i'
+                              % node.value)
+        return (self.ctxt.new_rvalue_from_int(self.compute_type, node.value),
+                False)
+
+    def lower_UnaryOp(self, node):
+        operand = self.lower(node.operand)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        if isinstance(node.op, ast.USub):
+            return (self.ctxt.new_unary_op(UnaryOp.MINUS, self.compute_type,
+                                           self.as_value(operand)),
+                    False)
+        if isinstance(node.op, ast.Not):
+            return (self.ctxt.new_unary_op(UnaryOp.LOGICAL_NEGATE,
+                                           self.bool_type,
+                                           self.as_bool(operand)),
+                    True)
+        if isinstance(node.op, ast.Invert) and not self.is_float:
+            return (self.ctxt.new_unary_op(UnaryOp.BITWISE_NEGATE,
+                                           self.compute_type,
+                                           self.as_value(operand)),
+                    False)
+        raise KernelError('unsupported unary operator: %s' % ast.dump(node))
+
+    def lower_BinOp(self, node):
+        if isinstance(node.op, ast.Pow):
+            return self.lower_power(node)
+        if isinstance(node.op, (ast.FloorDiv, ast.Mod)) and not self.is_float:
+            return self.lower_floor_division(node)
+        if isinstance(node.op, ast.Div) and not self.is_float:
+            raise KernelError('"/" is only supported for float dtypes;'
+                              ' use "//" for integer division')
+        op = _BINARY_OPS.get(type(node.op))
+        if op is None or (self.is_float
+                          and isinstance(node.op, _INT_ONLY_OPS)):
+            raise KernelError('unsupported binary operator: %s'
+                              % ast.dump(node))
+        return (self.ctxt.new_binary_op(op, self.compute_type,
+                                        self.as_value(self.lower(node.left)),
+                                        self.as_value(self.lower(node.right))),
+                False)
+
+    def lower_floor_division(self, node):
+        """
+        Lower integer "a // b" or "a % b", rounding towards negative
+        infinity as Python does, rather than towards zero as C does:
+
+            if (b == 0) return _ZERO_DIVISION;
+            d = b == -1 ? 1 : b;    (INT_MIN / -1 would trap)
+            q = (a / d) * (b == -1 ? -1 : 1);
+            r = a % d;
+            adjust = r != 0 && (r < 0) != (b < 0);
+            a // b is q - adjust, and a % b is r + adjust * b
+        """
+        ctxt = self.ctxt
+        a = self.new_temp(self.as_value(self.lower(node.left)))
+        b = self.new_temp(self.as_value(self.lower(node.right)))
+        zero = ctxt.zero(self.compute_type)
+        one = ctxt.one(self.compute_type)
+
+        if self.zero_division_block is None:
+            self.zero_division_block = self.func.new_block(b'zero_division')
+            self.zero_division_block.end_with_return(
+                ctxt.new_rvalue_from_int(ctxt.get_type(TypeKind.INT),
+                                         _ZERO_DIVISION))
+        nonzero = self.func.new_block()
+        self.block.end_with_conditional(
+            ctxt.new_comparison(Comparison.EQ, b, zero),
+            self.zero_division_block, nonzero)
+        self.block = nonzero
+
+        is_minus_one = ctxt.new_cast(
+            ctxt.new_comparison(Comparison.EQ, b,
+                                ctxt.new_rvalue_from_int(self.compute_type,
+                                                         -1)),
+            self.compute_type)
+        two_if_minus_one = ctxt.new_binary_op(
+            BinaryOp.MULT, self.compute_type,
+            ctxt.new_rvalue_from_int(self.compute_type, 2), is_minus_one)
+        d = self.new_temp(ctxt.new_binary_op(BinaryOp.PLUS, self.compute_type,
+                                             b, two_if_minus_one))
+        r = self.new_temp(ctxt.new_binary_op(BinaryOp.MODULO,
+                                             self.compute_type, a, d))
+        adjust = ctxt.new_cast(
+            ctxt.new_binary_op(
+                BinaryOp.LOGICAL_AND, self.bool_type,
+                ctxt.new_comparison(Comparison.NE, r, zero),
+                ctxt.new_comparison(Comparison.NE,
+                                    ctxt.new_comparison(Comparison.LT,
+                                                        r, zero),
+                                    ctxt.new_comparison(Comparison.LT,
+                                                        b, zero))),
+            self.compute_type)
+        if isinstance(node.op, ast.Mod):
+            return (ctxt.new_binary_op(
+                        BinaryOp.PLUS, self.compute_type, r,
+                        ctxt.new_binary_op(BinaryOp.MULT, self.compute_type,
+                                           adjust, b)),
+                    False)
+        q = ctxt.new_binary_op(
+            BinaryOp.MULT, self.compute_type,
+            ctxt.new_binary_op(BinaryOp.DIVIDE, self.compute_type, a, d),
+            ctxt.new_binary_op(BinaryOp.MINUS, self.compute_type,
+                               one, two_if_minus_one))
+        return (ctxt.new_binary_op(BinaryOp.MINUS, self.compute_type,
+                                   q, adjust),
+                False)
+
+    def lower_power(self, node):
+        # Expand "x ** n" for small constant n into multiplications.
+        exponent = node.right
+        if not (isinstance(exponent, ast.Constant)
+                and type(exponent.value) is int
+                and 0 <= exponent.value <= MAX_POWER):
+            raise KernelError('only constant exponents from 0 to %i'
+                              ' are supported' % MAX_POWER)
+        if exponent.value == 0:
+            return (self.ctxt.one(self.compute_type), False)
+        base = self.as_value(self.lower(node.left))
+        result = base
+        for i in range(exponent.value - 1):
+            result = self.ctxt.new_binary_op(BinaryOp.MULT,
+                                             self.compute_type,
+                                             result, base)
+        return (result, False)
+
+    def lower_Compare(self, node):
+        # Split "a < b < c" into "a < b and b < c"
+        result = None
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            comparison = _COMPARISONS.get(type(op))
+            if comparison is None:
+                raise KernelError('unsupported comparison: %s'
+                                  % ast.dump(node))
+            rvalue = self.ctxt.new_comparison(
+                comparison,
+                self.as_value(self.lower(left)),
+                self.as_value(self.lower(right)))
+            if result is None:
+                result = rvalue
+            else:
+                result = self.ctxt.new_binary_op(BinaryOp.LOGICAL_AND,
+                                                 self.bool_type,
+                                                 result, rvalue)
+            left = right
+        return (result, True)
+
+    def lower_BoolOp(self, node):
+        op = (BinaryOp.LOGICAL_AND if isinstance(node.op, ast.And)
+              else BinaryOp.LOGICAL_OR)
+        values = [self.as_bool(self.lower(value)) for value in node.values]
+        result = values[0]
+        for value in values[1:]:
+            result = self.ctxt.new_binary_op(op, self.bool_type,
+                                             result, value)
+        return (result, True)
+
+    def lower_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.keywords:
+            raise KernelError('unsupported call: %s' % ast.dump(node))
+        if node.func.id == 'abs' and len(node.args) == 1:
+            return (self.ctxt.new_unary_op(UnaryOp.ABS, self.compute_type,
+                                           self.as_value(self.lower(node.args[0]))),
+                    False)
+        if node.func.id == 'where' and len(node.args) == 3:
+            return self.lower_where(*node.args)
+        raise KernelError('unsupported call: %s' % ast.dump(node))
+
+    def lower_where(self, cond, if_true, if_false):
+        """
+        Lower "where(cond, if_true, if_false)" to:
+
+            if (cond) goto on_true; else goto on_false;
+          on_true:
+            tmp = if_true;
+            goto after;
+          on_false:
+            tmp = if_false;
+            goto after;
+          after:
+            ...tmp...
+        """
+        tmp = self.new_temp()
+        boolval = self.as_bool(self.lower(cond))
+        on_true = self.func.new_block()
+        on_false = self.func.new_block()
+        after = self.func.new_block()
+        self.block.end_with_conditional(boolval, on_true, on_false)
+        for block, node in ((on_true, if_true), (on_false, if_false)):
+            self.block = block
+            value = self.as_value(self.lower(node))
+            self.block.add_assignment(tmp, value)
+            self.block.end_with_jump(after)
+        self.block = after
+        return (tmp, False)
+
+class Kernel:
+    """
+    A compiled elementwise expression over a fixed sequence of input
+    dtypes, equivalent to:
+
+      int
+      kernel (long n, const T0 *arg0, ..., const TN *argN, Tout *out)
+      {
+        for (long i = 0; i < n; i++)
+          out[i] = EXPR;
+        return _OK;
+      }
+
+    where EXPR returns _ZERO_DIVISION early for an integer division or
+    modulo by zero.
+    """
+    def __init__(self, expr, dtypes, out_dtype=None, opt_level=3):
+        # expr is either a string, or a tree already passed through
+        # _Canonicalizer.  dtypes gives the dtype of each array, in order
+        # of first appearance within expr.
+        if isinstance(expr, str):
+            expr = _Canonicalizer().visit(ast.parse(expr, mode='eval').body)
+        for dtype in dtypes:
+            if dtype not in DTYPES:
+                raise KernelError('unsupported dtype: %r' % dtype)
+        self.dtypes = tuple(dtypes)
+        compute_dtype = _common_dtype(self.dtypes)
+        self.out_dtype = out_dtype or compute_dtype
+
+        ctxt = Context()
+        ctxt.set_int_option(IntOption.OPTIMIZATION_LEVEL, opt_level)
+        compute_type = ctxt.get_type(DTYPES[compute_dtype][0])
+        out_type = ctxt.get_type(DTYPES[self.out_dtype][0])
+        long_type = ctxt.get_type(TypeKind.LONG)
+
+        param_n = ctxt.new_param(long_type, b'n')
+        args = []
+        for i, dtype in enumerate(self.dtypes):
+            arg_type = ctxt.get_type(DTYPES[dtype][0])
+            args.append((ctxt.new_param(arg_type.get_const().get_pointer(),
+                                        b'arg%i' % i),
+                         arg_type))
+        param_out = ctxt.new_param(out_type.get_pointer(), b'out')
+        int_type = ctxt.get_type(TypeKind.INT)
+        func = ctxt.new_function(FunctionKind.EXPORTED,
+                                 int_type,
+                                 b'kernel',
+                                 [param_n] + [arg for arg, _ in args]
+                                 + [param_out])
+        i = func.new_local(long_type, b'i')
+
+        entry_block = func.new_block(b'entry')
+        cond_block = func.new_block(b'cond')
+        loop_block = func.new_block(b'loop')
+        after_loop_block = func.new_block(b'after_loop')
+
+        entry_block.add_assignment(i, ctxt.zero(long_type))
+        entry_block.end_with_jump(cond_block)
+
+        cond_block.end_with_conditional(
+            ctxt.new_comparison(Comparison.LT, i, param_n),
+            loop_block,
+            after_loop_block)
+
+        lowering = _Lowering(ctxt, func, compute_type,
+                             compute_dtype in _FLOAT_DTYPES, args, i)
+        lowering.block = loop_block
+        value = lowering.as_value(lowering.lower(expr))
+        if self.out_dtype != compute_dtype:
+            value = ctxt.new_cast(value, out_type)
+        # (where() may have moved us on to a later block)
+        lowering.block.add_assignment(ctxt.new_array_access(param_out, i),
+                                      value)
+        lowering.block.add_assignment_op(i, BinaryOp.PLUS,
+                                         ctxt.one(long_type))
+        lowering.block.end_with_jump(cond_block)
+
+        after_loop_block.end_with_return(
+            ctxt.new_rvalue_from_int(int_type, _OK))
+
+        self.result = ctxt.compile()
+        # The inputs are passed as CONST_CHAR_PTR, so that read-only
+        # buffers are accepted for them, but not for out.
+        self._fn = self.result.get_function(
+            b'kernel', TypeKind.INT,
+            [TypeKind.LONG] + [TypeKind.CONST_CHAR_PTR] * len(self.dtypes)
+            + [TypeKind.VOID_PTR])
+
+    def __call__(self, *arrays, out=None):
+        """
+        Evaluate the expression over the given arrays (one per input,
+        in order), writing into out, which is allocated as an
+        array.array if not supplied.  Return out.
+
+        An integer division or modulo by zero raises ZeroDivisionError,
+        leaving out only partly written.
+        """
+        if len(arrays) != len(self.dtypes):
+            raise TypeError('kernel takes %i arrays (%i given)'
+                            % (len(self.dtypes), len(arrays)))
+        n = None
+        for buf, dtype in zip(arrays, self.dtypes):
+            if get_dtype(buf) != dtype:
+                raise KernelError('expected %s array, got %s'
+                                  % (dtype, get_dtype(buf)))
+            if n is None:
+                n = _num_elements(buf)
+            elif _num_elements(buf) != n:
+                raise ValueError('arrays have differing lengths')
+        if n is None:
+            raise TypeError('kernel needs at least one array')
+        if out is None:
+            typecode = DTYPES[self.out_dtype][1]
+            out = array.array(typecode,
+                              bytes(array.array(typecode).itemsize * n))
+        elif get_dtype(out) != self.out_dtype:
+            raise KernelError('expected %s output, got %s'
+                              % (self.out_dtype, get_dtype(out)))
+        elif _num_elements(out) != n:
+            raise ValueError('output has length %i, expected %i'
+                             % (_num_elements(out), n))
+        if self._fn(n, *(arrays + (out,))) == _ZERO_DIVISION:
+            raise ZeroDivisionError('integer division or modulo by zero')
+        return out
+
+class KernelCache:
+    """
+    Kernels, keyed by the shape of their expression (i.e. ignoring the
+    names of the arrays), their dtypes and optimization level, with
+    least-recently-used eviction.
+    """
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._kernels = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_kernel(self, expr, dtypes, out_dtype=None, opt_level=3):
+        """
+        get_kernel(self, expr:str, dtypes:dict, out_dtype=None, opt_level=3)
+          -> (Kernel, list of names)
+
+        Get a Kernel for expr, given a dict mapping each array name
+        within it to its dtype.  The returned names give the order in
+        which the arrays must be passed to the kernel.
+        """
+        canon = _Canonicalizer()
+        tree = canon.visit(ast.parse(expr, mode='eval').body)
+        names = canon.names
+        for name in names:
+            if name not in dtypes:
+                raise KernelError('no dtype given for %r' % name)
+        key_dtypes = tuple(dtypes[name] for name in names)
+        key = (ast.dump(tree), key_dtypes, out_dtype, opt_level)
+        with self._lock:
+            kernel = self._kernels.get(key)
+            if kernel is not None:
+                self._kernels.move_to_end(key)
+                self.hits += 1
+                return kernel, names
+            self.misses += 1
+        kernel = Kernel(tree, key_dtypes, out_dtype, opt_level)
+        with self._lock:
+            self._kernels[key] = kernel
+            while len(self._kernels) > self.capacity:
+                self._kernels.popitem(last=False)
+        return kernel, names
+
+_cache = KernelCache()
+
+def evaluate(expr, arrays=None, *, out=None, opt_level=3, **kwargs):
+    """
+    evaluate(expr:str, arrays:dict=None, *, out=None, opt_level=3,
+             **kwargs) -> out
+
+    Evaluate expr elementwise over the named arrays, compiling (or
+    reusing from the cache) a fused kernel for it.  The arrays are
+    given by the arrays mapping and/or as keyword arguments; arrays
+    whose names clash with evaluate's own parameters (such as "out")
+    must be given by the mapping.
+    """
+    arrays = dict(arrays or {})
+    for name, buf in kwargs.items():
+        if name in arrays:
+            raise TypeError('array %r given twice' % name)
+        arrays[name] = buf
+    dtypes = dict((name, get_dtype(buf)) for name, buf in arrays.items())
+    out_dtype = get_dtype(out) if out is not None else None
+    kernel, names = _cache.get_kernel(expr, dtypes, out_dtype, opt_level)
+    return kernel(*[arrays[name] for name in names], out=out)
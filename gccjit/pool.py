@@ -0,0 +1,115 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Sharing declarations between many compiles via child contexts.
+"""
+
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+import threading
+import time
+
+from ._gccjit import Context
+
+class ContextPool:
+    """
+    A long-lived parent Context holding declarations (types, structs,
+    imported functions, etc) and options shared by many jobs, each of
+    which is built and compiled within a fresh child of the parent.
+
+    populate(ctxt) is called once, on the parent; whatever it returns
+    is passed to each job as the "decls" of the shared declarations, so
+    that jobs reuse the parent's Type and Function objects rather than
+    declaring their own.
+
+    At most max_children children are outstanding at once; further
+    requests block until one is closed.  The pool itself is
+    thread-safe, but the parent must be treated as read-only once
+    populated: jobs must not create anything within it, not even
+    derived types via Type.get_pointer() and friends, since another
+    thread may be compiling a child of it.  Create any derived types
+    that jobs need within populate.
+    """
+    def __init__(self, populate=None, max_children=None):
+        self.parent = Context()
+        start = time.perf_counter()
+        self.decls = populate(self.parent) if populate else None
+        self.populate_time = time.perf_counter() - start
+        self.max_children = max_children
+        if max_children is not None:
+            self._slots = threading.BoundedSemaphore(max_children)
+        else:
+            self._slots = None
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.outstanding = 0
+
+    @contextmanager
+    def child(self):
+        """
+        Get a fresh child of the parent context, for use within a
+        "with" statement; the child is closed (freeing its memory) on
+        exit, releasing its slot in the pool.  Any Result compiled from
+        it remains valid.
+        """
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            with self._lock:
+                ctxt = self.parent.new_child_context()
+                self.jobs += 1
+                self.outstanding += 1
+            try:
+                yield ctxt
+            finally:
+                with self._lock:
+                    ctxt.close()
+                    self.outstanding -= 1
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def compile(self, build):
+        """
+        compile(self, build) -> Result
+
+        Call build(ctxt, decls) to populate a fresh child context, then
+        compile it.
+        """
+        with self.child() as ctxt:
+            build(ctxt, self.decls)
+            return ctxt.compile()
+
+    def get_stats(self):
+        """
+        Get a dict describing the pool: how many jobs it has run, how
+        many children are outstanding, the time taken to populate the
+        parent, and hence an estimate of the build time saved by sharing
+        it rather than repeating it in every job.
+        """
+        with self._lock:
+            return {'jobs': self.jobs,
+                    'outstanding': self.outstanding,
+                    'populate_time': self.populate_time,
+                    'saved_time': self.populate_time * max(self.jobs - 1, 0)}
+
+    def close(self):
+        """Close the parent context (and hence any outstanding children)."""
+        with self._lock:
+            self.parent.close()
@@ -0,0 +1,174 @@
+#   Copyright 2015 David Malcolm <dmalcolm@redhat.com>
+#   Copyright 2015 Red Hat, Inc.
+#
+#   This is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see
+#   <http://www.gnu.org/licenses/>.
+
+"""
+Tiered compilation: compile quickly at a low optimization level, and
+recompile functions that turn out to be hot at a higher one.
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+from ._gccjit import IntOption
+
+class TieredFunction:
+    """
+    A callable wrapping an exported function within ctxt, which is
+    compiled immediately at initial_level.  Once the function has been
+    called threshold times, the same context is recompiled at
+    final_level on a background thread, and later calls go to the new
+    code.
+
+    The context is owned by the TieredFunction from then on: it must not
+    be modified or compiled by anything else.
+
+    Switching tiers just replaces the Callable that calls are
+    dispatched to; a call already in flight holds a reference to the
+    old Callable, and hence to the old Result, so the old code stays
+    loaded until every such call has returned.
+    """
+    def __init__(self, ctxt, funcname, restype, argtypes,
+                 threshold=1000, initial_level=0, final_level=3):
+        self.ctxt = ctxt
+        self.funcname = funcname
+        self.restype = restype
+        self.argtypes = list(argtypes)
+        self.threshold = threshold
+        self.final_level = final_level
+        # Any exception raised by the background compile
+        self.error = None
+        self.calls = 0
+        self._upgraded = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        self.level = initial_level
+        self._fn = self._compile(initial_level)
+        if threshold <= 0:
+            self._start_upgrade()
+
+    def _compile(self, level):
+        self.ctxt.set_int_option(IntOption.OPTIMIZATION_LEVEL, level)
+        result = self.ctxt.compile()
+        return result.get_function(self.funcname, self.restype, self.argtypes)
+
+    def __call__(self, *args):
+        fn = self._fn
+        if not self._started:
+            # Calls from several threads mustn't lose counts, nor start
+            # more than one upgrade.
+            with self._lock:
+                self.calls += 1
+                start = not self._started and self.calls >= self.threshold
+                if start:
+                    self._started = True
+            if start:
+                self._start_thread()
+        return fn(*args)
+
+    def _start_upgrade(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._start_thread()
+
+    def _start_thread(self):
+        thread = threading.Thread(target=self._upgrade, daemon=True)
+        thread.start()
+
+    def _upgrade(self):
+        try:
+            fn = self._compile(self.final_level)
+        except Exception as e:
+            self.error = e
+        else:
+            self._fn = fn
+            self.level = self.final_level
+        finally:
+            self._upgraded.set()
+
+    @property
+    def result(self):
+        """The Result that calls are currently dispatched to"""
+        return self._fn.result
+
+    def wait(self, timeout=None):
+        """
+        Wait for the recompilation at final_level to finish (successfully
+        or not), starting it now if it hasn't already started.  Return
+        True if it has finished.
+        """
+        self._start_upgrade()
+        return self._upgraded.wait(timeout)
+
+def get_hot_functions(profile, threshold):
+    """
+    Get the names of the functions in profile (as given by
+    Result.get_profile) called at least threshold times, hottest first.
+    """
+    return [name
+            for name, count in sorted(profile.items(),
+                                      key=lambda item: (-item[1], item[0]))
+            if count >= threshold]
+
+class ProfileGuidedRecompiler:
+    """
+    Compiles ctxt, a context built with Context.set_profiling enabled,
+    and recompiles once the call counters of the result show that some
+    of its functions are hot.
+
+    Each call to poll() reads the counters, and passes them to
+    policy(profile), which returns the names of the hot functions (by
+    default, those called at least threshold times).  The first time
+    any are hot, the context is recompiled at level, or, if rebuild is
+    given, rebuild(hot) is called to build a new context to compile
+    instead (e.g. one making the callees of the hot functions
+    FunctionKind.ALWAYS_INLINE).
+
+    As with TieredFunction, the context is owned by the recompiler.
+    """
+    def __init__(self, ctxt, threshold=1000, level=3, policy=None,
+                 rebuild=None):
+        self.ctxt = ctxt
+        self.threshold = threshold
+        self.level = level
+        self.policy = policy
+        self.rebuild = rebuild
+        self.result = ctxt.compile()
+        # The names of the functions that triggered recompilation
+        self.hot = None
+
+    def poll(self):
+        """
+        Check the counters, recompiling if the policy says so.  Return
+        the names of the hot functions if this recompiled, else None.
+        """
+        if self.hot is not None:
+            return None
+        profile = self.result.get_profile()
+        if self.policy is not None:
+            hot = self.policy(profile)
+        else:
+            hot = get_hot_functions(profile, self.threshold)
+        if not hot:
+            return None
+        ctxt = self.rebuild(hot) if self.rebuild is not None else self.ctxt
+        ctxt.set_int_option(IntOption.OPTIMIZATION_LEVEL, self.level)
+        self.result = ctxt.compile()
+        self.hot = list(hot)
+        return self.hot
@@ -19,7 +19,6 @@ License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)
 Programming Language :: Python
 Topic :: Software Development :: Libraries :: Python Modules
 Operating System :: Unix
-Programming Language :: Python :: 2
 Programming Language :: Python :: 3
 """
 
@@ -35,7 +34,7 @@ setup(
     classifiers = filter(None, classifiers.split("\n")),
     cmdclass = {'build_ext': build_ext},
     ext_modules = [Extension("gccjit._gccjit", ["gccjit/gccjit.pyx"],
-                             libraries=["gccjit"],
+                             libraries=["gccjit", "dl"],
                              # Hacks for ease of hacking on this:
                              #include_dirs = ['/home/david/coding/gcc-python/gcc-git-jit-clean/src/gcc/jit'],
                              #library_dirs=["/home/david/coding/gcc-python/gcc-git-jit-clean/build/gcc/"],
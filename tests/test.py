@@ -36,6 +36,244 @@ class JitTests(unittest.TestCase):
             self.assertEqual(test_calling_fn(i),
                              sum([j * j for j in range(i)]))
 
+    def test_get_function(self):
+        from examples.square import create_fn
+        result = create_fn()
+        square = result.get_function(b"square",
+                                     gccjit.TypeKind.INT,
+                                     [gccjit.TypeKind.INT])
+        self.assertEqual(square(5), 25)
+        self.assertEqual(square(-3), 9)
+        self.assertIs(square.result, result)
+        with self.assertRaises(TypeError):
+            square()
+
+    def test_get_function_signatures(self):
+        ctxt = gccjit.Context()
+        double_type = ctxt.get_type(gccjit.TypeKind.DOUBLE)
+        long_type = ctxt.get_type(gccjit.TypeKind.LONG)
+        a = ctxt.new_param(double_type, b'a')
+        b = ctxt.new_param(long_type, b'b')
+        fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                               double_type, b'scale', [a, b])
+        fn.new_block().end_with_return(
+            ctxt.new_binary_op(gccjit.BinaryOp.MULT, double_type,
+                               a, ctxt.new_cast(b, double_type)))
+        result = ctxt.compile()
+        scale = result.get_function(b'scale',
+                                    gccjit.TypeKind.DOUBLE,
+                                    [gccjit.TypeKind.DOUBLE,
+                                     gccjit.TypeKind.LONG])
+        self.assertEqual(scale(1.5, 4), 6.0)
+        with self.assertRaises(gccjit.Error):
+            result.get_function(b'not_there', gccjit.TypeKind.VOID, [])
+
+    def test_map(self):
+        from array import array
+        ctxt = gccjit.Context()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        param_i = ctxt.new_param(int_type, b'i')
+        square = ctxt.new_function(gccjit.FunctionKind.ALWAYS_INLINE,
+                                   int_type, b"square", [param_i])
+        square.new_block(b'entry').end_with_return(
+            ctxt.new_binary_op(gccjit.BinaryOp.MULT, int_type,
+                               param_i, param_i))
+        gccjit.make_map_function(ctxt, square, int_type, int_type,
+                                 b"square_all")
+        result = ctxt.compile()
+        data = array('i', range(10))
+        out = array('i', [0] * 10)
+        result.map(b"square_all", data, out)
+        self.assertEqual(list(out), [i * i for i in range(10)])
+
+        # The loop can also be called directly, passing buffers for
+        # the pointer arguments:
+        fn = result.get_function(b"square_all", gccjit.TypeKind.VOID,
+                                 [gccjit.TypeKind.VOID_PTR,
+                                  gccjit.TypeKind.VOID_PTR,
+                                  gccjit.TypeKind.LONG])
+        fn(array('i', [7]), out, 1)
+        self.assertEqual(out[0], 49)
+
+        with self.assertRaises(ValueError):
+            result.map(b"square_all", data, array('i', [0] * 5))
+
+        # The element types of the buffers must match those of the loop:
+        self.assertEqual(int_type.format, 'i')
+        self.assertEqual(ctxt.get_map_formats(),
+                         {b"square_all": ('i', 'i')})
+        for bad_in, bad_out in ((array('d', [0.0] * 10), out),
+                                (data, array('q', [0] * 10)),
+                                (data, array('I', [0] * 10)),
+                                (data, memoryview(bytearray(40)))):
+            with self.assertRaises(gccjit.Error):
+                result.map(b"square_all", bad_in, bad_out)
+        with self.assertRaises(gccjit.Error):
+            result.map(b"square_all", data, out, formats=('d', 'd'))
+        out = array('i', [0] * 10)
+        result.map(b"square_all", memoryview(data).cast('B').cast('i'),
+                   out)
+        self.assertEqual(list(out), [i * i for i in range(10)])
+
+    def test_kernels(self):
+        from array import array
+        from gccjit import kernels
+        a = array('d', [1.0, 2.0, 3.0])
+        b = array('d', [4.0, 5.0, 6.0])
+        c = array('d', [0.5, 0.5, 0.5])
+        out = kernels.evaluate('a*b + c', a=a, b=b, c=c)
+        self.assertEqual(list(out), [4.5, 10.5, 18.5])
+
+        x = array('i', [-2, 0, 3])
+        out = kernels.evaluate('where(x > 0, x, -x) * 2', x=x)
+        self.assertEqual(out.typecode, 'i')
+        self.assertEqual(list(out), [4, 0, 6])
+
+        # Same shape and dtypes, different names: reuses the kernel
+        hits = kernels._cache.hits
+        out = kernels.evaluate('where(y > 0, y, -y) * 2', y=x)
+        self.assertEqual(kernels._cache.hits, hits + 1)
+
+        with self.assertRaises(kernels.KernelError):
+            kernels.evaluate('a @ b', a=a, b=b)
+
+        # Integer division and modulo round towards negative infinity,
+        # as in Python, whatever the signs of the operands.
+        # (INT_MIN // -1 overflows, but mustn't trap as it does in C.)
+        x = array('i', [7, -7, 7, -7, 0, -2 ** 31, -2 ** 31])
+        y = array('i', [2, 2, -2, -2, -3, 3, -1])
+        out = list(kernels.evaluate('x // y', x=x, y=y))
+        self.assertEqual(out[:6], [3, -4, -4, 3, 0, -715827883])
+        self.assertEqual(list(kernels.evaluate('x % y', x=x, y=y)),
+                         [1, 1, -1, -1, 0, 1, 0])
+        zeros = array('i', [0] * 7)
+        with self.assertRaises(ZeroDivisionError):
+            kernels.evaluate('x // y', x=x, y=zeros)
+        with self.assertRaises(ZeroDivisionError):
+            kernels.evaluate('x % y', x=x, y=zeros)
+        # Only divisions that are actually evaluated are checked.
+        self.assertEqual(list(kernels.evaluate('where(y != 0, x % y, 0)',
+                                               x=x, y=zeros)),
+                         [0] * 7)
+        with self.assertRaises(kernels.KernelError):
+            kernels.evaluate('x / y', x=x, y=y)
+
+        # Arrays may be named after evaluate's own parameters.
+        out = kernels.evaluate('out + opt_level',
+                               {'out': b, 'opt_level': c})
+        self.assertEqual(list(out), [4.5, 5.5, 6.5])
+        with self.assertRaises(TypeError):
+            kernels.evaluate('a + b', {'a': a}, a=a, b=b)
+
+        # Inputs may be read-only, but out must be writable.
+        readonly_a = memoryview(a.tobytes()).cast('d')
+        out = kernels.evaluate('a*b + c', a=readonly_a, b=b, c=c)
+        self.assertEqual(list(out), [4.5, 10.5, 18.5])
+        with self.assertRaises(BufferError):
+            kernels.evaluate('a*b + c', a=a, b=b, c=c,
+                             out=memoryview(out.tobytes()).cast('d'))
+
+    def test_compile_many(self):
+        from examples.sum_of_squares import populate_ctxt
+        contexts = []
+        for i in range(4):
+            ctxt = gccjit.Context()
+            populate_ctxt(ctxt)
+            contexts.append(ctxt)
+        results = gccjit.compile_many(contexts, max_workers=2)
+        self.assertEqual(len(results), 4)
+        for result in results:
+            code = int_int_func_type(result.get_code(b"loop_test"))
+            self.assertEqual(code(5), 30)
+
+    def test_compile_async(self):
+        import asyncio
+        from examples.sum_of_squares import populate_ctxt
+        ctxt = gccjit.Context()
+        populate_ctxt(ctxt)
+        async def compile_it():
+            return await ctxt.compile_async()
+        result = asyncio.run(compile_it())
+        code = int_int_func_type(result.get_code(b"loop_test"))
+        self.assertEqual(code(5), 30)
+
+    def test_fingerprint(self):
+        from examples.sum_of_squares import populate_ctxt
+        fingerprints = []
+        for opt_level in (0, 0, 2):
+            ctxt = gccjit.Context()
+            ctxt.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL,
+                                opt_level)
+            populate_ctxt(ctxt)
+            fingerprints.append(ctxt.get_fingerprint())
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+
+    def test_fingerprint_doubles(self):
+        fingerprints = []
+        for value in (1e-9, 2e-9):
+            ctxt = gccjit.Context()
+            double_type = ctxt.get_type(gccjit.TypeKind.DOUBLE)
+            fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                                   double_type, b"get_constant", [])
+            block = fn.new_block()
+            block.end_with_return(
+                ctxt.new_rvalue_from_double(double_type, value))
+            fingerprints.append(ctxt.get_fingerprint())
+        self.assertNotEqual(fingerprints[0], fingerprints[1])
+
+    def test_result_cache(self):
+        from gccjit.cache import ResultCache
+        from examples.sum_of_squares import populate_ctxt
+        cache = ResultCache(capacity=1)
+        results = []
+        for i in range(2):
+            ctxt = gccjit.Context()
+            populate_ctxt(ctxt)
+            results.append(cache.compile(ctxt))
+        self.assertIsNot(results[0], results[1])
+        self.assertEqual(results[0].get_code(b"loop_test"),
+                         results[1].get_code(b"loop_test"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Each caller gets its own handle, so one closing it can't free
+        # code that another is still using:
+        loop_test = results[1].get_function(b"loop_test",
+                                            gccjit.TypeKind.INT,
+                                            [gccjit.TypeKind.INT])
+        results[0].close()
+        with self.assertRaises(gccjit.Error):
+            results[0].get_code(b"loop_test")
+        self.assertEqual(loop_test(5), 30)
+
+        # Evicting the entry mustn't free code that we still hold:
+        ctxt = gccjit.Context()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                               int_type, b"other", [])
+        fn.new_block().end_with_return(ctxt.zero(int_type))
+        cache.compile(ctxt)
+        self.assertEqual(len(cache), 1)
+        code = int_int_func_type(results[1].get_code(b"loop_test"))
+        self.assertEqual(code(5), 30)
+
+    def test_disk_cache(self):
+        from gccjit.cache import DiskCache
+        from examples.sum_of_squares import populate_ctxt
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = DiskCache(tmpdir)
+            for i in range(2):
+                ctxt = gccjit.Context()
+                populate_ctxt(ctxt)
+                result = cache.compile(ctxt)
+                self.assertIsInstance(result, gccjit.LibraryResult)
+                code = int_int_func_type(result.get_code(b"loop_test"))
+                self.assertEqual(code(5), 30)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            cache.max_bytes = 0
+            cache.evict()
+            self.assertEqual(os.listdir(tmpdir), [])
+
     def test_imported_function(self):
         """
         void some_fn (const char *name)
@@ -133,6 +371,722 @@ class JitTests(unittest.TestCase):
         self.assertEqual(str(call),
                          'fn (a, b, c)')
 
+    def test_interning(self):
+        ctxt = gccjit.Context()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        self.assertIs(ctxt.get_type(gccjit.TypeKind.INT), int_type)
+        self.assertIs(ctxt.get_int_type(4, True), ctxt.get_int_type(4, True))
+        self.assertIs(int_type.get_pointer(), int_type.get_pointer())
+        self.assertIs(int_type.get_const(), int_type.get_const())
+        self.assertIs(int_type.get_volatile(), int_type.get_volatile())
+        self.assertIsNot(int_type.get_const(), int_type.get_volatile())
+        self.assertIs(ctxt.zero(int_type), ctxt.new_rvalue_from_int(int_type, 0))
+        self.assertIs(ctxt.one(int_type), ctxt.one(int_type))
+        self.assertIs(ctxt.new_rvalue_from_int(int_type, 42),
+                      ctxt.new_rvalue_from_int(int_type, 42))
+        self.assertIsNot(ctxt.new_rvalue_from_int(int_type, 42),
+                         ctxt.new_rvalue_from_int(ctxt.get_type(gccjit.TypeKind.LONG), 42))
+        loc = ctxt.new_location(b'foo.c', 1, 2)
+        self.assertIs(ctxt.new_location(b'foo.c', 1, 2), loc)
+        self.assertIsNot(ctxt.new_location(b'foo.c', 1, 3), loc)
+
+        # Each context has its own table.
+        other = gccjit.Context()
+        self.assertIsNot(other.get_type(gccjit.TypeKind.INT), int_type)
+        child = ctxt.new_child_context()
+        self.assertIsNot(child.get_type(gccjit.TypeKind.INT), int_type)
+
+    def test_add_statements(self):
+        ctxt = gccjit.Context()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        param_arr = ctxt.new_param(int_type.get_pointer(), b'arr')
+        fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                               int_type, b'sum_first_4', [param_arr])
+        total = fn.new_local(int_type, b'total')
+        block = fn.new_block(b'entry')
+        loc = ctxt.new_location(b'test.c', 1, 0)
+        elements = ctxt.new_array_accesses(
+            [(param_arr, ctxt.new_rvalue_from_int(int_type, i))
+             for i in range(4)])
+        doubled = ctxt.new_binary_ops(
+            [(gccjit.BinaryOp.MULT, int_type, e, ctxt.new_rvalue_from_int(int_type, 2), loc)
+             for e in elements])
+        S = gccjit.StatementKind
+        block.add_statements(
+            [(S.COMMENT, b'total = 0;'),
+             (S.ASSIGN, total, ctxt.zero(int_type), loc)]
+            + [(S.ASSIGN_OP, total, gccjit.BinaryOp.PLUS, d) for d in doubled])
+        with self.assertRaises(ValueError):
+            block.add_statements([(S.COMMENT, b'', loc, loc)])
+        with self.assertRaises(TypeError):
+            block.add_statements([(S.ASSIGN, total, b'not an rvalue')])
+        block.end_with_return(total)
+
+        result = ctxt.compile()
+        from array import array
+        arr = array('i', [1, 2, 3, 4])
+        sum_first_4 = result.get_function(b'sum_first_4', gccjit.TypeKind.INT,
+                                          [gccjit.TypeKind.VOID_PTR])
+        self.assertEqual(sum_first_4(arr), 20)
+
+        # Only a CONST_CHAR_PTR argument accepts a read-only buffer.
+        readonly = memoryview(arr.tobytes()).cast('i')
+        self.assertTrue(readonly.readonly)
+        with self.assertRaises(BufferError):
+            sum_first_4(readonly)
+        sum_first_4 = result.get_function(b'sum_first_4', gccjit.TypeKind.INT,
+                                          [gccjit.TypeKind.CONST_CHAR_PTR])
+        self.assertEqual(sum_first_4(readonly), 20)
+        self.assertEqual(sum_first_4(arr), 20)
+
+    def test_hashing(self):
+        ctxt = gccjit.Context()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        param_i = ctxt.new_param(int_type, b'i')
+        fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                               int_type, b'f', [param_i])
+        block = fn.new_block()
+        other = ctxt.new_param(int_type, b'i')
+
+        seen = {int_type: 'type', param_i: 'param', fn: 'fn', block: 'block'}
+        self.assertEqual(seen[ctxt.get_type(gccjit.TypeKind.INT)], 'type')
+        self.assertEqual(seen[fn.get_param(0)], 'param')
+        self.assertEqual(seen[block.get_function()], 'fn')
+        self.assertNotIn(other, seen)
+        self.assertEqual(len({param_i, fn.get_param(0), other}), 2)
+
+        self.assertEqual(param_i.address, fn.get_param(0).address)
+        self.assertNotEqual(param_i.address, other.address)
+        self.assertIsInstance(param_i.address, int)
+        self.assertNotEqual(param_i, None)
+        self.assertNotEqual(int_type, 'int')
+
+    def test_lifetimes(self):
+        import gc
+        from examples.sum_of_squares import populate_ctxt
+
+        # Wrappers keep their context alive.
+        int_type = gccjit.Context().get_type(gccjit.TypeKind.INT)
+        gc.collect()
+        self.assertEqual(str(int_type.get_pointer()), 'int *')
+
+        # Children keep their parent alive.
+        parent = gccjit.Context()
+        child = parent.new_child_context()
+        del parent
+        gc.collect()
+        populate_ctxt(child)
+        result = child.compile()
+        del child
+        gc.collect()
+        self.assertNotEqual(result.get_code(b'loop_test'), 0)
+
+    def test_release_without_gc(self):
+        # Interned wrappers don't keep their context alive through the
+        # context's intern table, so the gcc_jit_context is released as
+        # soon as the last reference goes, without the garbage collector.
+        import gc
+        import weakref
+        from examples.sum_of_squares import populate_ctxt
+        gc.disable()
+        try:
+            ctxt = gccjit.Context()
+            populate_ctxt(ctxt)
+            int_type = ctxt.get_type(gccjit.TypeKind.INT)
+            int_type.get_pointer()
+            ctxt.zero(int_type)
+            ctxt.new_location(b'foo.c', 1, 2)
+            ref = weakref.ref(ctxt)
+            del ctxt
+            self.assertIsNotNone(ref())
+            del int_type
+            self.assertIsNone(ref())
+        finally:
+            gc.enable()
+
+    def test_close(self):
+        from examples.sum_of_squares import populate_ctxt
+        for i in range(100):
+            with gccjit.Context() as ctxt:
+                populate_ctxt(ctxt)
+                with ctxt.compile() as result:
+                    self.assertNotEqual(result.get_code(b'loop_test'), 0)
+                with self.assertRaises(gccjit.Error):
+                    result.get_code(b'loop_test')
+            self.assertTrue(ctxt.closed)
+            with self.assertRaises(gccjit.Error):
+                ctxt.compile()
+            # Closing again is harmless.
+            ctxt.close()
+            result.close()
+
+        # Closing a parent closes its children.
+        parent = gccjit.Context()
+        child = parent.new_child_context()
+        parent.close()
+        self.assertTrue(child.closed)
+
+    def test_use_after_close(self):
+        ctxt = gccjit.Context()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        param_x = ctxt.new_param(int_type, b'x')
+        fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                               int_type, b'ident', [param_x])
+        block = fn.new_block()
+        block.end_with_return(param_x)
+        result = ctxt.compile()
+        ident = result.get_function(b'ident', gccjit.TypeKind.INT,
+                                    [gccjit.TypeKind.INT])
+        self.assertEqual(ident(42), 42)
+
+        # Objects created within a closed context mustn't reach libgccjit.
+        ctxt.close()
+        with self.assertRaises(gccjit.Error):
+            ctxt.get_type(gccjit.TypeKind.INT)
+        with self.assertRaises(gccjit.Error):
+            int_type.get_pointer()
+        with self.assertRaises(gccjit.Error):
+            str(int_type)
+        with self.assertRaises(gccjit.Error):
+            ctxt.new_rvalue_from_int(int_type, 1)
+        with self.assertRaises(gccjit.Error):
+            fn.new_block()
+        with self.assertRaises(gccjit.Error):
+            block.end_with_return(param_x)
+        with self.assertRaises(gccjit.Error):
+            ctxt.compile()
+        with tempfile.NamedTemporaryFile(suffix='.o') as f:
+            with self.assertRaises(gccjit.Error):
+                ctxt.compile_to_file(gccjit.OutputKind.OBJECT_FILE,
+                                     f.name.encode())
+
+        # The Result outlives its context, but not its own close().
+        self.assertEqual(ident(7), 7)
+        result.close()
+        with self.assertRaises(gccjit.Error):
+            result.get_code(b'ident')
+        with self.assertRaises(gccjit.Error):
+            result.get_function(b'ident', gccjit.TypeKind.INT,
+                                [gccjit.TypeKind.INT])
+        with self.assertRaises(gccjit.Error):
+            ident(7)
+
+    def test_context_pool(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from gccjit.pool import ContextPool
+
+        def populate(ctxt):
+            ctxt.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL, 1)
+            int_type = ctxt.get_type(gccjit.TypeKind.INT)
+            param_x = ctxt.new_param(int_type, b'x')
+            square = ctxt.new_function(gccjit.FunctionKind.INTERNAL,
+                                       int_type, b'square', [param_x])
+            square.new_block().end_with_return(
+                ctxt.new_binary_op(gccjit.BinaryOp.MULT, int_type,
+                                   param_x, param_x))
+            return {'int': int_type, 'square': square}
+
+        pool = ContextPool(populate, max_children=2)
+
+        def job(i):
+            def build(ctxt, decls):
+                int_type = decls['int']
+                param_x = ctxt.new_param(int_type, b'x')
+                fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                                       int_type, b'f', [param_x])
+                fn.new_block().end_with_return(
+                    ctxt.new_binary_op(gccjit.BinaryOp.PLUS, int_type,
+                                       ctxt.new_call(decls['square'], [param_x]),
+                                       ctxt.new_rvalue_from_int(int_type, i)))
+                self.assertLessEqual(pool.get_stats()['outstanding'], 2)
+            result = pool.compile(build)
+            f = result.get_function(b'f', gccjit.TypeKind.INT,
+                                    [gccjit.TypeKind.INT])
+            return f(3)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            self.assertEqual(list(executor.map(job, range(8))),
+                             [9 + i for i in range(8)])
+        stats = pool.get_stats()
+        self.assertEqual(stats['jobs'], 8)
+        self.assertEqual(stats['outstanding'], 0)
+        self.assertGreaterEqual(stats['saved_time'], 0.0)
+
+        # Children inherit the parent's options, and their fingerprint
+        # covers the parent's code.
+        with pool.child() as a, pool.child() as b:
+            self.assertEqual(a.get_fingerprint(), b.get_fingerprint())
+            other = gccjit.Context().new_child_context()
+            self.assertNotEqual(a.get_fingerprint(), other.get_fingerprint())
+        pool.close()
+
+    def test_compile_stats(self):
+        from examples.sum_of_squares import populate_ctxt
+        ctxt = gccjit.Context()
+        populate_ctxt(ctxt)
+        self.assertIsNone(ctxt.compile().stats)
+
+        result = ctxt.compile(stats=True)
+        stats = result.stats
+        self.assertIsInstance(stats, gccjit.CompileStats)
+        self.assertEqual(stats.object_counts['Function'], 1)
+        self.assertEqual(stats.object_counts['Block'], 4)
+        self.assertGreater(stats.object_counts['RValue'], 0)
+        self.assertGreaterEqual(stats.build_time, 0.0)
+        self.assertGreater(stats.compile_time, 0.0)
+        self.assertEqual(list(stats.function_sizes), [b'loop_test'])
+        self.assertGreater(stats.code_size, 0)
+        self.assertEqual(stats.lookups, [])
+        result.get_code(b'loop_test')
+        self.assertEqual([name for name, t in stats.lookups], [b'loop_test'])
+        import json
+        json.dumps(stats.as_dict())
+
+        calls = []
+        def hook(ctxt, result, stats):
+            calls.append((ctxt, result, stats))
+        gccjit.add_compile_hook(hook)
+        try:
+            result = ctxt.compile()
+        finally:
+            gccjit.remove_compile_hook(hook)
+        self.assertEqual(calls, [(ctxt, result, result.stats)])
+        ctxt.compile()
+        self.assertEqual(len(calls), 1)
+
+        # Trampolines built for Callables are compiled behind the hooks'
+        # backs.  (No other test calls a function with this signature,
+        # so its trampoline isn't cached yet.)
+        ctxt = gccjit.Context()
+        long_type = ctxt.get_type(gccjit.TypeKind.LONG)
+        double_type = ctxt.get_type(gccjit.TypeKind.DOUBLE)
+        params = [ctxt.new_param(t, b'p%i' % i)
+                  for i, t in enumerate([double_type, long_type] * 3)]
+        fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                               long_type, b'sixth', params)
+        fn.new_block().end_with_return(params[5])
+        result = ctxt.compile()
+        calls = []
+        gccjit.add_compile_hook(hook)
+        try:
+            sixth = result.get_function(
+                b'sixth', gccjit.TypeKind.LONG,
+                [gccjit.TypeKind.DOUBLE, gccjit.TypeKind.LONG] * 3)
+            self.assertEqual(sixth(0.5, 1, 1.5, 2, 2.5, 3), 3)
+        finally:
+            gccjit.remove_compile_hook(hook)
+        self.assertEqual(calls, [])
+
+    def test_tiered(self):
+        from examples.sum_of_squares import populate_ctxt
+        from gccjit.tiered import TieredFunction
+        ctxt = gccjit.Context()
+        populate_ctxt(ctxt)
+        fn = TieredFunction(ctxt, b'loop_test', gccjit.TypeKind.INT,
+                            [gccjit.TypeKind.INT], threshold=5)
+        self.assertEqual(fn.level, 0)
+        first_result = fn.result
+        for i in range(10):
+            self.assertEqual(fn(10), 285)
+        self.assertTrue(fn.wait(timeout=60))
+        self.assertIsNone(fn.error)
+        self.assertEqual(fn.level, 3)
+        self.assertIsNot(fn.result, first_result)
+        self.assertEqual(fn(10), 285)
+
+    def test_function_table(self):
+        ctxt = gccjit.Context()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        for i in range(4):
+            param_x = ctxt.new_param(int_type, b'x')
+            fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                                   int_type, b'add_%i' % i, [param_x])
+            fn.new_block().end_with_return(
+                ctxt.new_binary_op(gccjit.BinaryOp.PLUS, int_type, param_x,
+                                   ctxt.new_rvalue_from_int(int_type, i)))
+        child = ctxt.new_child_context()
+        param_x = child.new_param(int_type, b'x')
+        fn = child.new_function(gccjit.FunctionKind.EXPORTED,
+                                int_type, b'negate', [param_x])
+        fn.new_block().end_with_return(
+            child.new_unary_op(gccjit.UnaryOp.MINUS, int_type, param_x))
+        result = child.compile()
+        table = result.get_table()
+        self.assertIs(result.get_table(), table)
+        self.assertEqual(table.names,
+                         (b'add_0', b'add_1', b'add_2', b'add_3', b'negate'))
+        self.assertEqual(len(table), 5)
+        for i, name in enumerate(table.names):
+            self.assertEqual(table.ordinal(name), i)
+            self.assertEqual(table[i], result.get_code(name))
+        self.assertEqual(table.as_dict()[b'negate'], table[4])
+        with self.assertRaises(IndexError):
+            table[5]
+        with self.assertRaises(gccjit.Error):
+            table.ordinal(b'missing')
+        add_2 = table.get_function(table.ordinal(b'add_2'),
+                                   gccjit.TypeKind.INT, [gccjit.TypeKind.INT])
+        self.assertEqual(add_2(40), 42)
+        entries = (ctypes.c_void_p * len(table)).from_address(table.address)
+        self.assertEqual(entries[4], table[4])
+        del add_2
+        result.close()
+        with self.assertRaises(gccjit.Error):
+            result.get_table()
+        self.assertEqual(len(table), 0)
+
+    def test_perf_map(self):
+        from examples.sum_of_squares import populate_ctxt
+        path = gccjit.get_perf_map_path()
+        self.assertEqual(path, '/tmp/perf-%i.map' % os.getpid())
+        # Lines written by anything else are left alone.
+        other = '1000 10 other_jit_%i' % id(self)
+        with open(path, 'a') as f:
+            f.write(other + '\n')
+        ctxt = gccjit.Context()
+        populate_ctxt(ctxt)
+        result = ctxt.compile(perf_map=True)
+        with open(path) as f:
+            before = f.read().splitlines()
+        entry = '%x' % result.get_code(b'loop_test')
+        matches = [line for line in before if line.startswith(entry + ' ')]
+        self.assertEqual(len(matches), 1)
+        start, size, name = matches[0].split()
+        self.assertGreater(int(size, 16), 0)
+        self.assertEqual(name, 'loop_test')
+
+        # Closing removes just the result's own line.
+        result.close()
+        with open(path) as f:
+            after = f.read().splitlines()
+        self.assertEqual(after,
+                         [line for line in before if line != matches[0]])
+        self.assertIn(other, after)
+
+    def test_release_with_table(self):
+        # A Result and its FunctionTable don't form a reference cycle,
+        # so dropping them releases the code (and its perf map entries)
+        # straight away, whilst the log is still open.  Their perf map
+        # entries go the next time the map is updated.
+        from examples.sum_of_squares import populate_ctxt
+        path = gccjit.get_perf_map_path()
+        with tempfile.TemporaryFile() as log:
+            ctxt = gccjit.Context()
+            ctxt.set_logfile(log)
+            populate_ctxt(ctxt)
+            result = ctxt.compile(perf_map=True)
+            other = ctxt.compile(perf_map=True)
+            table = result.get_table()
+            self.assertIs(result.get_table(), table)
+            line = '%x ' % table[table.ordinal(b'loop_test')]
+            other_line = '%x ' % other.get_code(b'loop_test')
+            with open(path) as f:
+                before = f.read().splitlines()
+            self.assertEqual(
+                len([l for l in before if l.startswith(line)]), 1)
+            del table, result
+            log.seek(0)
+            self.assertIn(b'gcc_jit_result_release', log.read())
+            other.close()
+            with open(path) as f:
+                after = f.read().splitlines()
+            self.assertEqual(
+                after,
+                [l for l in before
+                 if not l.startswith(line) and not l.startswith(other_line)])
+
+    def test_profiling(self):
+        from gccjit.tiered import ProfileGuidedRecompiler, get_hot_functions
+        ctxt = gccjit.Context()
+        ctxt.set_profiling(True)
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        param_x = ctxt.new_param(int_type, b'x')
+        helper = ctxt.new_function(gccjit.FunctionKind.INTERNAL,
+                                   int_type, b'helper', [param_x])
+        helper.new_block().end_with_return(
+            ctxt.new_binary_op(gccjit.BinaryOp.MULT, int_type,
+                               param_x, param_x))
+        for name in (b'hot', b'cold'):
+            param_y = ctxt.new_param(int_type, b'y')
+            fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                                   int_type, name, [param_y])
+            fn.new_block().end_with_return(ctxt.new_call(helper, [param_y]))
+
+        recompiler = ProfileGuidedRecompiler(ctxt, threshold=5)
+        result = recompiler.result
+        self.assertEqual(result.get_profile(),
+                         {b'helper': 0, b'hot': 0, b'cold': 0})
+        self.assertNotEqual(result.get_global(b'__pygccjit_calls_hot'), 0)
+        self.assertEqual(result.get_global(b'no_such_global'), 0)
+        hot = result.get_function(b'hot', gccjit.TypeKind.INT,
+                                  [gccjit.TypeKind.INT])
+        cold = result.get_function(b'cold', gccjit.TypeKind.INT,
+                                   [gccjit.TypeKind.INT])
+        for i in range(4):
+            self.assertEqual(hot(i), i * i)
+        self.assertEqual(cold(3), 9)
+        self.assertEqual(result.get_profile(),
+                         {b'helper': 5, b'hot': 4, b'cold': 1})
+        self.assertEqual(recompiler.poll(), None)
+        self.assertEqual(get_hot_functions(result.get_profile(), 4),
+                         [b'helper', b'hot'])
+
+        hot(4)
+        self.assertEqual(recompiler.poll(), [b'helper', b'hot'])
+        self.assertIsNot(recompiler.result, result)
+        self.assertEqual(recompiler.result.get_profile(),
+                         {b'helper': 0, b'hot': 0, b'cold': 0})
+        self.assertIsNone(recompiler.poll())
+
+        self.assertEqual(result.get_profile(reset=True)[b'hot'], 5)
+        self.assertEqual(result.get_profile()[b'hot'], 0)
+
+    def test_profiling_replayed(self):
+        from gccjit import farm
+        ctxt = gccjit.Context()
+        ctxt.set_profiling(True)
+        ctxt.start_recording()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        param_x = ctxt.new_param(int_type, b'x')
+        fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                               int_type, b'square', [param_x])
+        fn.new_block().end_with_return(
+            ctxt.new_binary_op(gccjit.BinaryOp.MULT, int_type,
+                               param_x, param_x))
+        recording = ctxt.get_recording()
+
+        replayed = gccjit.Context()
+        replayed.replay(recording)
+        self.assertEqual(replayed.get_profiled_functions(),
+                         ((b'square', b'__pygccjit_calls_square'),))
+        with farm.Farm(max_workers=1) as f:
+            farmed = f.submit(recording).result()
+        for result in (replayed.compile(), farmed):
+            self.assertEqual(result.get_profile(), {b'square': 0})
+            square = result.get_function(b'square', gccjit.TypeKind.INT,
+                                         [gccjit.TypeKind.INT])
+            self.assertEqual(square(3), 9)
+            self.assertEqual(result.get_profile(), {b'square': 1})
+
+    def test_lazy_locations(self):
+        ctxt = gccjit.Context()
+        ctxt.set_lazy_locations(True)
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        loc = ctxt.new_location(b'foo.bf', 1, 2)
+        self.assertIs(ctxt.new_location(b'foo.bf', 1, 2), loc)
+        self.assertNotEqual(ctxt.new_location(b'foo.bf', 1, 3), loc)
+        self.assertEqual({loc: 'loc'}[loc], 'loc')
+        self.assertEqual(str(loc), 'foo.bf:1:2')
+        # Without debuginfo, the location is never created.
+        fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED, int_type,
+                               b'f', [], loc=loc)
+        self.assertEqual(loc.address, 0)
+
+        # With it, locations are created as they're used.
+        ctxt.set_bool_option(gccjit.BoolOption.DEBUGINFO, True)
+        other_loc = ctxt.new_location(b'foo.bf', 2, 1)
+        self.assertEqual(other_loc.address, 0)
+        fn.new_block().end_with_return(ctxt.zero(int_type), other_loc)
+        self.assertNotEqual(other_loc.address, 0)
+        self.assertEqual(str(other_loc), 'foo.bf:2:1')
+        f = ctxt.compile().get_function(b'f', gccjit.TypeKind.INT, [])
+        self.assertEqual(f(), 0)
+
+    def test_debug_string_cached(self):
+        ctxt = gccjit.Context()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        param_i = ctxt.new_param(int_type, b'i')
+        rvalue = ctxt.new_binary_op(gccjit.BinaryOp.MULT, int_type,
+                                    param_i, param_i)
+        s = str(rvalue)
+        self.assertEqual(s, 'i * i')
+        self.assertIs(str(rvalue), s)
+
+    def test_recording(self):
+        from examples.sum_of_squares import populate_ctxt
+        ctxt = gccjit.Context()
+        ctxt.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL, 2)
+        ctxt.start_recording()
+        populate_ctxt(ctxt)
+        recording = ctxt.get_recording()
+        self.assertIsInstance(recording, bytes)
+
+        replayed = gccjit.Context()
+        replayed.replay(recording)
+        result = replayed.compile()
+        self.assertEqual(result.get_table().names, (b'loop_test',))
+        loop_test = result.get_function(b'loop_test', gccjit.TypeKind.INT,
+                                        [gccjit.TypeKind.INT])
+        self.assertEqual(loop_test(10), 285)
+
+        with self.assertRaises(gccjit.Error):
+            ctxt.replay(recording)
+        with self.assertRaises(gccjit.Error):
+            gccjit.Context().replay(recording[:-10])
+        import array, marshal, sys
+        bad_opcode = marshal.dumps((marshal.loads(recording)[0],
+                                    sys.byteorder, 0,
+                                    array.array('q', [1000, -1]).tobytes(),
+                                    []))
+        with self.assertRaises(gccjit.Error):
+            gccjit.Context().replay(bad_opcode)
+        for num_objects in (-1, 2 ** 61, 1 << 40, 'many'):
+            bad_count = marshal.dumps((marshal.loads(recording)[0],
+                                       sys.byteorder, num_objects,
+                                       marshal.loads(recording)[3], []))
+            with self.assertRaises(gccjit.Error):
+                gccjit.Context().replay(bad_count)
+
+        # Each id must refer to an object of the kind that its use needs.
+        ctxt = gccjit.Context()
+        ctxt.start_recording()
+        int_type = ctxt.get_type(gccjit.TypeKind.INT)
+        ctxt.new_function(gccjit.FunctionKind.EXPORTED, int_type, b'f', [])
+        ctxt.new_rvalue_from_int(int_type, 42)
+        version, byteorder, num_objects, code_bytes, strings = \
+            marshal.loads(ctxt.get_recording())
+        codes = array.array('q', code_bytes)
+        # The last call: new_rvalue_from_int, on the context (-1), of
+        # the int type (0).
+        self.assertEqual(list(codes[-3:]), [-1, 0, 42])
+        for index, id_ in ((-2, 1), (-3, 0)):
+            # The function as a type, or a call on the type rather than
+            # the context.
+            bad_codes = array.array('q', codes)
+            bad_codes[index] = id_
+            bad_kind = marshal.dumps((version, byteorder, num_objects,
+                                      bad_codes.tobytes(), strings))
+            with self.assertRaises(gccjit.Error):
+                gccjit.Context().replay(bad_kind)
+
+        # Options are replayed into the context's own record of them.
+        fingerprints = []
+        for opt_level in (0, 3):
+            original = gccjit.Context()
+            original.set_int_option(gccjit.IntOption.OPTIMIZATION_LEVEL,
+                                    opt_level)
+            original.start_recording()
+            populate_ctxt(original)
+            replayed = gccjit.Context()
+            replayed.replay(original.get_recording())
+            self.assertEqual(replayed.get_fingerprint(),
+                             original.get_fingerprint())
+            fingerprints.append(replayed.get_fingerprint())
+            result = replayed.compile(stats=True)
+            self.assertEqual(result.stats.opt_level, opt_level)
+        self.assertNotEqual(fingerprints[0], fingerprints[1])
+
+        # The element types of map functions are recorded too.
+        ctxt = gccjit.Context()
+        ctxt.start_recording()
+        ctxt.set_map_formats(b'square_all', 'i', None)
+        replayed = gccjit.Context()
+        replayed.replay(ctxt.get_recording())
+        self.assertEqual(replayed.get_map_formats(),
+                         {b'square_all': ('i', None)})
+
+        # Objects created before recording started can't be referred to.
+        ctxt = gccjit.Context()
+        ctxt.get_type(gccjit.TypeKind.INT)
+        with self.assertRaises(gccjit.Error):
+            ctxt.start_recording()
+        with self.assertRaises(gccjit.Error):
+            ctxt.get_recording()
+
+    def test_farm(self):
+        from examples.sum_of_squares import populate_ctxt
+        from gccjit import farm
+        recordings = []
+        for i in range(3):
+            ctxt = gccjit.Context()
+            ctxt.start_recording()
+            int_type = ctxt.get_type(gccjit.TypeKind.INT)
+            param_x = ctxt.new_param(int_type, b'x')
+            fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                                   int_type, b'add', [param_x])
+            fn.new_block().end_with_return(
+                ctxt.new_binary_op(gccjit.BinaryOp.PLUS, int_type, param_x,
+                                   ctxt.new_rvalue_from_int(int_type, i)))
+            recordings.append(ctxt.get_recording())
+        ctxt = gccjit.Context()
+        ctxt.start_recording()
+        populate_ctxt(ctxt)
+        recordings.append(ctxt.get_recording())
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        with farm.Farm(max_workers=2, directory=directory) as f:
+            results = f.compile_many(recordings)
+            for i in range(3):
+                add = results[i].get_function(b'add', gccjit.TypeKind.INT,
+                                              [gccjit.TypeKind.INT])
+                self.assertEqual(add(10), 10 + i)
+            loop_test = results[3].get_function(b'loop_test',
+                                                gccjit.TypeKind.INT,
+                                                [gccjit.TypeKind.INT])
+            self.assertEqual(loop_test(10), 285)
+
+            # An error within a worker is raised in the parent.
+            ctxt = gccjit.Context()
+            ctxt.start_recording()
+            int_type = ctxt.get_type(gccjit.TypeKind.INT)
+            fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                                   int_type, b'unterminated', [])
+            fn.new_block()
+            with self.assertRaises(gccjit.Error):
+                f.submit(ctxt.get_recording()).result()
+
+            # The libraries are removed whether or not they were loaded.
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_bundle(self):
+        from examples.sum_of_squares import populate_ctxt
+        from gccjit import bundle
+        b = bundle.Bundle()
+        for i in range(3):
+            ctxt = gccjit.Context()
+            int_type = ctxt.get_type(gccjit.TypeKind.INT)
+            param_x = ctxt.new_param(int_type, b'x')
+            fn = ctxt.new_function(gccjit.FunctionKind.EXPORTED,
+                                   int_type, b'add_%i' % i, [param_x])
+            fn.new_block().end_with_return(
+                ctxt.new_binary_op(gccjit.BinaryOp.PLUS, int_type, param_x,
+                                   ctxt.new_rvalue_from_int(int_type, i)))
+            b.add(ctxt, {b'add_%i' % i: (gccjit.TypeKind.INT,
+                                         [gccjit.TypeKind.INT])})
+        ctxt = gccjit.Context()
+        populate_ctxt(ctxt)
+        b.add(ctxt, {b'loop_test': (gccjit.TypeKind.INT,
+                                    [gccjit.TypeKind.INT])})
+        with self.assertRaises(ValueError):
+            b.add(gccjit.Context(), {b'add_0': (gccjit.TypeKind.INT, [])})
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'kernels.so')
+            b.write(path)
+            # Nothing is left behind under a temporary name.
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ['kernels.so', 'kernels.so.json'])
+            with bundle.load(path) as result:
+                for i in range(3):
+                    self.assertEqual(result.get_function(b'add_%i' % i)(10),
+                                     10 + i)
+                self.assertEqual(result.get_function(b'loop_test')(10), 285)
+                with self.assertRaises(gccjit.Error):
+                    result.get_function(b'missing')
+                self.assertEqual(result.get_global(b'missing'), 0)
+                self.assertEqual(result.get_profile(), {})
+
+            # A library that doesn't match its manifest isn't loaded.
+            with open(path, 'ab') as f:
+                f.write(b'\0')
+            with self.assertRaises(gccjit.Error):
+                bundle.load(path)
+        finally:
+            import shutil
+            shutil.rmtree(tmpdir)
+
     def test_union(self):
         ctxt = gccjit.Context()
         int_type = ctxt.get_type(gccjit.TypeKind.INT)
@@ -158,6 +1112,69 @@ class JitTests(unittest.TestCase):
         c.parse_into_ctxt(b'examples/emit-alphabet.bf')
         c.run()
 
+    def test_bf_optimized_aot(self):
+        from examples import bf
+        from subprocess import Popen, PIPE
+        import shutil
+        c = bf.Compiler(optimize=True)
+        c.parse_into_ctxt(b'examples/emit-alphabet.bf')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            exe = os.path.join(tmpdir, 'emit-alphabet-optimized.exe')
+            c.compile_to_file(os.fsencode(exe))
+            p = Popen([exe], stdout=PIPE)
+            out, err = p.communicate()
+            self.assertEqual(out, b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_bf_optimizer(self):
+        from examples import bf
+        c = bf.Compiler(optimize=True)
+        c.filename = b'test.bf'
+        c.line = 1
+        c.column = 0
+        ops = c.parse_ops(c.tokenize(['+++[-]>[->+>++<<]<+-']))
+        self.assertEqual([op[0] for op in ops],
+                         ['set', 'move', 'mul', 'mul', 'set', 'move'])
+        self.assertEqual(ops[2][2:], (0, 1, 1))
+        self.assertEqual(ops[3][2:], (0, 2, 2))
+        with self.assertRaises(bf.CompileError):
+            c.parse_ops(c.tokenize([']']))
+
+    def test_bf_tokenize_chunks(self):
+        from examples import bf
+        def positions(chunks):
+            c = bf.Compiler()
+            c.line = 1
+            c.column = 0
+            return [(ch, line, column + i)
+                    for run, line, column in c.tokenize(chunks)
+                    for i, ch in enumerate(run)]
+        src = 'a ++\n>>[-.\n\n  x<<]\n+'
+        expected = positions([src])
+        self.assertEqual(expected[0], ('+', 1, 2))
+        self.assertEqual(expected[-1], ('+', 5, 0))
+        for size in range(1, len(src)):
+            chunks = [src[i:i + size] for i in range(0, len(src), size)]
+            self.assertEqual(positions(chunks), expected)
+
+    def test_benchmark_suite(self):
+        import json
+        from benchmarks import suite
+        results = json.loads(json.dumps(suite.run(quick=True)))
+        self.assertTrue(results['quick'])
+        benchmarks = results['benchmarks']
+        for name in ('object_creation.rvalue_get_type',
+                     'object_creation.new_rvalue_from_int',
+                     'ir_build.statements',
+                     'ir_build.add_statements',
+                     'compile.O0', 'compile.O3',
+                     'result.get_code',
+                     'call.get_function'):
+            self.assertIn(name, benchmarks)
+            self.assertGreaterEqual(benchmarks[name]['seconds'], 0.0)
+
     def test_dump_reproducer(self):
         from examples.sum_of_squares import populate_ctxt
         ctxt = gccjit.Context()
@@ -183,6 +1200,39 @@ class JitTests(unittest.TestCase):
                 self.assertIn('JIT: ', logtxt)
                 self.assertIn('entering: gcc_jit_context_get_type', logtxt)
 
+    def test_set_logfile_ownership(self):
+        from examples.sum_of_squares import populate_ctxt
+        def count_fds():
+            return len(os.listdir('/proc/self/fd'))
+        with tempfile.TemporaryFile() as f:
+            before = count_fds()
+            for i in range(50):
+                ctxt = gccjit.Context()
+                ctxt.set_logfile(f)
+                populate_ctxt(ctxt)
+                result = ctxt.compile()
+                del ctxt
+                # The result still logs to the file.
+                result.get_code(b'loop_test')
+                del result
+            self.assertEqual(count_fds(), before)
+            # The file itself is still open.
+            f.seek(0)
+            self.assertIn(b'gcc_jit_result_get_code', f.read())
+
+    def test_get_log(self):
+        from examples.sum_of_squares import populate_ctxt
+        ctxt = gccjit.Context()
+        self.assertIsNone(ctxt.get_log())
+        ctxt.capture_log()
+        populate_ctxt(ctxt)
+        ctxt.compile()
+        log = ctxt.get_log()
+        self.assertIn(b'JIT: ', log)
+        self.assertIn(b'entering: gcc_jit_context_get_type', log)
+        ctxt.set_logfile(None)
+        self.assertIsNone(ctxt.get_log())
+
 class ErrorTests(unittest.TestCase):
     def test_get_type_error(self):
         ctxt = gccjit.Context()
@@ -218,5 +1268,18 @@ class ErrorTests(unittest.TestCase):
                          (b'gcc_jit_function_new_block:'
                           b' cannot add block to an imported function'))
 
+    def test_compile_async_error(self):
+        import asyncio
+        ctxt = gccjit.Context()
+        with self.assertRaises(gccjit.Error):
+            ctxt.get_type(-1)
+        async def compile_it():
+            return await ctxt.compile_async()
+        with self.assertRaises(gccjit.Error) as cm:
+            asyncio.run(compile_it())
+        self.assertEqual(cm.exception.msg,
+                         (b'gcc_jit_context_get_type:'
+                          b' unrecognized value for enum gcc_jit_types: -1'))
+
 if __name__ == '__main__':
     unittest.main()